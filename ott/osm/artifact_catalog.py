@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import time
+import sqlite3
+
+from .stats.osm_info import OsmInfo
+
+import logging
+log = logging.getLogger(__file__)
+
+
+class ArtifactCatalog(object):
+    """
+    Persistent (sqlite) catalog of the files in the osm cache: each artifact's path, size, mtime, sha1, the step
+    that made it, the artifacts it was made from (its inputs) and its stats json ... so questions like 'the latest
+    stats of or-wa.osm' or 'what's made from or-wa.osm.pbf' are an indexed query, rather than globbing the cache
+    directory and opening -stats files
+
+    :example:
+        with ArtifactCatalog("cache/artifacts.db") as catalog:
+            catalog.record("cache/or-wa.osm.pbf", "osm_to_pbf", inputs=["cache/or-wa.osm"])
+            catalog.latest_stats("or-wa.osm")
+            catalog.outputs_of("cache/or-wa.osm", recursive=True)
+    """
+    def __init__(self, catalog_path):
+        self.catalog_path = catalog_path
+        self.db = sqlite3.connect(catalog_path)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("CREATE TABLE IF NOT EXISTS artifacts (path TEXT PRIMARY KEY, name TEXT, size INTEGER, "
+                        "mtime REAL, sha1 TEXT, step TEXT, stats TEXT, recorded REAL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS artifacts_name ON artifacts (name)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS inputs (path TEXT, input TEXT, PRIMARY KEY (path, input))")
+        self.db.execute("CREATE INDEX IF NOT EXISTS inputs_input ON inputs (input)")
+        self.db.commit()
+
+    @classmethod
+    def key(cls, path):
+        return os.path.abspath(path)
+
+    @classmethod
+    def to_dict(cls, row):
+        ret_val = None
+        if row is not None:
+            ret_val = dict(row)
+            ret_val['stats'] = json.loads(ret_val['stats']) if ret_val['stats'] else None
+        return ret_val
+
+    def record(self, path, step=None, inputs=(), stats=None, use_hash=False):
+        """ add (or update) an artifact ... the inputs replace any it had before
+            :param stats: dict (json) of the artifact's stats ... None keeps any stats it already has
+            :param use_hash: add the file's sha1 (re-using the sha1 already in the catalog when the file hasn't changed)
+            :return True if recorded ... False if the file doesn't exist
+        """
+        if not os.path.exists(path):
+            log.debug("not cataloging {}, since it doesn't exist".format(path))
+            return False
+
+        key = self.key(path)
+        old = self.get(key)
+        file_key = OsmInfo.get_file_key(path)
+        sha1 = None
+        if old and old['size'] == file_key['size'] and old['mtime'] == file_key['mtime']:
+            sha1 = old['sha1']
+        if use_hash and sha1 is None:
+            sha1 = OsmInfo.file_sha1(path)
+        if stats is None and old:
+            stats = old['stats']
+
+        self.db.execute("INSERT OR REPLACE INTO artifacts (path, name, size, mtime, sha1, step, stats, recorded) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (key, os.path.basename(path), file_key['size'], file_key['mtime'], sha1, step,
+                         json.dumps(stats) if stats is not None else None, time.time()))
+        self.db.execute("DELETE FROM inputs WHERE path = ?", (key,))
+        self.db.executemany("INSERT OR REPLACE INTO inputs (path, input) VALUES (?, ?)", ((key, self.key(i)) for i in inputs))
+        self.db.commit()
+        return True
+
+    def get(self, path):
+        """ :return dict of an artifact's row (with its stats json parsed) ... None if it isn't in the catalog """
+        return self.to_dict(self.db.execute("SELECT * FROM artifacts WHERE path = ?", (self.key(path),)).fetchone())
+
+    def is_current(self, path):
+        """ True if the file is in the catalog with its current size and mtime """
+        row = self.get(path)
+        return row is not None and os.path.exists(path) and \
+            (row['size'], row['mtime']) == (os.path.getsize(path), os.path.getmtime(path))
+
+    def latest(self, name):
+        """ :return dict of the newest (mtime) artifact with this file name (e.g., 'or-wa.osm'), in any directory """
+        return self.to_dict(self.db.execute("SELECT * FROM artifacts WHERE name = ? ORDER BY mtime DESC LIMIT 1", (name,)).fetchone())
+
+    def latest_stats(self, name):
+        """ :return stats of the newest artifact with this file name that has stats ... None if there aren't any """
+        row = self.db.execute("SELECT stats FROM artifacts WHERE name = ? AND stats IS NOT NULL ORDER BY mtime DESC LIMIT 1", (name,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def inputs_of(self, path):
+        """ :return paths of the artifacts an artifact was made from """
+        return [r[0] for r in self.db.execute("SELECT input FROM inputs WHERE path = ? ORDER BY input", (self.key(path),))]
+
+    def outputs_of(self, path, recursive=False):
+        """ :return paths of the artifacts made from an artifact ... recursive adds everything made from those, etc. """
+        if recursive:
+            sql = "WITH RECURSIVE made(path) AS (SELECT path FROM inputs WHERE input = ? " \
+                  "UNION SELECT i.path FROM inputs i JOIN made m ON i.input = m.path) SELECT path FROM made ORDER BY path"
+        else:
+            sql = "SELECT path FROM inputs WHERE input = ? ORDER BY path"
+        return [r[0] for r in self.db.execute(sql, (self.key(path),))]
+
+    def artifacts(self, step=None):
+        """ :return list of the dicts of all the artifacts (or just those made by step) """
+        if step:
+            rows = self.db.execute("SELECT * FROM artifacts WHERE step = ? ORDER BY path", (step,))
+        else:
+            rows = self.db.execute("SELECT * FROM artifacts ORDER BY path")
+        return [self.to_dict(r) for r in rows]
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
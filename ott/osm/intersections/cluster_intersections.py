@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+import math
+import itertools
+
+from .intersection_index import distance
+
+import logging
+log = logging.getLogger(__file__)
+
+
+DEFAULT_CLUSTER_DISTANCE = 150.0  # meters ... e.g., the two nodes where a street crosses a divided road
+METERS_PER_DEGREE = 111320.0
+
+
+def cluster_intersections(nodes, max_distance=DEFAULT_CLUSTER_DISTANCE):
+    """
+    combine the nodes of each street pair -- in either name order, e.g. (A, B) and (B, A) -- that are within
+    max_distance of one another into a single intersection, at the centroid of its nodes
+
+    nodes are hashed into a fixed grid of max_distance sized cells (per street pair), so each node is only compared to
+    the clusters in its own and neighboring cells ... linear time.  street pairs that are far apart (e.g., a Main St &
+    1st Ave in two towns) stay separate intersections.  a cluster is filed under the cell of its centroid, and moves
+    to another cell when its centroid does, so a chain of nodes that drifts across cells stays one cluster.
+
+    :param nodes: (names, 'lat,lon') of the intersection nodes (see intersection_nodes)
+    :return list of ((street, cross street), 'lat,lon') ... in the name order, and the order, that each was first seen
+    """
+    cell_size = max_distance / METERS_PER_DEGREE
+    clusters = []  # [names, sum of lats, sum of lons, number of nodes, grid cell of the centroid]
+    grid = {}      # (street pair, row, col) -> list of cluster indexes
+    num_nodes = 0
+
+    for names, coordinate in nodes:
+        lat, lon = (float(c) for c in coordinate.split(','))
+        row, col = int(lat // cell_size), int(lon // cell_size)
+        num_cols = int(math.ceil(1.0 / max(math.cos(math.radians(lat)), 0.01)))  # lon cells are narrower than lat cells
+        num_nodes += 1
+
+        for pair in itertools.combinations(names, 2):
+            key = tuple(sorted(pair))
+            best = None
+            best_distance = max_distance
+            for r in range(row - 1, row + 2):
+                for c in range(col - num_cols, col + num_cols + 1):
+                    for i in grid.get((key, r, c), ()):
+                        cluster = clusters[i]
+                        d = distance(lat, lon, cluster[1] / cluster[3], cluster[2] / cluster[3])
+                        if d <= best_distance:
+                            best, best_distance = i, d
+
+            if best is None:
+                cell = (key, row, col)
+                grid.setdefault(cell, []).append(len(clusters))
+                clusters.append([pair, lat, lon, 1, cell])
+            else:
+                cluster = clusters[best]
+                cluster[1] += lat
+                cluster[2] += lon
+                cluster[3] += 1
+                cell = (key, int(cluster[1] / cluster[3] // cell_size), int(cluster[2] / cluster[3] // cell_size))
+                if cell != cluster[4]:
+                    grid[cluster[4]].remove(best)
+                    if not grid[cluster[4]]:
+                        del grid[cluster[4]]
+                    grid.setdefault(cell, []).append(best)
+                    cluster[4] = cell
+
+    log.info("clustered {} intersection nodes into {} intersections".format(num_nodes, len(clusters)))
+    return [(c[0], "{:.7f},{:.7f}".format(c[1] / c[3], c[2] / c[3])) for c in clusters]
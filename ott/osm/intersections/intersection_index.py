@@ -0,0 +1,339 @@
+# -*- coding: utf-8 -*-
+"""
+spatial and street name index of the intersections from extract_intersections(), for local 'X & Y' and nearby queries
+
+:example:
+    index = IntersectionIndex.from_intersections(extract_intersections("portland.osm"))
+    index.save("intersections.idx")
+    index = IntersectionIndex.load("intersections.idx")  # mmap'd, so loading is instant
+    index.lookup("NE Century", "NE Cherry")
+    index.nearest(45.52, -122.68, k=5)
+    index.within_bbox(45.54, 45.45, -122.70, -122.62)
+"""
+import re
+import math
+import mmap
+import bisect
+import struct
+from array import array
+
+from .osm_to_intersections import intersection_items
+
+import logging
+log = logging.getLogger(__file__)
+
+
+MAGIC = b"OTTINTX1"
+HEADER = struct.Struct("<8sdqqqq")  # magic, cell size, number of records, names, cells, and name bytes
+DEFAULT_CELL_SIZE = 0.005  # degrees (~500 meters)
+EARTH_RADIUS = 6371008.8  # meters
+NEAREST_MAX_RINGS = 64  # nearest() scans all the records, rather than search more than this many rings of cells
+
+NON_WORD_RE = re.compile(r"[^\w\s]", re.UNICODE)
+
+
+def normalize_name(name):
+    """ street name key: lower case, no punctuation, single spaces ... e.g., 'N.E. Century  Blvd' is 'ne century blvd' """
+    return " ".join(NON_WORD_RE.sub("", name.lower()).split())
+
+
+def distance(lat1, lon1, lat2, lon2):
+    """ haversine distance in meters """
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+
+class NameTable(object):
+    """ read-only sequence of the (utf-8 encoded) names in a byte blob, via an array of their offsets """
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return bytes(self.blob[self.offsets[i]:self.offsets[i + 1]]).decode('utf-8')
+
+
+class NormalizedNames(object):
+    """ sequence of the normalized names (for bisect) ... the name table is sorted on them """
+    def __init__(self, names):
+        self.names = names
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, i):
+        return normalize_name(self.names[i])
+
+
+class IntersectionIndex(object):
+    """ intersections (street, cross street, lat, lon) with a grid spatial index and a street name pair index
+
+        everything is kept in flat arrays, so an index can be saved to a file and memory-mapped back in (load), with
+        nothing to parse:
+          - records are sorted by grid cell (row major), so each cell -- and each row of cells in a bbox -- is one
+            contiguous run of records, found with a binary search of the sorted cell keys
+          - street names are sorted on their normalized form, and each record's (street, cross street) name ids are
+            combined into a pair key (smaller id first, so 'A & B' and 'B & A' match), with a sorted pair key array
+    """
+    def __init__(self, cell_size, lats, lons, streets, cross_streets, cell_keys, cell_starts, pair_keys, pair_records, names):
+        self.cell_size = cell_size
+        self.num_cols = int(math.ceil(360.0 / cell_size))
+        self.lats = lats
+        self.lons = lons
+        self.streets = streets
+        self.cross_streets = cross_streets
+        self.cell_keys = cell_keys
+        self.cell_starts = cell_starts
+        self.pair_keys = pair_keys
+        self.pair_records = pair_records
+        self.names = names
+        self.normalized_names = NormalizedNames(names)
+        self.extent = None
+        self.mm = None
+        self.views = []
+
+    def __len__(self):
+        return len(self.lats)
+
+    @classmethod
+    def from_intersections(cls, intersections, cell_size=DEFAULT_CELL_SIZE):
+        """ build an index from the {(street, cross street): 'lat,lon'} dict of extract_intersections()
+            (or the list of ((street, cross street), 'lat,lon') from cluster_intersections)
+        """
+        records = []
+        for names, coord in intersection_items(intersections):
+            try:
+                lat, lon = (float(c) for c in coord.split(','))
+                records.append((names[0], names[1], lat, lon))
+            except Exception as e:
+                log.debug("skipping intersection {} {}: {}".format(names, coord, e))
+
+        name_list = sorted(set(n for r in records for n in r[:2]), key=lambda n: (normalize_name(n), n))
+        name_ids = dict((n, i) for i, n in enumerate(name_list))
+
+        cell_key = cls.cell_key_func(cell_size)
+        records.sort(key=lambda r: cell_key(r[2], r[3]))
+
+        lats = array('d', (r[2] for r in records))
+        lons = array('d', (r[3] for r in records))
+        streets = array('q', (name_ids[r[0]] for r in records))
+        cross_streets = array('q', (name_ids[r[1]] for r in records))
+
+        cell_keys = array('q')
+        cell_starts = array('q')
+        for i, r in enumerate(records):
+            k = cell_key(r[2], r[3])
+            if len(cell_keys) == 0 or cell_keys[-1] != k:
+                cell_keys.append(k)
+                cell_starts.append(i)
+        cell_starts.append(len(records))
+
+        pairs = sorted((cls.pair_key(streets[i], cross_streets[i]), i) for i in range(len(records)))
+        pair_keys = array('q', (p[0] for p in pairs))
+        pair_records = array('q', (p[1] for p in pairs))
+
+        blob = bytearray()
+        offsets = array('q', [0])
+        for n in name_list:
+            blob += n.encode('utf-8')
+            offsets.append(len(blob))
+
+        return cls(cell_size, lats, lons, streets, cross_streets, cell_keys, cell_starts, pair_keys, pair_records, NameTable(bytes(blob), offsets))
+
+    @classmethod
+    def cell_key_func(cls, cell_size):
+        num_cols = int(math.ceil(360.0 / cell_size))
+
+        def cell_key(lat, lon):
+            return int((lat + 90.0) // cell_size) * num_cols + int((lon + 180.0) // cell_size)
+        return cell_key
+
+    @classmethod
+    def pair_key(cls, a, b):
+        return (min(a, b) << 32) | max(a, b)
+
+    def record(self, i):
+        """ :return dict of intersection record i (same fields as intersection_tuple_to_record) """
+        street = self.names[self.streets[i]]
+        cross_street = self.names[self.cross_streets[i]]
+        return {
+            'name': "{} & {}".format(street, cross_street),
+            'street': street,
+            'cross_street': cross_street,
+            'lat': self.lats[i],
+            'lon': self.lons[i],
+        }
+
+    def find_names(self, name):
+        """ :return ids of the street names that match name (normalized) ... or, failing that, that start with it
+                    as whole words (so 'NE Century' finds 'NE Century Blvd')
+        """
+        key = normalize_name(name)
+        exact = []
+        ret_val = []
+        i = bisect.bisect_left(self.normalized_names, key)
+        while i < len(self.names):
+            n = self.normalized_names[i]
+            if not n.startswith(key):
+                break
+            if len(n) == len(key):
+                exact.append(i)
+            elif n[len(key)] == ' ':
+                ret_val.append(i)
+            i += 1
+        return exact or ret_val
+
+    def lookup(self, street, cross_street):
+        """ :return list of the intersection records of street & cross street (in either order) """
+        ret_val = []
+        for a in self.find_names(street):
+            for b in self.find_names(cross_street):
+                key = self.pair_key(a, b)
+                i = bisect.bisect_left(self.pair_keys, key)
+                while i < len(self.pair_keys) and self.pair_keys[i] == key:
+                    ret_val.append(self.record(self.pair_records[i]))
+                    i += 1
+        return ret_val
+
+    def cell_range(self, row, col_start, col_end):
+        """ :return (start, end) record range of a row's cells from col_start to col_end (inclusive) """
+        start = bisect.bisect_left(self.cell_keys, row * self.num_cols + col_start)
+        end = bisect.bisect_right(self.cell_keys, row * self.num_cols + col_end)
+        return self.cell_starts[start], self.cell_starts[end]
+
+    def within_bbox(self, top, bottom, left, right):
+        """ :return list of the intersection records within the bbox (same top, bottom, left, right order as config) """
+        ret_val = []
+        cs = self.cell_size
+        col_start, col_end = int((left + 180.0) // cs), int((right + 180.0) // cs)
+        for row in range(int((bottom + 90.0) // cs), int((top + 90.0) // cs) + 1):
+            start, end = self.cell_range(row, col_start, col_end)
+            for i in range(start, end):
+                if bottom <= self.lats[i] <= top and left <= self.lons[i] <= right:
+                    ret_val.append(self.record(i))
+        return ret_val
+
+    def cell_extent(self):
+        """ :return (min row, max row, min col, max col) of the cells with records ... None when there aren't any """
+        if self.extent is None and len(self.cell_keys) > 0:
+            cols = [key % self.num_cols for key in self.cell_keys]
+            self.extent = self.cell_keys[0] // self.num_cols, self.cell_keys[-1] // self.num_cols, min(cols), max(cols)
+        return self.extent
+
+    def nearest(self, lat, lon, k=1):
+        """ :return list of the k nearest intersection records (nearest first), each with a 'distance' in meters
+
+            searches rings of grid cells out from lat, lon, until the k-th nearest is closer than any unsearched cell
+            ... the rings stop at the cells that have records, and when those are more than NEAREST_MAX_RINGS rings
+            away (e.g., a point outside the index's region), all the records are scanned instead
+        """
+        found = []
+        extent = self.cell_extent()
+        if extent is None:
+            return found
+
+        cs = self.cell_size
+        row, col = int((lat + 90.0) // cs), int((lon + 180.0) // cs)
+        min_row, max_row, min_col, max_col = extent
+        last_ring = max(abs(row - min_row), abs(row - max_row), abs(col - min_col), abs(col - max_col))
+        is_searched = False
+        for ring in range(min(last_ring, NEAREST_MAX_RINGS) + 1):
+            for r in range(max(row - ring, min_row), min(row + ring, max_row) + 1):
+                if abs(r - row) == ring:
+                    ranges = [(max(col - ring, min_col), min(col + ring, max_col))]
+                else:
+                    ranges = [(col - ring, col - ring), (col + ring, col + ring)]
+                for col_start, col_end in ranges:
+                    if col_start > col_end or col_end < min_col or col_start > max_col:
+                        continue
+                    start, end = self.cell_range(r, col_start, col_end)
+                    for i in range(start, end):
+                        found.append((distance(lat, lon, self.lats[i], self.lons[i]), i))
+
+            if len(found) == len(self):
+                is_searched = True
+                break
+            if len(found) >= k:
+                found.sort()
+                # anything outside the searched rings is at least ring cells away (cells are narrower than they are tall)
+                if found[k - 1][0] <= ring * math.radians(cs) * EARTH_RADIUS * math.cos(math.radians(lat)):
+                    is_searched = True
+                    break
+
+        if not is_searched:
+            found = [(distance(lat, lon, self.lats[i], self.lons[i]), i) for i in range(len(self))]
+
+        found.sort()
+        ret_val = []
+        for d, i in found[:k]:
+            rec = self.record(i)
+            rec['distance'] = round(d, 1)
+            ret_val.append(rec)
+        return ret_val
+
+    def close(self):
+        """ release the memory-mapped file of a load()'ed index ... the index can't be used after it's closed """
+        if self.mm is not None:
+            for v in reversed(self.views):
+                v.release()
+            self.views = []
+            self.mm.close()
+            self.mm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def save(self, path):
+        """ write the index to a file (native byte order ... see load) """
+        names_blob = self.names.blob
+        with open(path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, self.cell_size, len(self), len(self.names), len(self.cell_keys), len(names_blob)))
+            for a in (self.lats, self.lons, self.streets, self.cross_streets, self.cell_keys, self.cell_starts,
+                      self.pair_keys, self.pair_records, self.names.offsets):
+                f.write(a.tobytes() if isinstance(a, array) else bytes(a))
+            f.write(names_blob)
+
+    @classmethod
+    def load(cls, path):
+        """ memory-map an index file written by save() ... the arrays are views of the file, so nothing is read up front """
+        with open(path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, cell_size, num_records, num_names, num_cells, blob_size = HEADER.unpack_from(mm, 0)
+        if magic != MAGIC:
+            mm.close()
+            raise ValueError("{} isn't an intersection index file".format(path))
+
+        view = memoryview(mm)
+        views = [view]
+        pos = [HEADER.size]
+
+        def take(fmt, count):
+            size = count * 8
+            ret_val = view[pos[0]:pos[0] + size].cast(fmt)
+            views.append(ret_val)
+            pos[0] += size
+            return ret_val
+
+        lats = take('d', num_records)
+        lons = take('d', num_records)
+        streets = take('q', num_records)
+        cross_streets = take('q', num_records)
+        cell_keys = take('q', num_cells)
+        cell_starts = take('q', num_cells + 1)
+        pair_keys = take('q', num_records)
+        pair_records = take('q', num_records)
+        offsets = take('q', num_names + 1)
+        names = NameTable(view[pos[0]:pos[0] + blob_size], offsets)
+        views.append(names.blob)
+
+        ret_val = cls(cell_size, lats, lons, streets, cross_streets, cell_keys, cell_starts, pair_keys, pair_records, names)
+        ret_val.mm = mm
+        ret_val.views = views
+        return ret_val
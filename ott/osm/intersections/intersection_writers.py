@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+intersection record writers (and readers), picked by output file extension:
+  .csv, .csv.gz         -- pelias .csv (optionally gzip'd)
+  .ndjson, .ndjson.gz   -- newline delimited json (also .jsonl)
+  .parquet              -- parquet (needs pyarrow)
+  .arrow, .feather      -- arrow ipc file (needs pyarrow)
+
+:example:
+    with get_writer("intersection.parquet") as w:
+        w.write_rows(records)
+"""
+import io
+import csv
+import gzip
+import json
+
+import logging
+log = logging.getLogger(__file__)
+
+
+FIELDS = ['id', 'name', 'street', 'cross_street', 'address', 'zipcode', 'lon', 'lat', 'layer_id', 'source']
+FLOAT_FIELDS = ('lon', 'lat')
+
+
+def split_ext(path):
+    """ :return (base, ext) of a path, where .gz stays with the ext before it ... e.g., ('intersection', '.csv.gz') """
+    gz = ''
+    if path.endswith('.gz'):
+        path, gz = path[:-3], '.gz'
+    i = path.rfind('.')
+    if i < 0 or '/' in path[i:]:
+        return path, gz
+    return path[:i], path[i:] + gz
+
+
+def open_text(path, mode):
+    """ open a (utf-8) text file ... gzip'd when it ends in .gz """
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8', newline='')
+    return io.open(path, mode, encoding='utf-8', newline='')
+
+
+class IntersectionWriter(object):
+    """ base writer: rows (dicts of FIELDS) are buffered and written batch_size at a time (see write_batch) """
+    batch_size = 10000
+
+    def __init__(self, path):
+        self.path = path
+        self.batch = []
+        self.num_rows = 0
+
+    def write_row(self, row):
+        self.batch.append(row)
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def write_rows(self, rows):
+        for row in rows:
+            self.write_row(row)
+
+    def flush(self):
+        if self.batch:
+            self.write_batch(self.batch)
+            self.num_rows += len(self.batch)
+            self.batch = []
+
+    def write_batch(self, rows):
+        raise NotImplementedError
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @classmethod
+    def read(cls, path):
+        """ generator of the rows (dicts) of a file written by this writer """
+        raise NotImplementedError
+
+
+class CsvWriter(IntersectionWriter):
+    def __init__(self, path):
+        super(CsvWriter, self).__init__(path)
+        self.file = open_text(path, 'w')
+        self.writer = csv.DictWriter(self.file, fieldnames=FIELDS)
+        self.writer.writeheader()
+
+    def write_batch(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        super(CsvWriter, self).close()
+        self.file.close()
+
+    @classmethod
+    def read(cls, path):
+        with open_text(path, 'r') as f:
+            for row in csv.DictReader(f):
+                yield row
+
+
+class NdjsonWriter(IntersectionWriter):
+    def __init__(self, path):
+        super(NdjsonWriter, self).__init__(path)
+        self.file = open_text(path, 'w')
+
+    def write_batch(self, rows):
+        self.file.write("".join(json.dumps(dict((k, r.get(k)) for k in FIELDS), ensure_ascii=False) + "\n" for r in rows))
+
+    def close(self):
+        super(NdjsonWriter, self).close()
+        self.file.close()
+
+    @classmethod
+    def read(cls, path):
+        with open_text(path, 'r') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+class ArrowWriter(IntersectionWriter):
+    """ arrow ipc file ... columns are strings, except for lon and lat (float64) """
+    def __init__(self, path):
+        super(ArrowWriter, self).__init__(path)
+        import pyarrow as pa
+        self.pa = pa
+        self.schema = pa.schema([(k, pa.float64() if k in FLOAT_FIELDS else pa.string()) for k in FIELDS])
+        self.writer = self.open_writer()
+
+    def open_writer(self):
+        return self.pa.ipc.new_file(self.path, self.schema)
+
+    def write_batch(self, rows):
+        columns = []
+        for k in FIELDS:
+            if k in FLOAT_FIELDS:
+                columns.append([r.get(k) for r in rows])
+            else:
+                columns.append([None if r.get(k) is None else str(r.get(k)) for r in rows])
+        self.writer.write_batch(self.pa.record_batch(columns, schema=self.schema))
+
+    def close(self):
+        super(ArrowWriter, self).close()
+        self.writer.close()
+
+    @classmethod
+    def read_table(cls, path):
+        import pyarrow as pa
+        with pa.memory_map(path) as source:
+            return pa.ipc.open_file(source).read_all()
+
+    @classmethod
+    def read(cls, path):
+        for row in cls.read_table(path).to_pylist():
+            yield row
+
+
+class ParquetWriter(ArrowWriter):
+    def open_writer(self):
+        import pyarrow.parquet as pq
+        return pq.ParquetWriter(self.path, self.schema)
+
+    @classmethod
+    def read_table(cls, path):
+        import pyarrow.parquet as pq
+        return pq.read_table(path)
+
+
+WRITERS = {
+    '.csv': CsvWriter,
+    '.csv.gz': CsvWriter,
+    '.ndjson': NdjsonWriter,
+    '.ndjson.gz': NdjsonWriter,
+    '.jsonl': NdjsonWriter,
+    '.jsonl.gz': NdjsonWriter,
+    '.parquet': ParquetWriter,
+    '.arrow': ArrowWriter,
+    '.feather': ArrowWriter,
+}
+
+
+def writer_class(path):
+    """ :return the writer class for a path's extension (.csv for unknown extensions, same as always) """
+    ret_val = WRITERS.get(split_ext(path)[1].lower())
+    if ret_val is None:
+        log.info("no writer for {}'s extension, so writing .csv".format(path))
+        ret_val = CsvWriter
+    return ret_val
+
+
+def get_writer(path):
+    return writer_class(path)(path)
+
+
+def write_records(records, path):
+    """ :return number of records written to path (in the format of its extension) """
+    with get_writer(path) as w:
+        w.write_rows(records)
+    return w.num_rows
+
+
+def read_records(path):
+    """ generator of the rows of a file written by write_records """
+    return writer_class(path).read(path)
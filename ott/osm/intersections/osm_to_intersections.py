@@ -2,125 +2,322 @@
     Credit goes to https://stackoverflow.com/users/684592/kotaro
     https://stackoverflow.com/questions/14716497/how-can-i-find-a-list-of-street-intersections-from-openstreetmap-data?rq=1
 """
+import io
 import os
+import re
 import sys
-import csv
+import hashlib
 import itertools
+from array import array
+from contextlib import closing
 
 from ott.utils import file_utils
+from ott.osm.osm_sections import OsmSectionReader
+from .intersection_writers import FIELDS, WRITERS, split_ext, write_records, read_records
 
 try:
     from xml.etree import cElementTree as ET
 except ImportError as e:
     from xml.etree import ElementTree as ET
 
+try:
+    import numpy as np
+except ImportError as e:
+    np = None
+
 import logging
 log = logging.getLogger(__file__)
 
 
-tot_proc = 0
-num_proc = 0
+# NOTE: updated 5/2024 ... missing 'trunk' ala MLK Blvd, and also added busway, ped and road
+ROAD_TYPES = ('trunk', 'primary', 'secondary', 'residential', 'tertiary', 'busway', 'pedestrian', 'road', 'unclassified')
+NAME_KEYS = ('name', 'alt_name')
+
+
+def iter_elements(osm_file, tag):
+    """ stream the top level elements named tag out of an .osm file (or file object), clearing each as we go """
+    context = ET.iterparse(osm_file, events=('start', 'end'))
+    event, root = next(context)
+    for event, elem in context:
+        if event == 'end' and elem.tag in ('node', 'way', 'relation'):
+            if elem.tag == tag:
+                yield elem
+            elem.clear()
+            root.clear()
+
+
+def road_way(way):
+    """ :return (names, refs) of a road way element ... or None if the way isn't a road """
+    is_road = False
+    names = []
+    refs = []
+    for item in way:
+        if item.tag == 'nd':
+            refs.append(int(item.get('ref')))
+        elif item.tag == 'tag':
+            k = item.get('k')
+            if k == 'highway' and item.get('v') in ROAD_TYPES:
+                is_road = True
+            elif k in NAME_KEYS and len(item.get('v', '')) > 0:
+                names.append(item.get('v'))
+    return (tuple(names), refs) if is_road else None
+
+
+class RoadNodes(object):
+    """ pass one: node refs of the road ways, and the name(s) of those roads
+
+        memory scales with the number of road node refs: each ref maps to the index of its road's names (or to
+        a list of indexes for shared nodes), and identical name tuples are shared between roads
+        :see RoadNodeArrays (used when numpy is installed)
+    """
+    def __init__(self):
+        self.way_names = []
+        self.names_index = {}
+        self.refs = {}
+        self.num_ways = 0
+        self.num_refs = 0
+
+    def add_way(self, way):
+        road = road_way(way)
+        if road is not None:
+            self.add_road(*road)
+
+    def add_road(self, names, way_refs):
+        """ add a road's (tuple of) names and its list of node refs """
+        i = self.names_index.get(names)
+        if i is None:
+            i = self.names_index[names] = len(self.way_names)
+            self.way_names.append(names)
+
+        refs = self.refs
+        for ref in way_refs:
+            r = refs.get(ref)
+            if r is None:
+                refs[ref] = i
+            elif type(r) is list:
+                r.append(i)
+            else:
+                refs[ref] = [r, i]
+
+        self.num_ways += 1
+        if self.num_ways % 100000 == 0:
+            sys.stderr.write('.')
+
+    def finish(self):
+        self.num_refs = len(self.refs)
+
+    def shared_nodes(self, node_ids):
+        """ :return indexes (into the node_ids sequence) of the node ids that are shared by roads """
+        refs = self.refs
+        return [i for i, node_id in enumerate(node_ids) if type(refs.get(node_id)) is list]
+
+    def names(self, node_id):
+        """ :return unique names of the roads that share node_id (in file order) ... None if this isn't a shared node
+            :note a ref repeated in a single road (e.g., a loop) counts as shared, same as it always has
+        """
+        r = self.refs.get(node_id)
+        if type(r) is not list:
+            return None
+        ret_val = {}
+        for i in r:
+            for n in self.way_names[i]:
+                ret_val[n] = n
+        return list(ret_val.values())
+
 
+class RoadNodeArrays(object):
+    """ numpy version of RoadNodes, for big files
 
-def extract_intersections(osm):
+        pass one appends each road's node refs (int64) and its interned names index (int32) to flat arrays, which is
+        ~12 bytes per ref vs. the hundreds of bytes of a dict entry.  finish() then does the counting as a (stable)
+        sort + unique count, and keeps the (sorted) shared refs, the intersection candidates, for a binary search in pass two.
     """
-    This method reads the passed osm file (xml) and finds intersections (nodes that are shared by two or more roads)
-    :param osm: An osm file or a string from get_osm()
-    """
-    ret_val = {}
+    def __init__(self):
+        self.name_strs = []
+        self.name_ids = {}
+        self.way_names = []
+        self.names_index = {}
+        self.refs = array('q')
+        self.ways = array('i')
+        self.num_ways = 0
+        self.num_refs = 0
+
+        self.shared_refs = None
+        self.shared_starts = None
+        self.shared_counts = None
+        self.shared_ways = None
+
+    def intern(self, names):
+        """ :return index of the tuple of (interned) name ids for these names """
+        ids = []
+        for n in names:
+            i = self.name_ids.get(n)
+            if i is None:
+                i = self.name_ids[n] = len(self.name_strs)
+                self.name_strs.append(n)
+            ids.append(i)
+        ids = tuple(ids)
+
+        ret_val = self.names_index.get(ids)
+        if ret_val is None:
+            ret_val = self.names_index[ids] = len(self.way_names)
+            self.way_names.append(ids)
+        return ret_val
 
-    def get_names_from_way_list(way_list):
-        # import pdb; pdb.set_trace()
-        global num_proc
-        global tot_proc
-        ret_val = {}
-        try:
-            sys.stderr.write('.')
-            for w in way_list:
-                num_proc += 1
-                tot_proc += 1
-                for c in w:
-                    if c.tag == 'tag' and 'k' in c.attrib and (c.attrib['k'] == 'name' or c.attrib['k'] == 'alt_name'):
-                        if 'v' in c.attrib and len(c.attrib['v']) > 0:
-                            ret_val[c.attrib['v']] = c.attrib['v']
+    def add_way(self, way):
+        road = road_way(way)
+        if road is not None:
+            self.add_road(*road)
+
+    def add_road(self, names, way_refs):
+        """ add a road's (tuple of) names and its list of node refs """
+        i = self.intern(names)
+        self.refs.extend(way_refs)
+        self.ways.extend([i] * len(way_refs))
+
+        self.num_ways += 1
+        if self.num_ways % 100000 == 0:
             sys.stderr.write('.')
-        except Exception as e:
-            log.warning(e)
-        return ret_val
 
-    # step 1: parse either XML string or file
-    if '<' in osm and '>' in osm:
-        tree = ET.fromstring(osm)
-        children = tree.getchildren()
-    else:
-        tree = ET.parse(osm)
-        root = tree.getroot()
-        children = root.getchildren()
-
-    log.info("number of osm nodes read in: {}".format(len(children)))
-
-    counter = {}
-    road_ways = {}
-    for i, child in enumerate(children):
-        if child.tag == 'way':
-            is_road = False
-
-            # NOTE: updated 5/2024 ... missing 'trunk' ala MLK Blvd, and also added busway, ped and road
-            road_types = ('trunk', 'primary', 'secondary', 'residential', 'tertiary', 'busway', 'pedestrian', 'road', 'unclassified')
-            for item in child:
-                if item.tag == 'tag' and item.attrib['k'] == 'highway' and item.attrib['v'] in road_types:
-                    is_road = True
-                    break
-
-            if is_road:
-                for item in child:
-                    if item.tag == 'nd':
-                        nd_ref = item.attrib['ref']
-                        if nd_ref not in counter:
-                            counter[nd_ref] = 0
-                        counter[nd_ref] += 1
-                        if nd_ref not in road_ways:
-                            road_ways[nd_ref] = []
-                        road_ways[nd_ref].append(child)
-
-                if i % 100000 == 0:
-                    sys.stderr.write('.')
-
-    # Find nodes that are shared with more than one way, which might correspond to intersections
-    #intersections = filter(lambda x: counter[x] > 1, counter)
-    #sys.stderr.write('INtERSECTIONS READ: {}\n'.format(len(intersections)))
-
-    # import pdb; pdb.set_trace()
-    intersection_nodes = []
-    for i, child in enumerate(children):
-        if child.tag == 'node':
-            z = child.attrib['id']
-            n = counter.get(z)
-            if n and n > 1:
-                intersection_nodes.append(child)
-                if i % 5000 == 0:
-                    sys.stderr.write('.')
-
-    log.info("Number of RAW nodes: {}".format(len(intersection_nodes)))
-    for i, n in enumerate(intersection_nodes):
-        z = n.attrib['id']
-        names_d = get_names_from_way_list(road_ways[z])
-        names = names_d.values()
+    def finish(self):
+        """ count the refs: sort (stable, so each ref's roads stay in file order), then unique-count """
+        refs = np.frombuffer(self.refs, dtype=np.int64)
+        order = np.argsort(refs, kind='stable')
+        ways = np.frombuffer(self.ways, dtype=np.int32)[order]
+        refs = refs[order]
+        del order
+        self.refs = array('q')
+        self.ways = array('i')
+
+        unique_refs, starts, counts = np.unique(refs, return_index=True, return_counts=True)
+        is_shared = counts > 1
+        self.shared_refs = unique_refs[is_shared]
+        self.shared_starts = starts[is_shared]
+        self.shared_counts = counts[is_shared]
+        self.shared_ways = ways
+        self.num_refs = len(unique_refs)
+
+    def shared_nodes(self, node_ids):
+        """ :return indexes (into the node_ids sequence or array) of the node ids that are shared by roads """
+        if len(self.shared_refs) == 0:
+            return []
+        i = np.searchsorted(self.shared_refs, node_ids)
+        i[i == len(self.shared_refs)] = 0
+        return np.flatnonzero(self.shared_refs[i] == node_ids).tolist()
+
+    def names(self, node_id):
+        """ :return unique names of the roads that share node_id (in file order) ... None if this isn't a shared node """
+        i = np.searchsorted(self.shared_refs, node_id)
+        if i == len(self.shared_refs) or self.shared_refs[i] != node_id:
+            return None
+        start = self.shared_starts[i]
+        ret_val = {}
+        for w in self.shared_ways[start:start + self.shared_counts[i]].tolist():
+            for n in self.way_names[w]:
+                ret_val[n] = self.name_strs[n]
+        return list(ret_val.values())
+
+
+class XmlRoadReader(object):
+    """ reads the road ways, and then the shared (intersection) nodes, of an .osm file or xml string (see PbfRoadReader)
+        :param span: optional (start, end) byte range of the .osm file to read, rather than its way / node section
+    """
+    def __init__(self, osm, span=None):
+        self.osm = osm
+        self.span = span
+
+    def open_section(self, is_ways):
+        if '<' in self.osm and '>' in self.osm:
+            return io.BytesIO(self.osm.encode('utf-8'))
+        if self.span:
+            return OsmSectionReader(self.osm, *self.span)
+        return OsmSectionReader.section(self.osm, is_ways)
+
+    def roads(self):
+        """ generator of (names, refs) of the road ways (just the way section of a nodes-first .osm file) """
+        with closing(self.open_section(is_ways=True)) as f:
+            for way in iter_elements(f, 'way'):
+                road = road_way(way)
+                if road is not None:
+                    yield road
+
+    def road_nodes(self, roads):
+        """ generator of (names, 'lat,lon') of the nodes shared by roads (a RoadNodes that's seen all the roads) """
+        with closing(self.open_section(is_ways=False)) as f:
+            for node in iter_elements(f, 'node'):
+                names = roads.names(int(node.get('id')))
+                if names is not None:
+                    yield names, node.get('lat') + ',' + node.get('lon')
+
+
+def road_reader(osm, workers=1):
+    """ :return the reader of an osm file's roads and road nodes: PbfRoadReader, ParallelRoadReader or XmlRoadReader """
+    if osm.endswith(".pbf"):
+        from .pbf_intersections import PbfRoadReader
+        return PbfRoadReader(osm)
+    elif workers > 1 and os.path.exists(osm):
+        from .parallel_intersections import ParallelRoadReader
+        return ParallelRoadReader(osm, workers)
+    return XmlRoadReader(osm)
+
+
+def intersection_nodes(osm, workers=1, reader=None):
+    """
+    generator of (names, 'lat,lon') of each intersection node (a node shared by roads with two or more names)
+    :param osm: An osm file, a .osm.pbf file or a string from get_osm()
+    :param workers: number of processes to parse an .osm (xml) file with (see ParallelRoadReader)
+    :param reader: optional reader of the roads and road nodes (e.g., an IntersectionsConsumer of an OsmPipeline),
+                   rather than one for osm (see road_reader)
+
+    the file is streamed twice, so memory scales with the number of road nodes rather than file size:
+      pass 1: road ways, collecting their node refs and names (just the way section of a nodes-first .osm file)
+      pass 2: nodes, outputting the coordinates of the refs shared by two or more roads
+    """
+    if reader is None:
+        reader = road_reader(osm, workers)
+
+    # step 1: road node refs and names (counted with numpy arrays, when numpy is installed)
+    roads = RoadNodeArrays() if np else RoadNodes()
+    for names, refs in reader.roads():
+        roads.add_road(names, refs)
+    roads.finish()
+    log.info("number of road ways read in: {} (with {} node refs)".format(roads.num_ways, roads.num_refs))
+
+    # step 2: coordinates of the named intersection nodes
+    num_nodes = 0
+    for names, coordinate in reader.road_nodes(roads):
+        num_nodes += 1
         if len(names) < 2:
-            # print(names)
             continue
 
-        coordinate = n.attrib['lat'] + ',' + n.attrib['lon']
-        two_names_list = itertools.combinations(names, 2)
-        for t in two_names_list:
-            ret_val[t] = coordinate
-        if i % 5000 == 0:
+        yield names, coordinate
+        if num_nodes % 5000 == 0:
             sys.stderr.write('.')
 
+    log.info("Number of RAW nodes: {}".format(num_nodes))
+
+
+def extract_intersections(osm, workers=1, reader=None):
+    """
+    This method reads the passed osm file (xml or .pbf) and finds intersections (nodes shared by two or more roads)
+    :param osm: An osm file, a .osm.pbf file or a string from get_osm()
+    :param workers: number of processes to parse an .osm (xml) file with (see ParallelRoadReader)
+    :param reader: optional reader of the roads and road nodes (see intersection_nodes)
+    :return dict of {(street, cross street): 'lat,lon'} ... the last node of each street pair (see cluster_intersections)
+    """
+    ret_val = {}
+    for names, coordinate in intersection_nodes(osm, workers, reader):
+        for t in itertools.combinations(names, 2):
+            ret_val[t] = coordinate
     log.info("Number of NAMED (output) intersection nodes: {}".format(len(ret_val)))
     return ret_val
 
 
+def intersection_items(intersections):
+    """ (names, 'lat,lon') items of either extract_intersections() (a dict) or cluster_intersections() (a list) """
+    return intersections.items() if hasattr(intersections, 'items') else intersections
+
+
 def intersection_tuple_to_record(names_tuple, coord_string, separator='&', def_val={}):
     """
     turns an intersection record created above in extract_intersections() into a dict
@@ -142,28 +339,173 @@ def intersection_tuple_to_record(names_tuple, coord_string, separator='&', def_v
     return ret_val, valid
 
 
+DELTA_TYPES = ('added', 'removed', 'changed')
+MOVED_DISTANCE = 100  # meters ... a street pair that moves less than this is a changed row, not a removed and added one
+STABLE_ID_RE = re.compile(r'^[0-9a-f]{16}(-\d+)?$')
+
+
+def stable_id(rec):
+    """ id of an intersection record that stays the same from export to export: a hash of the street names and the
+        coordinate rounded to 3 decimal places (~100 meters) ... so a node move within its rounding cell keeps the id,
+        but a move across a cell boundary is a new id (see match_moved, which keeps the old id for those)
+    """
+    key = u"{}|{}|{:.3f}|{:.3f}".format(rec['street'], rec['cross_street'], float(rec['lat']), float(rec['lon']))
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+
+def unique_stable_ids(records):
+    """ :return list of the stable_id() of each record ... records whose ids collide (e.g., two clusters of a street
+                pair in the same ~100 meter cell) get -2, -3, ... suffixes, in coordinate order, so each id is unique,
+                and doesn't depend on the order of the records
+    """
+    ret_val = [stable_id(rec) for rec in records]
+    groups = {}
+    for i, id in enumerate(ret_val):
+        groups.setdefault(id, []).append(i)
+    for id, group in groups.items():
+        if len(group) > 1:
+            group.sort(key=lambda i: (float(records[i]['lat']), float(records[i]['lon']), i))
+            for n, i in enumerate(group[1:], 2):
+                ret_val[i] = "{}-{}".format(id, n)
+    return ret_val
+
+
+def match_moved(added, removed, max_distance=MOVED_DISTANCE, taken=()):
+    """ pair the added records with removed rows of the same street names, within max_distance meters (nearest first)
+        ... each paired record gets the id of its removed row, so a node that moves across a stable_id() rounding
+        boundary keeps its id
+        :param taken: ids of the other records (rows with one of those ids aren't paired, so the ids stay unique)
+        :return list of the (record, row) pairs ... the paired records and rows are taken out of added and removed
+    """
+    from .intersection_index import distance
+
+    rows_by_names = {}
+    for row in removed:
+        if str(row['id']) not in taken:
+            rows_by_names.setdefault((row['street'], row['cross_street']), []).append(row)
+
+    ret_val = []
+    for rec in list(added):
+        rows = rows_by_names.get((rec['street'], rec['cross_street']))
+        if not rows:
+            continue
+        lat, lon = float(rec['lat']), float(rec['lon'])
+        d, row = min(((distance(lat, lon, float(r['lat']), float(r['lon'])), r) for r in rows), key=lambda dr: dr[0])
+        if d <= max_distance:
+            rows.remove(row)
+            added.remove(rec)
+            removed.remove(row)
+            rec['id'] = row['id']
+            ret_val.append((rec, row))
+    return ret_val
+
+
+def csv_records(intersections, source='transit', stable_ids=False):
+    """ generator of the (valid) .csv records of extract_intersections() output ... ids are 1 to n, or stable ids
+        :note stable ids are set once all the records are read (see unique_stable_ids)
+    """
+    records = []
+    for i, (names, coordinate) in enumerate(intersection_items(intersections)):
+        rec = {'id': i+1, 'layer_id': 'intersection', 'source': source}
+        rec, is_valid = intersection_tuple_to_record(names, coordinate, def_val=rec)
+        if is_valid:
+            if not stable_ids:
+                yield rec
+            else:
+                records.append(rec)
+
+    for rec, id in zip(records, unique_stable_ids(records)):
+        rec['id'] = id
+        yield rec
+
+
 def to_csv(intersections, csv_file_path, source='transit'):
     """
     turn list returned by extract_intersections() into a .csv file
     note: the output format follows pelias transit .csv format (Oct 2018)
           format may change for generic pelias .csv reader
+    note: the file's extension picks the format (e.g., .csv.gz, .ndjson or .parquet ... see intersection_writers)
     """
-    with open(csv_file_path, mode='w') as csv_file:
-        fieldnames = ['id', 'name', 'street', 'cross_street', 'address', 'zipcode', 'lon', 'lat', 'layer_id', 'source']
-        writer = csv.DictWriter(csv_file, fieldnames=fieldnames)
-        writer.writeheader()
-        for i, names in enumerate(intersections):
-            rec = {'id': i+1, 'layer_id': 'intersection', 'source': source}
-            rec, is_valid = intersection_tuple_to_record(names, intersections[names], def_val=rec)
-            if is_valid:
-                writer.writerow(rec)
+    write_records(csv_records(intersections, source), csv_file_path)
+
 
+def delta_csv_path(csv_file_path, delta_type):
+    """ e.g., intersection.csv's added rows go to intersection-added.csv (and intersection.csv.gz's to intersection-added.csv.gz) """
+    base, ext = split_ext(csv_file_path)
+    return "{}-{}{}".format(base, delta_type, ext)
 
-def osm_to_intersections(osm_file, csv_output_path):
-    """ the 'main' routine to collect intersection from input .osm file and output to a csv file """
-    intersections = extract_intersections(osm_file)
+
+def to_csv_incremental(intersections, csv_file_path, source='transit', moved_distance=MOVED_DISTANCE):
+    """
+    same as to_csv, but with stable ids (see stable_id), plus -added, -removed and -changed .csv files of the rows
+    that differ from the previous csv_file_path export ... so a geocoder import only has to touch those rows
+    note: a previous export from to_csv (with 1 to n ids) is read fine, but all its rows will show as changed (new ids)
+    note: a street pair that moves (up to moved_distance meters) keeps its previous id, and is a changed row
+    :return dict with the number of rows in each delta file
+    """
+    # step 1: the previous export's rows, keyed by their stable id
+    previous = {}
+    if os.path.exists(csv_file_path):
+        rows = []
+        for row in read_records(csv_file_path):
+            try:
+                stable_id(row)
+                rows.append(row)
+            except (KeyError, TypeError, ValueError) as e:
+                log.warning("skipping row {} of {}: {}".format(row, csv_file_path, e))
+        previous = dict(zip(unique_stable_ids(rows), rows))
+
+    def is_changed(rec, row):
+        return any(str(rec.get(k, '')) != str(row.get(k) if row.get(k) is not None else '') for k in FIELDS)
+
+    # step 2: diff the new records against those rows
+    #         note: a row's stable id that isn't its key is one kept from an earlier move (see step 3), so it's kept again
+    records = list(csv_records(intersections, source, stable_ids=True))
+    ids = set(rec['id'] for rec in records)
+    deltas = dict((d, []) for d in DELTA_TYPES)
+    for rec in records:
+        row = previous.pop(rec['id'], None)
+        if row is None:
+            deltas['added'].append(rec)
+            continue
+        row_id = str(row['id'])
+        if row_id != rec['id'] and row_id not in ids and STABLE_ID_RE.match(row_id):
+            rec['id'] = row_id
+        if is_changed(rec, row):
+            deltas['changed'].append(rec)
+    deltas['removed'] = list(previous.values())
+
+    # step 3: added and removed rows of the same street pair, near each other, are moves (the old id is kept)
+    taken = set(rec['id'] for rec in records)
+    for rec, row in match_moved(deltas['added'], deltas['removed'], moved_distance, taken):
+        if is_changed(rec, row):
+            deltas['changed'].append(rec)
+
+    # step 4: write the full export, and the delta files
+    write_records(records, csv_file_path)
+    for d in DELTA_TYPES:
+        write_records(deltas[d], delta_csv_path(csv_file_path, d))
+
+    ret_val = dict((d, len(deltas[d])) for d in DELTA_TYPES)
+    log.info("{} intersections written to {} ({})".format(len(records), csv_file_path, ret_val))
+    return ret_val
+
+
+def osm_to_intersections(osm_file, csv_output_path, workers=1, incremental=False, cluster_distance=0, reader=None):
+    """ the 'main' routine to collect intersection from input .osm file and output to a csv file
+        :param cluster_distance: meters ... when set, each street pair's nearby nodes are one (centroid) intersection
+        :param reader: optional reader of the roads and road nodes (see intersection_nodes)
+    """
+    if cluster_distance > 0:
+        from .cluster_intersections import cluster_intersections
+        intersections = cluster_intersections(intersection_nodes(osm_file, workers, reader), cluster_distance)
+    else:
+        intersections = extract_intersections(osm_file, workers, reader)
     if csv_output_path:
-        to_csv(intersections, csv_output_path)
+        if incremental:
+            to_csv_incremental(intersections, csv_output_path)
+        else:
+            to_csv(intersections, csv_output_path)
     return intersections
 
 
@@ -182,7 +524,39 @@ def main():
             '--csv',
             '-c',
             required=False,
-            help=".csv file output (Pelias format)"
+            help=".csv file output (Pelias format) ... or .csv.gz, .ndjson, .parquet or .arrow output, by extension"
+        )
+        parser.add_argument(
+            '--format',
+            '-f',
+            required=False,
+            choices=sorted(e.lstrip('.') for e in WRITERS),
+            help="output format (replaces the output file's extension)"
+        )
+        parser.add_argument(
+            '--workers',
+            '-w',
+            type=int,
+            default=1,
+            help="number of processes used to parse the .osm file"
+        )
+        parser.add_argument(
+            '--incremental',
+            '-i',
+            action='store_true',
+            help="stable ids, plus -added, -removed and -changed .csv files vs. the previous .csv output"
+        )
+        parser.add_argument(
+            '--cluster',
+            type=float,
+            default=0,
+            help="meters: combine each street pair's nodes (in either name order) within this distance into one intersection"
+        )
+        parser.add_argument(
+            '--index',
+            '-x',
+            required=False,
+            help="intersection index file output (see IntersectionIndex)"
         )
         return parser.parse_args()
 
@@ -191,11 +565,18 @@ def main():
     if osm_file is None:
         osm_file = get_test_data()
 
-    intersections = osm_to_intersections(osm_file, p.pelias)
-    if p.pelias is None:
-        for i in intersections:
+    out_path = p.pelias
+    if out_path and p.format:
+        out_path = "{}.{}".format(split_ext(out_path)[0], p.format)
+
+    intersections = osm_to_intersections(osm_file, out_path, p.workers, p.incremental, p.cluster)
+    if p.index:
+        from .intersection_index import IntersectionIndex
+        IntersectionIndex.from_intersections(intersections).save(p.index)
+    if out_path is None and p.index is None:
+        for i, coordinate in intersection_items(intersections):
             #import pdb; pdb.set_trace()
-            print(i, intersections[i])
+            print(i, coordinate)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+import multiprocessing
+from array import array
+
+from ott.osm.osm_sections import OsmSectionReader
+from .osm_to_intersections import XmlRoadReader
+
+import logging
+log = logging.getLogger(__file__)
+
+
+def read_roads(task):
+    """ worker: road ways in a byte range of an .osm file
+        :return (list of each road's names, array of all the roads' refs, array of the number of refs in each road)
+                ... arrays, since they're much faster to send back to the parent process than lists of ints
+    """
+    osm_path, span = task
+    names = []
+    refs = array('q')
+    lengths = array('i')
+    for n, r in XmlRoadReader(osm_path, span).roads():
+        names.append(n)
+        refs.extend(r)
+        lengths.append(len(r))
+    return names, refs, lengths
+
+
+road_nodes = None
+
+
+def init_worker(roads):
+    global road_nodes
+    road_nodes = roads
+
+
+def read_road_nodes(task):
+    """ worker: :return list of (names, 'lat,lon') of the shared road nodes in a byte range of an .osm file """
+    osm_path, span = task
+    return list(XmlRoadReader(osm_path, span).road_nodes(road_nodes))
+
+
+class ParallelRoadReader(object):
+    """ XmlRoadReader that parses an .osm file with a pool of worker processes
+
+        each section of the file is split into byte ranges that begin on an element (see split_body): the way
+        section's ranges are parsed into (names, refs) roads, and the node section's ranges -- which, with the nodes
+        sorted by id, are node id ranges -- are matched against the shared refs of the (counted) roads, which each
+        worker gets a copy of.  results come back in range order, so the output is the same as a serial run.
+    """
+    ranges_per_worker = 4
+
+    def __init__(self, osm_path, workers):
+        self.osm_path = osm_path
+        self.workers = workers
+
+    def tasks(self, is_ways):
+        ranges = OsmSectionReader.section_ranges(self.osm_path, is_ways, self.workers * self.ranges_per_worker)
+        log.info("reading {} in {} ranges with {} workers".format(self.osm_path, len(ranges), self.workers))
+        return [(self.osm_path, span) for span in ranges]
+
+    def roads(self):
+        """ generator of (names, refs) of the road ways """
+        pool = multiprocessing.Pool(self.workers)
+        try:
+            for names, refs, lengths in pool.imap(read_roads, self.tasks(is_ways=True)):
+                pos = 0
+                for n, length in zip(names, lengths):
+                    yield n, refs[pos:pos + length].tolist()
+                    pos += length
+        finally:
+            pool.close()
+            pool.join()
+
+    def road_nodes(self, roads):
+        """ generator of (names, 'lat,lon') of the nodes shared by roads (a RoadNodes that's seen all the roads) """
+        pool = multiprocessing.Pool(self.workers, initializer=init_worker, initargs=(roads,))
+        try:
+            for nodes in pool.imap(read_road_nodes, self.tasks(is_ways=False)):
+                for node in nodes:
+                    yield node
+        finally:
+            pool.close()
+            pool.join()
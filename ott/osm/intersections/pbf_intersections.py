@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+import itertools
+
+from ott.osm.pbf_blocks import read_file_blocks, OSM_DATA
+from .osm_to_intersections import ROAD_TYPES, NAME_KEYS, np
+
+import logging
+log = logging.getLogger(__file__)
+
+
+HIGHWAY = b"highway"
+ROAD_TYPE_BYTES = frozenset(r.encode('utf-8') for r in ROAD_TYPES)
+NAME_KEY_BYTES = frozenset(k.encode('utf-8') for k in NAME_KEYS)
+
+
+def to_degrees(nano_degrees):
+    """ format a coordinate the way osmosis writes it in .osm xml (7 decimal places, without trailing zeros) """
+    ret_val = "{:.7f}".format(nano_degrees * 1e-9).rstrip('0')
+    if ret_val.endswith('.'):
+        ret_val += '0'
+    return ret_val
+
+
+class PbfRoadReader(object):
+    """ reads the road ways, and then the shared (intersection) nodes, of a .osm.pbf file (see XmlRoadReader)
+
+        the PrimitiveBlocks are read straight from the file's fileblocks (see pbf_blocks), so no Node or Way objects
+        are made: way tags are matched on string table indexes, and the dense nodes' delta coded ids are summed
+        (in bulk with numpy, when installed) and just the shared ones get their coordinates decoded.  pass one
+        notes which fileblocks have nodes, so pass two only decompresses and parses those blocks.
+    """
+    def __init__(self, pbf_path):
+        self.pbf_path = pbf_path
+        self.node_blocks = None
+
+    def blocks(self, block_nums=None):
+        """ generator of (fileblock number, PrimitiveBlock) of the data blocks (all, or just those in block_nums) """
+        with open(self.pbf_path, "rb") as r:
+            for i, file_block in enumerate(read_file_blocks(r)):
+                if file_block.type != OSM_DATA:
+                    continue
+                if block_nums is not None and i not in block_nums:
+                    continue
+                yield i, file_block.primitive_block()
+
+    def roads(self):
+        """ generator of (names, refs) of the road ways """
+        self.node_blocks = set()
+        for i, block in self.blocks():
+            strings = block.stringtable.s
+            highway = None
+            road_types = set()
+            name_keys = set()
+            for sid, s in enumerate(strings):
+                if s == HIGHWAY:
+                    highway = sid
+                if s in ROAD_TYPE_BYTES:
+                    road_types.add(sid)
+                if s in NAME_KEY_BYTES:
+                    name_keys.add(sid)
+
+            for group in block.primitivegroup:
+                if len(group.nodes) > 0 or len(group.dense.id) > 0:
+                    self.node_blocks.add(i)
+                if highway is None:
+                    continue
+                for way in group.ways:
+                    is_road = False
+                    names = []
+                    for k, v in zip(way.keys, way.vals):
+                        if k == highway and v in road_types:
+                            is_road = True
+                        elif k in name_keys and len(strings[v]) > 0:
+                            names.append(strings[v].decode('utf-8'))
+                    if is_road:
+                        yield tuple(names), list(itertools.accumulate(way.refs))
+
+    def road_nodes(self, roads):
+        """ generator of (names, 'lat,lon') of the nodes shared by roads (a RoadNodes that's seen all the roads) """
+        for i, block in self.blocks(self.node_blocks):
+            for group in block.primitivegroup:
+                for node in group.nodes:
+                    names = roads.names(node.id)
+                    if names is not None:
+                        yield names, self.coordinate(block, node.lat, node.lon)
+
+                dense = group.dense
+                if len(dense.id) == 0:
+                    continue
+                if np:
+                    ids = np.cumsum(np.fromiter(dense.id, dtype=np.int64, count=len(dense.id)))
+                else:
+                    ids = list(itertools.accumulate(dense.id))
+                shared = roads.shared_nodes(ids)
+                if len(shared) == 0:
+                    continue
+
+                lats = list(itertools.accumulate(dense.lat))
+                lons = list(itertools.accumulate(dense.lon))
+                for n in shared:
+                    yield roads.names(int(ids[n])), self.coordinate(block, lats[n], lons[n])
+
+    @classmethod
+    def coordinate(cls, block, lat, lon):
+        """ :return 'lat,lon' string of a node's (granularity units) lat and lon """
+        lat = block.lat_offset + block.granularity * lat
+        lon = block.lon_offset + block.granularity * lon
+        return to_degrees(lat) + ',' + to_degrees(lon)
@@ -7,8 +7,13 @@ from .pbf_tools import PbfTools
 from .stats.osm_info import OsmInfo
 from .rename.osm_rename import OsmRename
 from .intersections.osm_to_intersections import osm_to_intersections
+from .osm_pipeline import OsmPipeline, StatsConsumer, TransitCullWriter, IntersectionsConsumer
+from .artifact_catalog import ArtifactCatalog
+from .step_scheduler import StepScheduler
 
 import os
+import re
+import functools
 import logging
 log = logging.getLogger(__file__)
 
@@ -55,6 +60,12 @@ class OsmCache(CacheBase):
         self.osm_raw_name = string_utils.safe_append(name, "-raw.osm")
         self.osm_raw_path = string_utils.safe_path_join(self.cache_dir, self.osm_raw_name)
 
+        # note: persistent memo of street renames, so nightly renames only parse new street names
+        self.rename_memo_path = string_utils.safe_path_join(self.cache_dir, "rename_memo.db")
+
+        # note: catalog of the cache's files (stats, plus what each file was made from) ... see ArtifactCatalog
+        self.catalog_path = string_utils.safe_path_join(self.cache_dir, "artifacts.db")
+
         # step 3: pbf tools (for downloading new data from geofabrik, as well as converting the .pbf to our .osm)
         osmosis_path = self.config.get('osmosis_path', def_val=os.path.join(self.this_module_dir, 'osmosis', 'bin', 'osmosis'))
         self.pbf_tools = PbfTools(self.cache_dir, osmosis_path)
@@ -108,15 +119,8 @@ class OsmCache(CacheBase):
 
         # step 4: other OSM processing steps on a new (fresh) .osm file
         if is_updated or force_postprocessing:
-            OsmInfo.cache_stats(self.osm_path)
-            self.pbf_tools.osm_to_pbf(self.osm_path)
-            self.pbf_tools.osm_to_pbf(self.osm_carto_path)
-            # note: cull transit file is used for Pelias (no confusing stop / station overlap)
-            osm_cull_transit_path = self.pbf_tools.cull_transit_from_osm(self.osm_path)
-            self.pbf_tools.osm_to_pbf(osm_cull_transit_path)
-            self.other_exports()
-            self.intersections_export()
-            self.osm_2_pgsql()
+            osm_cull_transit_path = self.postprocess()
+            self.catalog_exports(pbf_path, osm_cull_transit_path)
 
         return is_updated
 
@@ -130,13 +134,30 @@ class OsmCache(CacheBase):
         Having those flags can lead to much larger extents (e.g., NW Oregon/SW Wash file will extend to Montana)
 
         The non-carto file is clipped strictly to the bbox. It's better use is the trip planner, geocoder, etc...
+
+        when config 'rename_format' is pbf, the streets are renamed on a -carto.osm.pbf clip (see PbfRename),
+        and the .osm files are then written from that .pbf ... saving a round trip of the (big) -carto.osm xml
         """
+        if rename and self.config.get('rename_format', def_val='osm') == 'pbf':
+            self.clip_region_to_bbox_pbf(pbf_path)
+            return
+
         self.clip_to_bbox(pbf_path, self.osm_carto_path, complete=True)
         self.make_raw_osm(self.osm_carto_path)  # save off clipped OSM to 'raw' before renaming (for pelias)
         if rename:
-            OsmRename.rename(self.osm_carto_path, do_bkup=False)
+            workers = self.config.get_int('rename_workers', def_val=1)
+            OsmRename.rename(self.osm_carto_path, do_bkup=False, memo_path=self.rename_memo_path, workers=workers)
         self.clip_to_bbox(self.osm_carto_path, self.osm_path)
 
+    def clip_region_to_bbox_pbf(self, pbf_path):
+        """ same as clip_region_to_bbox(rename=True), but with the rename done on .pbf data (PbfRename) """
+        carto_pbf_path = self.osm_carto_path + ".pbf"
+        self.clip_to_bbox(pbf_path, carto_pbf_path, complete=True)
+        self.make_raw_osm(carto_pbf_path)
+        OsmRename.rename(carto_pbf_path, do_bkup=False, memo_path=self.rename_memo_path)
+        self.pbf_tools.pbf_to_osm(carto_pbf_path, self.osm_carto_path)
+        self.clip_to_bbox(carto_pbf_path, self.osm_path)
+
     def clip_to_bbox_spec(self, in_path, out_path, top, bottom, left, right, complete):
         """ clip to specified bbox """
         if not file_utils.exists(in_path):
@@ -158,21 +179,139 @@ class OsmCache(CacheBase):
         for e in exports:
             if name and name not in e['out']:
                 continue
-            in_path = os.path.join(self.cache_dir, e['in'])
-            out_path = os.path.join(self.cache_dir, e['out'])
-            top, bottom, left, right = self.config.get_bbox(e['bbox'])
-            self.clip_to_bbox_spec(in_path, out_path, top, bottom, left, right, complete=True)
+            out_path = self.other_export(e)
             self.pbf_tools.osm_to_pbf(out_path)
 
-    def intersections_export(self):
+    def other_export(self, export):
         """
-        generate intersections .csv from the configured main .osm file (e.g., or-wa.osm)
+        clip one of the other_exports (config) .osm files
+        :return path of the export
         """
+        in_path = os.path.join(self.cache_dir, export['in'])
+        out_path = os.path.join(self.cache_dir, export['out'])
+        top, bottom, left, right = self.config.get_bbox(export['bbox'])
+        self.clip_to_bbox_spec(in_path, out_path, top, bottom, left, right, complete=True)
+        return out_path
+
+    def intersection_csv_path(self):
+        """ :return path of the intersections .csv (from the intersection_out_file config) ... None when not configured """
+        ret_val = None
         intersection_file = self.config.get_json('intersection_out_file')
         if intersection_file:
-            csv_path = os.path.join(self.cache_dir, intersection_file)
-            log.info("exporting intersections to file {}".format(csv_path))
-            osm_to_intersections(self.osm_path, csv_path)
+            ret_val = os.path.join(self.cache_dir, intersection_file)
+        return ret_val
+
+    def intersections_export(self):
+        """
+        generate intersections .csv from the configured main .osm file (e.g., or-wa.osm)
+        :note reads the .osm.pbf version of that file (e.g., or-wa.osm.pbf) instead, when it's up to date
+        """
+        csv_path = self.intersection_csv_path()
+        if csv_path:
+            osm_path = self.osm_path
+            if file_utils.exists(self.pbf_path) and not file_utils.is_a_newer_than_b(self.osm_path, self.pbf_path):
+                osm_path = self.pbf_path
+            workers = self.config.get_int('intersection_workers', def_val=1)
+            incremental = self.config.get_json('intersection_incremental') is True
+            cluster_distance = self.config.get_int('intersection_cluster_distance', def_val=0)
+            log.info("exporting intersections from {} to file {}".format(osm_path, csv_path))
+            osm_to_intersections(osm_path, csv_path, workers, incremental, cluster_distance)
+
+    def single_pass_exports(self):
+        """
+        stats, transit cull and intersections of the .osm file, from a single read of it (see OsmPipeline)
+        :return path of the cull transit .osm file
+        """
+        pipeline = OsmPipeline(self.osm_path)
+        pipeline.add(StatsConsumer())
+        # note: cull transit file is used for Pelias (no confusing stop / station overlap)
+        cull = pipeline.add(TransitCullWriter())
+        csv_path = self.intersection_csv_path()
+        if csv_path:
+            incremental = self.config.get_json('intersection_incremental') is True
+            cluster_distance = self.config.get_int('intersection_cluster_distance', def_val=0)
+            pipeline.add(IntersectionsConsumer(csv_path, incremental, cluster_distance))
+        pipeline.run()
+        return cull.osm_out_path
+
+    def cull_transit_path(self):
+        """ :return path of the cull transit .osm file (e.g., or-wa_cull_transit.osm) """
+        return re.sub('.osm$', '_cull_transit.osm', self.osm_path)
+
+    def postprocess(self):
+        """
+        post-process a new .osm file: stats, .pbf conversions, transit cull, other exports, intersections and osm2pgsql
+
+        each step says which files it reads and writes, so with config postprocessing_workers > 1, the steps that
+        aren't waiting on another step's output run at the same time (see StepScheduler) ... osmosis_workers caps
+        how many osmosis (java) steps run at once
+        :return path of the cull transit .osm file
+        """
+        osm_cull_transit_path = self.cull_transit_path()
+        csv_path = self.intersection_csv_path()
+        workers = self.config.get_int('postprocessing_workers', def_val=1)
+        osmosis_workers = self.config.get_int('osmosis_workers', def_val=workers)
+        scheduler = StepScheduler(workers, {'osmosis': osmosis_workers})
+
+        single_pass = self.config.get_json('single_pass_postprocessing') is True
+        if single_pass:
+            outputs = [OsmInfo.get_stats_file_path(self.osm_path), osm_cull_transit_path] + ([csv_path] if csv_path else [])
+            scheduler.add('single_pass_exports', self.single_pass_exports, [self.osm_path], outputs)
+        else:
+            stats_workers = self.config.get_int('stats_workers', def_val=1)
+            use_hash = self.config.get_json('stats_hash') is True
+            scheduler.add('stats', functools.partial(OsmInfo.cache_stats, self.osm_path, workers=stats_workers, use_hash=use_hash),
+                          [self.osm_path], [OsmInfo.get_stats_file_path(self.osm_path)])
+
+        scheduler.add('osm_to_pbf ' + self.osm_name, functools.partial(self.pbf_tools.osm_to_pbf, self.osm_path),
+                      [self.osm_path], [self.osm_path + ".pbf"], 'osmosis')
+        scheduler.add('osm_to_pbf ' + self.osm_carto_name, functools.partial(self.pbf_tools.osm_to_pbf, self.osm_carto_path),
+                      [self.osm_carto_path], [self.osm_carto_path + ".pbf"], 'osmosis')
+        if not single_pass:
+            # note: cull transit file is used for Pelias (no confusing stop / station overlap)
+            scheduler.add('cull_transit_from_osm', functools.partial(self.pbf_tools.cull_transit_from_osm, self.osm_path, osm_cull_transit_path),
+                          [self.osm_path], [osm_cull_transit_path], 'osmosis')
+        scheduler.add('osm_to_pbf ' + os.path.basename(osm_cull_transit_path), functools.partial(self.pbf_tools.osm_to_pbf, osm_cull_transit_path),
+                      [osm_cull_transit_path], [osm_cull_transit_path + ".pbf"], 'osmosis')
+
+        for e in self.config.get_json('other_exports') or []:
+            out_path = os.path.join(self.cache_dir, e['out'])
+            scheduler.add('other_exports ' + e['out'], functools.partial(self.other_export, e),
+                          [os.path.join(self.cache_dir, e['in'])], [out_path], 'osmosis')
+            scheduler.add('osm_to_pbf ' + e['out'], functools.partial(self.pbf_tools.osm_to_pbf, out_path),
+                          [out_path], [out_path + ".pbf"], 'osmosis')
+
+        if csv_path and not single_pass:
+            # note: reads the .osm.pbf when it's up to date, so it waits on that conversion
+            scheduler.add('intersections_export', self.intersections_export, [self.osm_path, self.pbf_path], [csv_path])
+        scheduler.add('osm_2_pgsql', self.osm_2_pgsql, [self.osm_carto_path, self.osm_path])
+
+        scheduler.run()
+        return osm_cull_transit_path
+
+    def catalog_exports(self, pbf_path, osm_cull_transit_path):
+        """
+        record the cache's (post-processed) files in the artifact catalog, with the files they were made from
+        :note a catalog error is logged, rather than failing the update
+        """
+        try:
+            with ArtifactCatalog(self.catalog_path) as catalog:
+                if file_utils.exists(pbf_path):
+                    catalog.record(pbf_path, 'download_pbf', stats=OsmInfo.pbf_header_stats(pbf_path))
+                catalog.record(self.osm_carto_path, 'clip_region_to_bbox', [pbf_path])
+                catalog.record(self.osm_path, 'clip_region_to_bbox', [self.osm_carto_path], OsmInfo.read_cached_stats(self.osm_path))
+                catalog.record(osm_cull_transit_path, 'cull_transit_from_osm', [self.osm_path])
+                for osm_path in (self.osm_path, self.osm_carto_path, osm_cull_transit_path):
+                    catalog.record(osm_path + ".pbf", 'osm_to_pbf', [osm_path])
+                for e in self.config.get_json('other_exports') or []:
+                    out_path = os.path.join(self.cache_dir, e['out'])
+                    catalog.record(out_path, 'other_exports', [os.path.join(self.cache_dir, e['in'])])
+                    catalog.record(out_path + ".pbf", 'osm_to_pbf', [out_path])
+                csv_path = self.intersection_csv_path()
+                if csv_path:
+                    catalog.record(csv_path, 'intersections_export', [self.osm_path])
+        except Exception as e:
+            log.warning("couldn't catalog {}: {}".format(self.cache_dir, e))
 
     def is_configured(self):
         return len(self.osm_name) > 0 and len(self.osm_path) > 0
@@ -224,6 +363,11 @@ class OsmCache(CacheBase):
                 cache_file = OsmInfo.get_stats_file_path(osm.osm_name)
                 osm.cp_cached_file(cache_file, app_dir)
                 ret_val = True
+
+                # step c: catalog the copy
+                with ArtifactCatalog(osm.catalog_path) as catalog:
+                    stats = catalog.get(path)
+                    catalog.record(app_osm_path, 'check_osm_file_against_cache', [path], stats['stats'] if stats else None)
         except Exception as e:
             log.warn(e)
         return ret_val
@@ -280,7 +424,8 @@ def clip_from_pbf():
 def clip_rename():
     """ for command line clipping of planet (or regional) .osm.pbf into custom .osm + rename and stats """
     o = clip_from_pbf()
-    OsmRename.rename(o.osm_path, do_bkup=False)
+    workers = o.config.get_int('rename_workers', def_val=1)
+    OsmRename.rename(o.osm_path, do_bkup=False, memo_path=o.rename_memo_path, workers=workers)
     OsmInfo.cache_stats(o.osm_path)
 
 
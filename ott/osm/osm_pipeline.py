@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+"""
+single pass post-processing of an .osm file: the file is read and parsed once, and each of its elements is handed
+to every registered consumer (stats, intersections, transit cull writer, ...), rather than each step re-reading
+(and re-parsing) a multi-GB file on its own
+
+:example:
+    pipeline = OsmPipeline("or-wa.osm")
+    pipeline.add(StatsConsumer())
+    cull = pipeline.add(TransitCullWriter())
+    pipeline.add(IntersectionsConsumer("intersection.csv"))
+    pipeline.run()
+"""
+import io
+import os
+import re
+from array import array
+
+from .stats.osm_info import OsmInfo
+from .rename.stream_rename import escape_attr_value
+from .stats.scan_stats import to_epoch
+from .intersections.osm_to_intersections import road_way, osm_to_intersections, np
+
+try:
+    from xml.etree import cElementTree as ET
+except ImportError as e:
+    from xml.etree import ElementTree as ET
+
+import logging
+log = logging.getLogger(__file__)
+
+
+# osmosis tag transform of PbfTools.cull_transit_from_osm
+TRANSIT_TAG_TRANSFORM = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'osmosis', 'tagtransform.xml')
+
+# characters that have to be escaped in a (double quoted) attribute value
+ATTR_ESCAPE_RE = re.compile(u'[&<>"\t\n\r]')
+
+
+class OsmConsumer(object):
+    """ consumer interface of an OsmPipeline ... override whichever of these a consumer needs """
+    def start(self, osm_path, attrib):
+        """ called before the first element, with the .osm file path and (a copy of) its <osm> element attributes """
+        pass
+
+    def element(self, elem):
+        """ called with each (complete) top level element -- <bounds>, <node>, <way> and <relation> -- in file order
+            :note the element is cleared after all the consumers have seen it, so don't hang on to it
+        """
+        pass
+
+    def finish(self):
+        """ called after the last element """
+        pass
+
+
+class OsmPipeline(object):
+    """ streams an .osm file (iterparse) once, fanning each top level element out to the consumers """
+    def __init__(self, osm_path):
+        self.osm_path = osm_path
+        self.consumers = []
+
+    def add(self, consumer):
+        """ register a consumer (see OsmConsumer) ... :return the consumer """
+        self.consumers.append(consumer)
+        return consumer
+
+    def run(self):
+        log.info("reading {} for {}".format(self.osm_path, ", ".join(c.__class__.__name__ for c in self.consumers)))
+        context = ET.iterparse(self.osm_path, events=('start', 'end'))
+        event, root = next(context)
+        for c in self.consumers:
+            c.start(self.osm_path, dict(root.attrib))
+
+        depth = 0
+        num_elements = 0
+        for event, elem in context:
+            if event == 'start':
+                depth += 1
+                continue
+            depth -= 1
+            if depth == 0:
+                for c in self.consumers:
+                    c.element(elem)
+                elem.clear()
+                root.clear()
+                num_elements += 1
+
+        for c in self.consumers:
+            c.finish()
+        log.info("{} elements read from {}".format(num_elements, self.osm_path))
+        return self.consumers
+
+
+class StatsConsumer(OsmConsumer):
+    """ OsmInfo stats of the file, written to its -stats file (same as OsmInfo.cache_stats) """
+    def __init__(self, stats_file=None, pretty_print=True):
+        self.stats_file = stats_file
+        self.pretty_print = pretty_print
+        self.stats = OsmInfo()
+        self.last_timestamp = ""
+
+    def start(self, osm_path, attrib):
+        self.stats.osm_file = osm_path
+        self.stats_file = OsmInfo.get_stats_file_path(osm_path, self.stats_file)
+
+    def element(self, elem):
+        if elem.tag != 'way':
+            return
+        stats = self.stats
+        stats.way_count += 1
+        for tag in elem.iter('tag'):
+            if tag.get('k') == 'highway':
+                stats.highway_count += 1
+                break
+
+        # note: timestamps are compared as strings, so only the newer ones are converted to numbers
+        timestamp = elem.get('timestamp', '')[:19]
+        if timestamp > self.last_timestamp:
+            self.last_timestamp = timestamp
+            stats.update_last(to_epoch(timestamp), int(elem.get('id', 0)), int(elem.get('changeset', 0)))
+
+    def finish(self):
+        self.stats.finish_stats(self.stats.osm_file)
+        self.stats.write_stats_file(self.stats_file, self.pretty_print)
+
+
+class IntersectionsConsumer(OsmConsumer):
+    """ intersections export (see osm_to_intersections), where this consumer is the reader of the roads and nodes
+
+        the roads are kept like a ParallelRoadReader worker's (names, plus flat arrays of the refs), and every node's
+        id and coordinate go into arrays (7 decimal fixed point, so 16 bytes a node), since the nodes come before the
+        ways that say which nodes are intersections
+    """
+    def __init__(self, csv_output_path, incremental=False, cluster_distance=0):
+        self.csv_output_path = csv_output_path
+        self.incremental = incremental
+        self.cluster_distance = cluster_distance
+        self.names = []
+        self.refs = array('q')
+        self.lengths = array('i')
+        self.node_ids = array('q')
+        self.lats = array('i')
+        self.lons = array('i')
+        self.intersections = None
+
+    def element(self, elem):
+        if elem.tag == 'node':
+            self.node_ids.append(int(elem.get('id')))
+            self.lats.append(int(round(float(elem.get('lat')) * 1e7)))
+            self.lons.append(int(round(float(elem.get('lon')) * 1e7)))
+        elif elem.tag == 'way':
+            road = road_way(elem)
+            if road is not None:
+                self.names.append(road[0])
+                self.refs.extend(road[1])
+                self.lengths.append(len(road[1]))
+
+    def finish(self):
+        self.intersections = osm_to_intersections(None, self.csv_output_path, incremental=self.incremental,
+                                                  cluster_distance=self.cluster_distance, reader=self)
+
+    def roads(self):
+        """ generator of (names, refs) of the road ways """
+        pos = 0
+        for names, length in zip(self.names, self.lengths):
+            yield names, self.refs[pos:pos + length].tolist()
+            pos += length
+
+    def road_nodes(self, roads):
+        """ generator of (names, 'lat,lon') of the nodes shared by roads (a RoadNodes that's seen all the roads) """
+        from .intersections.pbf_intersections import to_degrees
+        ids = np.frombuffer(self.node_ids, dtype=np.int64) if np and len(self.node_ids) else self.node_ids
+        for n in roads.shared_nodes(ids):
+            node_id = self.node_ids[n]
+            yield roads.names(node_id), to_degrees(self.lats[n] * 100) + ',' + to_degrees(self.lons[n] * 100)
+
+
+class TransitCullWriter(OsmConsumer):
+    """ writes a copy of the .osm file without its transit elements (same as PbfTools.cull_transit_from_osm):
+        elements with a tag matching any of the tag transform file's <match> tags (key and value regexes) are dropped
+    """
+    def __init__(self, osm_out_path=None, tag_transform_file=TRANSIT_TAG_TRANSFORM):
+        self.osm_out_path = osm_out_path
+        self.rules = self.read_rules(tag_transform_file)
+        self.file = None
+        self.num_culled = 0
+
+    @classmethod
+    def read_rules(cls, tag_transform_file):
+        """ :return list of the (key, value) regexes of the <match> tags in an osmosis tag transform file """
+        ret_val = []
+        for tag in ET.parse(tag_transform_file).getroot().iterfind('.//match/tag'):
+            rule = (re.compile('(?:{})$'.format(tag.get('k'))), re.compile('(?:{})$'.format(tag.get('v'))))
+            if rule not in ret_val:
+                ret_val.append(rule)
+        return ret_val
+
+    def is_transit(self, elem):
+        for tag in elem.iter('tag'):
+            k, v = tag.get('k', ''), tag.get('v', '')
+            for key_re, value_re in self.rules:
+                if key_re.match(k) and value_re.match(v):
+                    return True
+        return False
+
+    def start(self, osm_path, attrib):
+        if self.osm_out_path is None:
+            self.osm_out_path = re.sub('.osm$', '_cull_transit.osm', osm_path)
+        self.file = io.open(self.osm_out_path, "w", encoding="utf-8")
+        self.file.write(u"<?xml version='1.0' encoding='UTF-8'?>\n")
+        self.file.write(u"<osm{}>\n".format(self.attributes(attrib)))
+
+    @classmethod
+    def attributes(cls, attrib):
+        return u"".join(u' {}="{}"'.format(k, escape_attr_value(v) if ATTR_ESCAPE_RE.search(v) else v)
+                        for k, v in attrib.items())
+
+    def write_element(self, elem, indent=u"  "):
+        """ write an element the way osmosis does: one (indented) line per element, with double quoted attributes """
+        if len(elem) == 0:
+            self.file.write(u"{}<{}{}/>\n".format(indent, elem.tag, self.attributes(elem.attrib)))
+        else:
+            self.file.write(u"{}<{}{}>\n".format(indent, elem.tag, self.attributes(elem.attrib)))
+            for child in elem:
+                self.write_element(child, indent + u"  ")
+            self.file.write(u"{}</{}>\n".format(indent, elem.tag))
+
+    def element(self, elem):
+        if elem.tag != 'bounds' and self.is_transit(elem):
+            self.num_culled += 1
+            return
+        self.write_element(elem)
+
+    def finish(self):
+        self.file.write(u"</osm>\n")
+        self.file.close()
+        log.info("{} transit elements culled from {}".format(self.num_culled, self.osm_out_path))
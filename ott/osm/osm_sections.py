@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+import re
+import mmap
+
+import logging
+log = logging.getLogger(__file__)
+
+
+# start of a top level .osm element (and of the <osm> root element)
+ELEMENT_START_RE = re.compile(br'<(node|way|relation)[\s/>]')
+OSM_START_RE = re.compile(br'<osm[\s>]')
+OSM_END = b"</osm>"
+
+# fake root element wrapped around fragments of an .osm file's body (for xml parsers)
+FRAGMENT_OPEN = b"<osm>"
+FRAGMENT_CLOSE = b"</osm>"
+
+
+def find_body_span(mm):
+    """ returns the (start, end) byte offsets of the body of an .osm file (the run of <node>, <way> and <relation>
+        elements between the <osm ...> header and the closing </osm>) ... or None if the file doesn't look like .osm
+    """
+    ret_val = None
+    m = OSM_START_RE.search(mm)
+    end = mm.rfind(OSM_END)
+    if m and end > m.end():
+        s = ELEMENT_START_RE.search(mm, m.end(), end)
+        start = s.start() if s else end
+        ret_val = start, end
+    return ret_val
+
+
+def find_first_way(mm, start=0, end=None, look_ahead=64 * 1024):
+    """ returns the byte offset of the first <way> in an .osm file (mmap or bytes), found via binary search
+
+        osmosis writes all the <node> elements before any <way> or <relation>, so the element that starts at (or
+        after) any byte offset tells us which side of the node section's end that offset is on.  once the search
+        is down to look_ahead bytes, the first <way> (or <relation>, if there are no ways) is scanned for.
+
+        :return offset of the end of the node section ... end when the file is all nodes
+    """
+    if end is None:
+        end = len(mm)
+
+    def is_in_nodes(pos):
+        m = ELEMENT_START_RE.search(mm, pos, end)
+        return m is not None and m.group(1) == b"node"
+
+    lo = start
+    hi = end
+    while hi - lo > look_ahead:
+        mid = (lo + hi) // 2
+        if is_in_nodes(mid):
+            lo = mid
+        else:
+            hi = mid
+
+    for m in ELEMENT_START_RE.finditer(mm, lo, end):
+        if m.group(1) != b"node":
+            return m.start()
+    return end
+
+
+def split_body(mm, start, end, num_ranges):
+    """ split the body of an .osm file into (roughly equal) byte ranges, where each range begins on an element """
+    offsets = [start]
+    for i in range(1, num_ranges):
+        target = start + (end - start) * i // num_ranges
+        if target <= offsets[-1]:
+            continue
+        m = ELEMENT_START_RE.search(mm, target, end)
+        if m is None:
+            break
+        if m.start() > offsets[-1]:
+            offsets.append(m.start())
+    offsets.append(end)
+    return list(zip(offsets[:-1], offsets[1:]))
+
+
+def is_nodes_first(mm, start, nodes_end, end, look_ahead=64 * 1024, samples=32):
+    """ True if an .osm file's body (start to end) looks sorted nodes first, with the node section ending at nodes_end
+        (see find_first_way) ... a way or relation starts at nodes_end, there are no nodes in the look_ahead bytes
+        after it, and the elements at (samples) evenly spaced offsets are nodes before nodes_end and not nodes after
+
+        :note just looks at a few spots (not the whole body), so it's cheap on big files ... but it can miss a few
+              stray nodes in the middle of the way section
+    """
+    if nodes_end < end:
+        m = ELEMENT_START_RE.match(mm, nodes_end)
+        if m is None or m.group(1) == b"node":
+            return False
+        for m in ELEMENT_START_RE.finditer(mm, nodes_end, min(end, nodes_end + look_ahead)):
+            if m.group(1) == b"node":
+                return False
+
+    for lo, hi, is_nodes in ((start, nodes_end, True), (nodes_end, end, False)):
+        for i in range(1, samples + 1):
+            m = ELEMENT_START_RE.search(mm, lo + (hi - lo) * i // (samples + 1), hi)
+            if m is not None and (m.group(1) == b"node") != is_nodes:
+                return False
+    return True
+
+
+class OsmSectionReader(object):
+    """ read-only file object of a byte range of an .osm file's body, wrapped in a fake <osm> element
+        (e.g., to feed just the way and relation section of an .osm file to an xml parser)
+    """
+    def __init__(self, osm_path, start, end=None):
+        self.f = open(osm_path, "rb")
+        if end is None:
+            self.f.seek(0, 2)
+            end = self.f.tell()
+        self.f.seek(start)
+        self.remaining = end - start
+        self.pending = FRAGMENT_OPEN
+        self.is_closed = False
+
+    @classmethod
+    def ways(cls, osm_path):
+        """ reader of the way and relation elements of an .osm file (i.e., everything after the node section) """
+        return cls.section(osm_path, is_ways=True)
+
+    @classmethod
+    def nodes(cls, osm_path):
+        """ reader of the node elements of an .osm file (i.e., everything before the first way) """
+        return cls.section(osm_path, is_ways=False)
+
+    @classmethod
+    def section(cls, osm_path, is_ways):
+        """ reader of either the node or the way section of an .osm file
+            :note the whole body is read when the file isn't sorted nodes first
+        """
+        start, end = cls.section_span(osm_path, is_ways)
+        log.debug("reading {} from byte {} to {}".format(osm_path, start, end))
+        return cls(osm_path, start, end)
+
+    @classmethod
+    def section_span(cls, osm_path, is_ways):
+        """ :return (start, end) byte offsets of the node or way section of an .osm file (see section) """
+        with open(osm_path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            span = find_body_span(mm)
+            if span is None:
+                raise ValueError("{} doesn't look like an .osm file".format(osm_path))
+            start, end = span
+            nodes_end = find_first_way(mm, start, end)
+            if not is_nodes_first(mm, start, nodes_end, end):
+                log.info("{} isn't sorted with the nodes first, so reading the whole file".format(osm_path))
+            elif is_ways:
+                start = nodes_end
+            else:
+                end = nodes_end
+        finally:
+            mm.close()
+        return start, end
+
+    @classmethod
+    def section_ranges(cls, osm_path, is_ways, num_ranges):
+        """ :return list of (start, end) byte ranges of the node or way section, split on elements (see split_body) """
+        start, end = cls.section_span(osm_path, is_ways)
+        with open(osm_path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            return split_body(mm, start, end, num_ranges)
+        finally:
+            mm.close()
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = len(self.pending) + self.remaining + len(FRAGMENT_CLOSE)
+        ret_val = b""
+        while len(ret_val) < size:
+            if len(self.pending) == 0:
+                if self.remaining > 0:
+                    self.pending = self.f.read(min(size - len(ret_val), self.remaining))
+                    self.remaining = self.remaining - len(self.pending) if self.pending else 0
+                elif not self.is_closed:
+                    self.pending = FRAGMENT_CLOSE
+                    self.is_closed = True
+                else:
+                    break
+            n = size - len(ret_val)
+            ret_val += self.pending[:n]
+            self.pending = self.pending[n:]
+        return ret_val
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
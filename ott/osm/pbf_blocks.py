@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+import zlib
+from struct import pack, unpack
+
+try:
+    from osmread.protobuf.fileformat_pb2 import BlobHeader, Blob
+    from osmread.protobuf.osmformat_pb2 import HeaderBlock, PrimitiveBlock
+except ImportError:
+    from osmread.protobuf.osm_pb2 import BlobHeader, Blob, HeaderBlock, PrimitiveBlock
+
+import logging
+log = logging.getLogger(__file__)
+
+
+OSM_HEADER = "OSMHeader"
+OSM_DATA = "OSMData"
+
+
+class PbfException(Exception):
+    pass
+
+
+class FileBlock(object):
+    """ one fileblock of a .pbf file: a BlobHeader, plus the (still serialized and compressed) Blob bytes
+
+        the blob is only decompressed / parsed on demand, so blocks that aren't changed can be copied to
+        an output .pbf file verbatim (see write_to)
+    """
+    def __init__(self, header, blob_bytes):
+        self.header = header
+        self.blob_bytes = blob_bytes
+
+    @property
+    def type(self):
+        return self.header.type
+
+    def data(self):
+        """ :return the uncompressed block bytes (a serialized HeaderBlock or PrimitiveBlock) """
+        blob = Blob()
+        blob.ParseFromString(self.blob_bytes)
+        if blob.HasField('raw'):
+            return blob.raw
+        elif blob.HasField('zlib_data'):
+            return zlib.decompress(blob.zlib_data)
+        raise PbfException("unsupported .pbf blob compression (only raw and zlib are supported)")
+
+    def header_block(self):
+        ret_val = HeaderBlock()
+        ret_val.ParseFromString(self.data())
+        return ret_val
+
+    def primitive_block(self):
+        ret_val = PrimitiveBlock()
+        ret_val.ParseFromString(self.data())
+        return ret_val
+
+    def write_to(self, w):
+        """ write this fileblock (unchanged) to file object w """
+        header_bytes = self.header.SerializeToString()
+        w.write(pack('!L', len(header_bytes)))
+        w.write(header_bytes)
+        w.write(self.blob_bytes)
+
+    @classmethod
+    def from_block(cls, block_type, block, compress_level=6):
+        """ make a new (zlib compressed) fileblock from a HeaderBlock or PrimitiveBlock message """
+        data = block.SerializeToString()
+        blob = Blob()
+        blob.raw_size = len(data)
+        blob.zlib_data = zlib.compress(data, compress_level)
+        blob_bytes = blob.SerializeToString()
+
+        header = BlobHeader()
+        header.type = block_type
+        header.datasize = len(blob_bytes)
+        return cls(header, blob_bytes)
+
+
+def read_file_blocks(r):
+    """ generator of the FileBlocks in file object r (a .pbf file, opened 'rb') """
+    while True:
+        buf = r.read(4)
+        if len(buf) == 0:
+            break
+        if len(buf) != 4:
+            raise PbfException("truncated .pbf file (invalid BlobHeader length)")
+
+        header = BlobHeader()
+        header.ParseFromString(r.read(unpack('!L', buf)[0]))
+        blob_bytes = r.read(header.datasize)
+        if len(blob_bytes) != header.datasize:
+            raise PbfException("truncated .pbf file ({} blob is short)".format(header.type))
+        yield FileBlock(header, blob_bytes)
+
+
+def read_header_block(pbf_path):
+    """ :return the HeaderBlock of a .pbf file ... just the file's first (small) fileblock is read and parsed """
+    with open(pbf_path, "rb") as r:
+        for file_block in read_file_blocks(r):
+            if file_block.type != OSM_HEADER:
+                raise PbfException("{} doesn't start with an {} block".format(pbf_path, OSM_HEADER))
+            return file_block.header_block()
+    raise PbfException("{} is empty".format(pbf_path))
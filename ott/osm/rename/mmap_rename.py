@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+import io
+import re
+import mmap
+import itertools
+from xml.etree import ElementTree as ET
+
+from ott.osm.osm_sections import find_body_span
+from ott.osm.osm_sections import find_first_way
+from ott.osm.osm_sections import is_nodes_first
+
+from .stream_rename import StreamRename
+from .stream_rename import RENAMED_BY
+from .stream_rename import escape_attr_value
+from .stream_rename import is_street_name_key
+
+import logging
+log = logging.getLogger(__file__)
+
+
+# <tag k="..." v="..."> elements whose key might be a street name (see is_street_name_key), found via a byte search
+STREET_TAG_RE = re.compile(
+    br'<tag\s+k\s*=\s*(["\'])([^"\']*addr:street[^"\']*|name|(?:name_|alt_name|old_name|bridge:name|description|destination)[^"\']*)\1'
+    br'\s+v\s*=\s*("[^"]*"|\'[^\']*\')'
+)
+
+# a <tag> with its v attribute before k can't be found by the byte search above
+TAG_V_FIRST_RE = re.compile(br'<tag\s+v\s*=')
+
+# attribute values with these bytes need an xml parser to decode (entities, and whitespace normalization)
+XML_DECODE_BYTES = (b"&", b"\t", b"\n", b"\r")
+
+
+class MmapRename(object):
+    """ byte-level street renamer for .osm (xml) files
+
+        the input file is mmap'd, and the street name <tag> elements are found with a regex byte search, so the
+        <node>, <nd> and other geometry lines that make up most of an .osm file are never decoded or parsed ...
+        the bytes between renames are written straight from the mmap to the output.  the node section (found with
+        find_first_way) is just searched for 'addr:street', since that's the only key renamed on nodes.  only the header (the <osm>
+        generator attribute) goes thru StreamRename, so the output is byte-identical to StreamRename's.
+
+        :note files with <tag v="" k=""> attribute order can't be byte searched (process returns None)
+    """
+    def __init__(self, rename_func, attrib=RENAMED_BY, encoding="utf-8"):
+        self.rename_func = rename_func
+        self.attrib = attrib
+        self.encoding = encoding
+        self.num_renamed = 0
+
+    def process(self, in_path, out_path):
+        """ :return number of street name tags renamed ... or None if this file can't be byte searched """
+        return self.rename(in_path, out_path)
+
+    def scan(self, in_path):
+        """ pre-scan of a file's street names (e.g., to batch rename them before process() is called)
+            :return set of the (non-empty) street name values ... or None if the file can't be byte searched
+        """
+        mm = self.open_mmap(in_path)
+        if mm is None:
+            return None
+        try:
+            return self.scan_mmap(mm)
+        finally:
+            mm.close()
+
+    def rename(self, in_path, out_path, prescan=None):
+        """ process() a file, with one mmap (and one check that the file can be byte searched) for both the scan
+            of its street names and the rename
+            :param prescan: called with the scan()'s set of street names before the rename (e.g., a batch parse)
+            :return number of street name tags renamed ... or None if this file can't be byte searched
+        """
+        mm = self.open_mmap(in_path)
+        if mm is None:
+            return None
+        try:
+            if prescan:
+                names = self.scan_mmap(mm)
+                if names:
+                    prescan(names)
+            return self.process_mmap(mm, out_path)
+        finally:
+            mm.close()
+
+    def process_mmap(self, mm, out_path):
+        """ write the renamed copy of an open_mmap() file to out_path ... :return number of street name tags renamed """
+        body_start, body_end = find_body_span(mm)
+        with open(out_path, "wb") as w, memoryview(mm) as view:
+            # step 1: the <osm> header, where the generator attribute gets marked (or says we're already renamed)
+            if not self.mark_header(mm, body_start, w):
+                w.write(view[body_start:])
+                return 0
+
+            # step 2: the body, with the renamed street name values spliced in
+            pos = body_start
+            for m, val in self.street_tags(mm, body_start, body_end):
+                if len(val) == 0:
+                    log.warning("xml element {} (byte {}) found an empty street name value".format(m.group(0), m.start()))
+                    continue
+                rename = self.rename_func(val)
+                if rename != val:
+                    quote = m.group(3)[:1].decode(self.encoding)
+                    w.write(view[pos:m.start(3) + 1])
+                    w.write(escape_attr_value(rename, quote).encode(self.encoding))
+                    pos = m.end(3) - 1
+                    self.num_renamed += 1
+            w.write(view[pos:])
+        return self.num_renamed
+
+    def scan_mmap(self, mm):
+        """ :return set of the (non-empty) street name values of an open_mmap() file """
+        body_start, body_end = find_body_span(mm)
+        if not self.mark_header(mm, body_start, io.BytesIO()):
+            return set()
+        return set(val for m, val in self.street_tags(mm, body_start, body_end) if len(val) > 0)
+
+    def open_mmap(self, in_path):
+        """ :return mmap of the .osm file ... or None if the file can't be byte searched """
+        with open(in_path, "rb") as f:
+            try:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                return None  # empty file
+        if find_body_span(mm) is None or TAG_V_FIRST_RE.search(mm):
+            mm.close()
+            return None
+        return mm
+
+    def mark_header(self, mm, body_start, w):
+        """ write the header (with the marked generator attribute) to w
+            :return False if the header says this file was already renamed
+        """
+        s = StreamRename(lambda n: n, attrib=self.attrib, encoding=self.encoding)
+        s.feed(mm[:body_start], w)
+        s.flush_all(w)
+        return s.do_rename
+
+    def street_tags(self, mm, body_start, body_end):
+        """ generator of (tag match, decoded value) for the street name <tag> elements in the body of the file """
+        # the node section (osmosis writes the nodes first) is just searched for addr:street tags
+        nodes_end = find_first_way(mm, body_start, body_end)
+        if not is_nodes_first(mm, body_start, nodes_end, body_end):
+            nodes_end = body_start
+        tags = itertools.chain(self.find_addr_street_tags(mm, body_start, nodes_end), self.find_street_tags(mm, nodes_end, body_end))
+
+        for m, is_inside_way in tags:
+            key = m.group(2).decode(self.encoding)
+            if is_street_name_key(key, is_inside_way):
+                yield m, self.decode_value(m.group(3))
+
+    def find_addr_street_tags(self, mm, start, end):
+        """ generator of (tag match, is_inside_way) for the addr:street <tag> elements between byte start and end
+            :note a plain byte search for 'addr:street', which skips thru a node section at close to disk speed
+        """
+        i = mm.find(b"addr:street", start, end)
+        while i >= 0:
+            m = None
+            t = mm.rfind(b"<tag", start, i)
+            if t >= 0:
+                m = STREET_TAG_RE.match(mm, t)
+            if m and m.start(2) <= i < m.end(2):
+                yield m, False
+                i = m.end()
+            else:
+                i += 1
+            i = mm.find(b"addr:street", i, end)
+
+    def find_street_tags(self, mm, start, end):
+        """ generator of (tag match, is_inside_way) for the street name <tag> elements between byte start and end """
+        last = start
+        is_inside_way = False
+        for m in STREET_TAG_RE.finditer(mm, start, end):
+            # the element this tag belongs to is the nearest <node>, <way> or <relation> start before it
+            i = m.start()
+            element = max(mm.rfind(b"<node", last, i), mm.rfind(b"<way", last, i), mm.rfind(b"<relation", last, i))
+            if element >= 0:
+                is_inside_way = mm[element + 1] != ord("n")
+            last = m.end()
+            yield m, is_inside_way
+
+    def decode_value(self, quoted):
+        """ decode a quoted attribute value the same way an xml parser would """
+        if any(b in quoted for b in XML_DECODE_BYTES):
+            return ET.fromstring(b"<tag v=" + quoted + b"/>").get('v')
+        return quoted[1:-1].decode(self.encoding)
@@ -4,21 +4,44 @@
 import os
 import inspect
 import csv
+import hashlib
+import multiprocessing
 from pyparsing import *
 from ott.utils import compat_2_to_3
+from .replace_table import ReplaceTable
+from .street_tokenizer import StreetTokenizer
 import logging
 log = logging.getLogger(__file__)
 
 
+class BatchResult(dict):
+    """ dict of each unique name in a batch to its parser output, along with the total and unique name counts """
+    def __init__(self):
+        super(BatchResult, self).__init__()
+        self.num_total = 0
+        self.num_unique = 0
+
+
 class OsmAbbrParser(object):
     """
     Convert long OSM types and directions to their proper abbreviated forms
     """
     this_module_dir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
 
-    def __init__(self):
+    # NOTE: bump the version whenever a parser change alters output (this invalidates any persistent rename memo)
+    version = "3"
+    csv_files = ('string_replace.csv', 'street_types.csv', 'dir_types.csv', 'string_ignore_replace.csv')
+
+    # NOTE: add chars here to allow these chars in a name / address without breaking the string (e.g., OMSI/SE)
+    name_chars = nums + alphas + u"á" + u"é" + u"¿" \
+                 "|" + "." + "," + "." + "'" + '"' + "&" + ";" + ":" + "#" + "@" + \
+                 "(" + ")" + "[" + "]" + "<" + ">" + "{" + "}" "/" + "\\" + "-" + "_" \
+                 "$" + "%" + "!" + "^" + "*" + "?" + "+" + "=" + "~" + "`"
+
+    def __init__(self, use_tokenizer=True):
         """
-        constructor builds the pyparsing parser
+        constructor builds the pyparsing parser (and the hand-written tokenizer that fronts it)
+        :param use_tokenizer: False will send every name to the pyparsing grammar
         """
 
         # step 1: load .csv files from ./config/ used for parsing, find/replace and string fixups
@@ -28,6 +51,12 @@ class OsmAbbrParser(object):
         self.str_ignore_kw,   self.str_ignore   = self.load_replace_csv('string_ignore_replace.csv')
         self.str_ignore_kw = self.str_ignore_kw.lower()
 
+        # step 1b: compile the .csv lists into hashed / multi-pattern lookup tables (keyed by the list of dicts)
+        self.tables = {}
+        for l in (self.str_replace, self.street_types, self.dir_types, self.str_ignore):
+            self.tables[id(l)] = ReplaceTable(l)
+        self.str_ignore_table = self.tables[id(self.str_ignore)]
+
         # step 2a: build the keyword list for street types from our .csv files
         st = map(CaselessKeyword, self.street_types_kw.split())
         type_ = Combine(MatchFirst(st) + Optional(".").suppress())
@@ -37,13 +66,7 @@ class OsmAbbrParser(object):
         prefix = Combine(StringStart() + MatchFirst(dt) + Optional(" ") + Optional(".").suppress())
         suffix = Combine(OneOrMore(MatchFirst(dt) + Optional(".").suppress()) + StringEnd())
 
-        # NOTE: add chars here to allow these chars in a name / address without breaking the string (e.g., OMSI/SE)
-        name_chars = nums + alphas + u"á" + u"é" + u"¿" \
-                     "|" + "." + "," + "." + "'" + '"' + "&" + ";" + ":" + "#" + "@" + \
-                     "(" + ")" + "[" + "]" + "<" + ">" + "{" + "}" "/" + "\\" + "-" + "_" \
-                     "$" + "%" + "!" + "^" + "*" + "?" + "+" + "=" + "~" + "`"
-
-        name_string = Word(name_chars)
+        name_string = Word(self.name_chars)
         street_name = (
                        Combine( 
                             OneOrMore(
@@ -74,6 +97,11 @@ class OsmAbbrParser(object):
                           | nm
         )
 
+        # step 3: fast path tokenizer for the common street name shapes (falls back to the grammar above)
+        self.tokenizer = None
+        if use_tokenizer:
+            self.tokenizer = StreetTokenizer(self.dir_types_kw.split(), self.street_types_kw.split(), self.name_chars)
+
     def parse(self, s):
         """
         Returns parsed address as dictionary
@@ -90,14 +118,16 @@ class OsmAbbrParser(object):
             r = ret_val
 
             # test whether this string is in our ignore list (e.g., South Shore Blvd) before sending to the parser
-            if s.lower() in self.str_ignore_kw:
+            if self.str_ignore_table.has(s):
                 d = self.csv_ignore_replace(self.str_ignore, s)
                 r['name'] = d['replace']
                 r['type'] = d['type']
                 r['prefix'] = d['prefix']
                 r['suffix'] = d['suffix']
             else:
-                p = self.streetAddress.parseString(s)
+                p = self.tokenizer.parse(s) if self.tokenizer else None
+                if p is None:
+                    p = self.streetAddress.parseString(s)
                 r['name'] = p.name
                 r['type'] = self.find_replace(self.street_types, p.type)
                 r['suffix'] = self.find_replace(self.dir_types,    p.suffix)
@@ -145,6 +175,46 @@ class OsmAbbrParser(object):
             log.debug(e)
         return ret_val
 
+    def to_str_many(self, names, workers=1):
+        """ batch version of to_str() ... returns a BatchResult of each unique name to its abbreviated string """
+        return self.batch('to_str', names, workers)
+
+    def dict_many(self, names, workers=1):
+        """ batch version of dict() ... returns a BatchResult of each unique name to its parsed dict """
+        return self.batch('dict', names, workers)
+
+    def batch(self, method, names, workers=1):
+        """ dedup the names, then run each unique name thru the named parser method (in a tight loop, or across a
+            pool of worker processes when workers > 1 ... worth it when most of the names are new to the caller)
+        """
+        ret_val = BatchResult()
+        unique = []
+        for n in names:
+            ret_val.num_total += 1
+            if n not in ret_val:
+                ret_val[n] = None
+                unique.append(n)
+        ret_val.num_unique = len(unique)
+
+        if workers > 1 and len(unique) > workers:
+            chunk_size = len(unique) // (workers * 4) + 1
+            chunks = [(method, unique[i:i + chunk_size]) for i in range(0, len(unique), chunk_size)]
+            pool = multiprocessing.Pool(workers, initializer=init_batch_worker)
+            try:
+                results = pool.map(batch_worker, chunks)
+            finally:
+                pool.close()
+                pool.join()
+            for (_, chunk), r in zip(chunks, results):
+                ret_val.update(zip(chunk, r))
+        else:
+            f = getattr(self, method)
+            for n in unique:
+                ret_val[n] = f(n)
+
+        log.info("{} parsed {} unique of {} names".format(method, ret_val.num_unique, ret_val.num_total))
+        return ret_val
+
     def do_label(self, s, t):
         ret_val = True
         s = s.lower()
@@ -175,8 +245,12 @@ class OsmAbbrParser(object):
         return ret_val
 
     def csv_ignore_replace(self, csv_list, value):
+        """ returns the first dict whose 'str' (or else 'replace') string is found within value
         """
-        """
+        table = self.tables.get(id(csv_list))
+        if table:
+            return table.find_contained(value)
+
         ret_val = None
         # search the 'str' column for a csv entry...
         for i, dic in enumerate(csv_list):
@@ -194,6 +268,10 @@ class OsmAbbrParser(object):
     def sub_str_replace(self, lst, value, justOnce=False):
         """ find a value in a list of dicts, key identifies what attribute of the dict to look at
         """
+        table = self.tables.get(id(lst))
+        if table:
+            return table.sub_str_replace(value, justOnce)
+
         ret_val = value
         for i, dic in enumerate(lst):
             if self.dict_find(dic, value):
@@ -205,6 +283,10 @@ class OsmAbbrParser(object):
     def find_list_pos(self, lst, key, value):
         """ find position of matching dict  in a list of dicts, key identifies what attribute of the dict to compare to the value
         """
+        table = self.tables.get(id(lst))
+        if table and key in ('str', 'replace'):
+            return table.find_pos(value, key)
+
         ret_val = -1
         for i, dic in enumerate(lst):
             if dic[key].strip().lower() == value.strip().lower():
@@ -218,6 +300,10 @@ class OsmAbbrParser(object):
 
             call find on the list, and when a match is found, the 'replace' attribute will be returned
         """
+        table = self.tables.get(id(lst))
+        if table:
+            return table.find_replace(value)
+
         i = self.find_list_pos(lst, 'str', value)
         if i == -1:
            i = self.find_list_pos(lst, 'replace', value)
@@ -226,6 +312,17 @@ class OsmAbbrParser(object):
         d = lst[i]
         return d['replace']
 
+    @classmethod
+    def config_key(cls):
+        """ returns a hash of the parser version and the contents of the .csv config files
+            (used to key caches of parser output, so that editing a .csv invalidates those caches)
+        """
+        h = hashlib.sha1(cls.version.encode('utf-8'))
+        for fn in cls.csv_files:
+            with open(os.path.join(cls.this_module_dir, 'config', fn), 'rb') as f:
+                h.update(f.read())
+        return h.hexdigest()
+
     def load_replace_csv(self, fn):
         """ returns a large string with the 'str' and 'replace' attributes concat'd together (used as keywords in pyparsing)
             returns a list of dicts of the form [{str:"XTC", replace:"Atom Ant"}, ...]
@@ -245,3 +342,18 @@ class OsmAbbrParser(object):
             l.append(row)
 
         return strings, l
+
+
+batch_parser = None
+
+
+def init_batch_worker():
+    global batch_parser
+    batch_parser = OsmAbbrParser()
+
+
+def batch_worker(task):
+    """ worker: run a chunk of names thru the named parser method """
+    method, names = task
+    f = getattr(batch_parser, method)
+    return [f(n) for n in names]
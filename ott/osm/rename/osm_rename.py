@@ -2,38 +2,37 @@
 # -*- coding: utf-8 -*-
 
 import sys
-try:
-    import xml.etree.cElementTree as ET
-except ImportError:
-    import xml.etree.ElementTree as ET
 
 from ott.utils import file_utils
 from ott.utils import date_utils
 
 from .osm_abbr_parser import OsmAbbrParser
+from .stream_rename import StreamRename
+from .stream_rename import RENAMED_BY
+from .rename_memo import RenameMemo
+from .parallel_rename import ParallelRename
+from .mmap_rename import MmapRename
 
 import logging
 log = logging.getLogger(__file__)
 
 
 class OsmRename(object):
-    """ Utility for getting stats on an osm file 
+    """ Utility for renaming (abbreviating) the streets in an osm file
     """
-    attrib = "streets renamed by OpenTransitTools on {}".format(date_utils.pretty_date())
-    bunchsize = 1000000
+    attrib = "{} on {}".format(RENAMED_BY, date_utils.pretty_date())
     rename_cache = {}
 
-    def __init__(self, osm_infile_path, osm_outfile_path, do_bkup=True):
+    def __init__(self, osm_infile_path, osm_outfile_path, do_bkup=True, memo_path=None, workers=1):
         """ this class will work to rename streets in OSM, abbreviating common street prefix and suffixes
             (e.g., North == N, Southeast == SE, Street == St, Avenue == Ave, etc...)
-            
-            :note this assumes that each OSM <tag /> falls completely upon a single line of the file 
-            and the parser / renamer will break if targeted tags are spread across multiple lines of the file
-
-            @todo look at SAX
-            https://gist.github.com/veryhappythings/98604
-            :todo ... add unit tests
-            TODO: fix up hacky parts...
+
+            :note the input is streamed through an xml (expat) state machine (see StreamRename), so the renamer
+            no longer cares how the <tag /> elements are laid out on the lines of the file
+
+            :param memo_path: optional path to a persistent (sqlite) memo of street renames, shared across runs
+            :param workers: number of processes to rename with (see ParallelRename) ... output is the same either way
+            :note a .pbf input file is renamed in place on its PrimitiveBlocks (see PbfRename), without going to xml
         """
         self.osm_input_path = osm_infile_path
         if osm_outfile_path is None or len(osm_outfile_path) == 0:
@@ -45,125 +44,105 @@ class OsmRename(object):
         else:
             self.osm_output_path = osm_outfile_path
 
+        self.workers = workers
+        self.num_processed = 0
+        self.new_renames = {}
         self.abbr_parser = OsmAbbrParser()
+
+        memo = None
+        if memo_path:
+            memo = RenameMemo(memo_path, self.abbr_parser.config_key())
+            self.rename_cache.update(memo.load())
+
         self.process_osm_file()
 
+        if memo:
+            memo.save(self.new_renames)
+            memo.close()
+
         if is_same_input_output:
             if do_bkup:
                 file_utils.bkup(osm_outfile_path)
             file_utils.mv(self.osm_output_path, osm_outfile_path)
 
     def process_osm_file(self):
-        """ read input xml file line by line.  where we encounter street element tags, look to rename 
-            the 'v' attribute (e.g, street name) with 
-        """
-        bunch = []
-        do_rename = False
-        is_inside_way = False
-        with open(self.osm_input_path, "r") as r, open(self.osm_output_path, "w") as w:
-            for line_num, line in enumerate(r):
-                # step 1: check to see if this .osm file has already been renamed
-                if not do_rename and "<osm " in line:
-                    if not self.attrib in line:
-                        line = add_xml_attribute_to_osm_tag(line, line_num)
-                        do_rename = True
-
-                # step 2: run rename method(s) for this line in the text (xml) file
-                if do_rename:
-                    if "addr:street" in line:
-                        line = self.process_streetname_str(line, line_num, "addr:street")
-                    if is_inside_way:
-                        if '<tag k="name"' in line or '<tag k="name_' in line:
-                            line = self.process_streetname_str(line, line_num, "way:name")
-                        elif '<tag k="alt_name' in line:
-                            line = self.process_streetname_str(line, line_num, "way:alt_name")
-                        elif '<tag k="old_name' in line:
-                            line = self.process_streetname_str(line, line_num, "way:old_name")
-                        elif '<tag k="bridge:name' in line:
-                            line = self.process_streetname_str(line, line_num, "way:bridge:name")
-                        elif '<tag k="description' in line:
-                            line = self.process_streetname_str(line, line_num, "way:description")
-                        elif '<tag k="destination' in line:
-                            line = self.process_streetname_str(line, line_num, "way:destination")
-                    if '<way ' in line or '<relation ' in line:
-                        is_inside_way = True
-                    if '</way>' in line or '</relation>' in line:
-                        is_inside_way = False
-
-                    # remove ET xml (type html) side effects, so ending tags look trim & proper
-                    if line:
-                        line = line.replace(" />", "/>").replace("></tag>", "/>")
-
-                # step 3: buffer write the lines of the file to a new file
-                bunch.append(line)
-                if len(bunch) == self.bunchsize:
-                    w.writelines(bunch)
-                    bunch = []
-            w.writelines(bunch)
-
-    def process_streetname_str(self, line, line_num, type):
-        """ parse line of text into XML and look to rename the v attribute in the tag element """
-        ret_val = line
-
-        xml = ET.fromstring(line)
-        val = xml.get('v')
-        if val:
-            if len(val) > 0:
-                self.rename_xml_value_attirbute(xml, line_num)
-                xml_str = ET.tostring(xml, encoding="UTF-8", method="html")
-                ret_val = "    {}\n".format(xml_str)
-            else:
-                log.warning("{} (line {}) xml element {} found an empty street name value".format(type, line_num, xml.attrib))
-        else:
-            log.warning("{} (line {}) xml element {} is without a value attribute".format(type, line_num, xml.attrib))
-
-        return ret_val
+        """ stream the input xml file thru the rename state machine, where street element tags get their
+            'v' attribute (e.g, street name) renamed, and everything else is copied verbatim to the output file
 
-    def rename_xml_value_attirbute(self, xml, line_num):
-        """ rename the 'v' value attirbute in this xml element tag """
-        street_name = xml.attrib['v']
-        if street_name in self.rename_cache:
-            xml.attrib['v'] = self.rename_cache[street_name]
-            if line_num % 111 == 0:
+            :note the byte-level MmapRename is tried first, and the (expat) StreamRename handles what it can't ...
+                  MmapRename pre-scans the street names, so any new names are parsed in one batch up front
+        """
+        if self.osm_input_path.endswith(".pbf"):
+            self.process_pbf_file()
+            return
+
+        if self.workers > 1:
+            p = ParallelRename(self.rename_cache, self.attrib, self.workers)
+            new_renames = p.process(self.osm_input_path, self.osm_output_path)
+            if new_renames is not None:
+                self.rename_cache.update(new_renames)
+                self.new_renames.update(new_renames)
+                log.info("renamed {} with {} workers ({} new street names)".format(self.osm_input_path, self.workers, len(new_renames)))
+                return
+
+        m = MmapRename(self.rename_street_name, attrib=self.attrib)
+        num_renamed = m.rename(self.osm_input_path, self.osm_output_path, prescan=self.batch_rename)
+        if num_renamed is None:
+            with open(self.osm_input_path, "rb") as r, open(self.osm_output_path, "wb") as w:
+                s = StreamRename(self.rename_street_name, attrib=self.attrib)
+                num_renamed = s.process(r, w)
+        log.info("renamed {} of {} street name tags in {}".format(num_renamed, self.num_processed, self.osm_input_path))
+
+    def process_pbf_file(self):
+        """ rename the street names in the string tables of a .pbf file's blocks """
+        from .pbf_rename import PbfRename
+        with open(self.osm_input_path, "rb") as r, open(self.osm_output_path, "wb") as w:
+            # note: each block has its own string table, so a name is looked up once per block it's in
+            names = set()
+
+            def rename(name):
+                names.add(name)
+                return self.rename_street_name(name)
+
+            p = PbfRename(rename, attrib=self.attrib)
+            num_renamed = p.process(r, w)
+        log.info("renamed {} street name tags ({} distinct names) in {}".format(num_renamed, len(names), self.osm_input_path))
+
+    def batch_rename(self, names):
+        """ parse all the (new) names in one batch, so the rename pass is just cache lookups """
+        batch = self.abbr_parser.to_str_many(n for n in names if n not in self.rename_cache)
+        self.rename_cache.update(batch)
+        self.new_renames.update(batch)
+        log.info("{} distinct street names in {}, and {} of those were new".format(len(names), self.osm_input_path, batch.num_unique))
+
+    def rename_street_name(self, street_name):
+        """ return the renamed (abbreviated) street name, via the cache or the abbreviation parser """
+        self.num_processed += 1
+        rename = self.rename_cache.get(street_name)
+        if rename is not None:
+            if self.num_processed % 111 == 0:
                 sys.stdout.write(":")
                 sys.stdout.flush()
         else:
             rename = self.abbr_parser.to_str(street_name)
-            xml.set('v', rename)
             self.rename_cache[street_name] = rename
-            if line_num % 111 == 0:
+            self.new_renames[street_name] = rename
+            if self.num_processed % 111 == 0:
                 sys.stdout.write(".")
                 sys.stdout.flush()
+        return rename
 
     @classmethod
-    def rename(cls, osm_infile_path, osm_outfile_path=None, do_bkup=True):
+    def rename(cls, osm_infile_path, osm_outfile_path=None, do_bkup=True, memo_path=None, workers=1):
         """ 
         """
         ret_val = None
         if osm_outfile_path is None:
             osm_outfile_path = osm_infile_path
-        ret_val = OsmRename(osm_infile_path, osm_outfile_path, do_bkup=do_bkup)
+        ret_val = OsmRename(osm_infile_path, osm_outfile_path, do_bkup=do_bkup, memo_path=memo_path, workers=workers)
         return ret_val
 
 
-def add_xml_attribute_to_osm_tag(line, line_num, attribute_name="generator", attribute_val=OsmRename.attrib, append=True):
-    """ a bit hacky <osm> element editing """
-    ret_val = line
-    try:
-        # import pdb; pdb.set_trace()
-        xml = ET.fromstring(line + "</osm>")  # need to fake close elem for ET, since real close is 1000s of lines away
-        curr_val = xml.get(attribute_name)
-        if append:
-            attribute_val = "{}; {}".format(curr_val, attribute_val)
-        xml.set(attribute_name, attribute_val)
-        ret_val = ET.tostring(xml, encoding="unicode")
-        ret_val = ret_val.replace("</osm>", "").replace("/>", ">")
-    except Exception as e:
-        log.warning("couldn't add attribute {} to xml element on line number {}".format(attribute_name, line_num))
-        log.warning(e)
-    return ret_val
-
-
 def main():
     """ cmd line processor """
     from ott.utils.parse.cmdline import osm_cmdline
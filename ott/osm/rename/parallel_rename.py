@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+import os
+import mmap
+import shutil
+import multiprocessing
+
+from ott.osm.osm_sections import find_body_span
+from ott.osm.osm_sections import split_body
+
+from .osm_abbr_parser import OsmAbbrParser
+from .stream_rename import StreamRename
+
+import logging
+log = logging.getLogger(__file__)
+
+
+class RangeRenamer(object):
+    """ per worker process street renamer, seeded with the shared renames and collecting any new renames """
+    def __init__(self, rename_cache):
+        self.abbr_parser = OsmAbbrParser()
+        self.rename_cache = rename_cache
+        self.new_renames = {}
+
+    def rename_street_name(self, street_name):
+        rename = self.rename_cache.get(street_name)
+        if rename is None:
+            rename = self.abbr_parser.to_str(street_name)
+            self.rename_cache[street_name] = rename
+            self.new_renames[street_name] = rename
+        return rename
+
+
+range_renamer = None
+
+
+def init_worker(rename_cache):
+    global range_renamer
+    range_renamer = RangeRenamer(rename_cache)
+
+
+def rename_range(task):
+    """ worker: rename a byte range of the input .osm file into its own part file
+        :return the new renames (names that weren't in the shared renames) from this range
+    """
+    in_path, part_path, start, end = task
+    with open(in_path, "rb") as r, open(part_path, "wb") as w:
+        r.seek(start)
+        s = StreamRename(range_renamer.rename_street_name)
+        s.process_fragment(r, w, end - start)
+
+    ret_val = range_renamer.new_renames
+    range_renamer.new_renames = {}
+    return ret_val
+
+
+class ParallelRename(object):
+    """ rename an .osm file with a pool of worker processes
+
+        the body of the .osm file is split into byte ranges that begin on <node>, <way> or <relation> elements,
+        and each range is streamed thru its own StreamRename in a worker process.  the <osm> header (and its
+        generator attribute) is handled once here, and the renamed parts are concatenated in order, so the output
+        is byte-identical to a single StreamRename of the whole file.
+    """
+    ranges_per_worker = 4
+
+    def __init__(self, rename_cache, attrib, workers):
+        self.rename_cache = rename_cache
+        self.attrib = attrib
+        self.workers = workers
+
+    def process(self, in_path, out_path):
+        """ :return dict of new renames ... or None when the file can't be split (caller should rename serially) """
+        if os.path.getsize(in_path) == 0:
+            return None
+
+        with open(in_path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            span = find_body_span(mm)
+            if span is None:
+                return None
+            body_start, body_end = span
+
+            with open(out_path, "wb") as w:
+                # step 1: the <osm> header, where the generator attribute gets marked (or says we're already renamed)
+                s = StreamRename(lambda n: n, attrib=self.attrib)
+                s.feed(mm[:body_start], w)
+                s.flush_all(w)
+                if not s.do_rename:
+                    with open(in_path, "rb") as r:
+                        r.seek(body_start)
+                        shutil.copyfileobj(r, w, StreamRename.chunk_size)
+                    return {}
+
+                # step 2: rename the body ranges in the worker pool
+                ranges = split_body(mm, body_start, body_end, self.workers * self.ranges_per_worker)
+                tasks = []
+                for i, (start, end) in enumerate(ranges):
+                    tasks.append((in_path, "{}.part{}".format(out_path, i), start, end))
+                log.info("renaming {} in {} ranges with {} workers".format(in_path, len(tasks), self.workers))
+
+                pool = multiprocessing.Pool(self.workers, initializer=init_worker, initargs=(self.rename_cache,))
+                try:
+                    results = pool.map(rename_range, tasks, chunksize=1)
+                finally:
+                    pool.close()
+                    pool.join()
+
+                # step 3: concatenate the renamed parts (in order), then the tail of the file
+                for t in tasks:
+                    with open(t[1], "rb") as r:
+                        shutil.copyfileobj(r, w, StreamRename.chunk_size)
+                    os.remove(t[1])
+                w.write(mm[body_end:])
+        finally:
+            mm.close()
+
+        ret_val = {}
+        for r in results:
+            ret_val.update(r)
+        return ret_val
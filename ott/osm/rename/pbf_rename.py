@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+import shutil
+
+from ott.osm.pbf_blocks import FileBlock
+from ott.osm.pbf_blocks import read_file_blocks
+from ott.osm.pbf_blocks import OSM_HEADER
+from ott.osm.pbf_blocks import OSM_DATA
+
+from .stream_rename import RENAMED_BY
+from .stream_rename import is_renamed
+from .stream_rename import is_street_name_key
+
+import logging
+log = logging.getLogger(__file__)
+
+
+class PbfRename(object):
+    """ street renamer for .osm.pbf files, that works on the PrimitiveBlocks directly (no xml round trip)
+
+        the tag keys and values of a PrimitiveBlock are indexes into the block's string table, so each distinct
+        street name in a block is renamed once, by rewriting its string table entry.  when that same entry is
+        also used by something that isn't renamed (e.g., a node's name, or a user name), the new name is
+        appended to the string table instead, and just the street name tags are pointed at it.
+
+        blocks without any renames are copied to the output as-is (still compressed).  the HeaderBlock's
+        writingprogram gets the 'renamed' marker, same as the <osm generator=""> attribute of an .osm file.
+    """
+    def __init__(self, rename_func, attrib=RENAMED_BY, compress_level=6):
+        self.rename_func = rename_func
+        self.attrib = attrib
+        self.compress_level = compress_level
+        self.do_rename = True
+        self.num_renamed = 0
+        self.num_blocks = 0
+        self.num_blocks_renamed = 0
+
+    def process(self, r, w):
+        """ rename streets in .pbf file object r (opened 'rb'), writing the results to file object w (opened 'wb') """
+        for fb in read_file_blocks(r):
+            if fb.type == OSM_HEADER:
+                fb = self.mark_header(fb)
+            elif fb.type == OSM_DATA and self.do_rename:
+                fb = self.rename_file_block(fb)
+            fb.write_to(w)
+            if not self.do_rename:
+                # already renamed: just copy the rest of the file
+                shutil.copyfileobj(r, w)
+                break
+        log.info("renamed streets in {} of {} .pbf blocks".format(self.num_blocks_renamed, self.num_blocks))
+        return self.num_renamed
+
+    def mark_header(self, fb):
+        """ append our 'renamed' marker to the HeaderBlock's writingprogram ... or turn off renaming if it's there """
+        header = fb.header_block()
+        if is_renamed(header.writingprogram):
+            log.info("writingprogram '{}' says this file was already renamed".format(header.writingprogram))
+            self.do_rename = False
+            return fb
+
+        if header.writingprogram:
+            header.writingprogram = "{}; {}".format(header.writingprogram, self.attrib)
+        else:
+            header.writingprogram = self.attrib
+        return FileBlock.from_block(OSM_HEADER, header, self.compress_level)
+
+    def rename_file_block(self, fb):
+        self.num_blocks += 1
+        block = fb.primitive_block()
+        if self.rename_block(block) == 0:
+            return fb
+        self.num_blocks_renamed += 1
+        return FileBlock.from_block(OSM_DATA, block, self.compress_level)
+
+    def rename_block(self, block):
+        """ rename the street name values in a PrimitiveBlock's string table
+            :return number of street name tags renamed in this block
+        """
+        strings = block.stringtable.s
+        keys = {}
+
+        def is_street(k, is_inside_way):
+            key = keys.get(k)
+            if key is None:
+                key = keys[k] = strings[k].decode('utf-8')
+            return is_street_name_key(key, is_inside_way)
+
+        # step 1: find the street name values (as (repeated field, position) refs), and all other string uses
+        street_refs = []
+        other_uses = set()
+        for group in block.primitivegroup:
+            for elements, is_inside_way in ((group.nodes, False), (group.ways, True), (group.relations, True)):
+                for e in elements:
+                    for i, k in enumerate(e.keys):
+                        other_uses.add(k)
+                        if is_street(k, is_inside_way):
+                            street_refs.append((e.vals, i))
+                        else:
+                            other_uses.add(e.vals[i])
+                    other_uses.add(e.info.user_sid)
+            for e in group.relations:
+                other_uses.update(e.roles_sid)
+
+            dense = group.dense
+            kv = dense.keys_vals
+            i = 0
+            while i < len(kv):
+                if kv[i] == 0:
+                    i += 1
+                    continue
+                other_uses.add(kv[i])
+                if is_street(kv[i], False):
+                    street_refs.append((kv, i + 1))
+                else:
+                    other_uses.add(kv[i + 1])
+                i += 2
+            user_sid = 0
+            for d in dense.denseinfo.user_sid:
+                user_sid += d
+                other_uses.add(user_sid)
+
+        # step 2: rename each distinct street name once, and rewrite (or append) its string table entry
+        renames = {}
+        for field, i in street_refs:
+            s = field[i]
+            if s in renames or s == 0:
+                continue
+            name = strings[s].decode('utf-8')
+            rename = self.rename_func(name) if len(name) > 0 else name
+            if rename == name:
+                renames[s] = None
+            elif s in other_uses:
+                strings.append(rename.encode('utf-8'))
+                renames[s] = len(strings) - 1
+            else:
+                strings[s] = rename.encode('utf-8')
+                renames[s] = s
+
+        # step 3: point the street name tags at their renamed string table entries (and count them)
+        ret_val = 0
+        for field, i in street_refs:
+            r = renames.get(field[i])
+            if r is not None:
+                field[i] = r
+                ret_val += 1
+        self.num_renamed += ret_val
+        return ret_val
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+import sqlite3
+
+import logging
+log = logging.getLogger(__file__)
+
+
+class RenameMemo(object):
+    """
+    Persistent (sqlite) memo of original street name to renamed (abbreviated) street name, shared across runs
+
+    The memo is stamped with a key (see OsmAbbrParser.config_key()), which is a hash of the rename .csv configs
+    and the parser version.  Opening the memo with a different key (e.g., someone edited a .csv file) empties it.
+    """
+    def __init__(self, memo_path, key):
+        self.memo_path = memo_path
+        self.key = key
+        self.db = sqlite3.connect(memo_path)
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (k TEXT PRIMARY KEY, v TEXT)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS memo (name TEXT PRIMARY KEY, rename TEXT)")
+
+        row = self.db.execute("SELECT v FROM meta WHERE k = 'key'").fetchone()
+        if row is None or row[0] != key:
+            if row is not None:
+                log.info("rename config changed ({} != {}), so clearing memo {}".format(row[0], key, memo_path))
+            self.db.execute("DELETE FROM memo")
+            self.db.execute("INSERT OR REPLACE INTO meta (k, v) VALUES ('key', ?)", (key,))
+        self.db.commit()
+
+    def load(self):
+        """ :return dict of all the memo'd names """
+        return dict(self.db.execute("SELECT name, rename FROM memo"))
+
+    def save(self, renames):
+        """ add a dict of name to rename to the memo """
+        if renames:
+            self.db.executemany("INSERT OR REPLACE INTO memo (name, rename) VALUES (?, ?)", renames.items())
+            self.db.commit()
+            log.info("saved {} new renames to memo {}".format(len(renames), self.memo_path))
+
+    def close(self):
+        self.db.close()
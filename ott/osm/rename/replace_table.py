@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+import re
+
+
+class SubStringMatcher(object):
+    """
+    Finds which of a list of (lower case) patterns occur as sub-strings of a value, in one pass of a combined regex
+
+    The regex is a zero-width look-ahead over all the patterns (longest first), so each position of the value
+    reports the longest pattern starting there.  Any shorter pattern that also matches is a sub-string of that
+    longest one, so each pattern carries a (pre-computed) list of the patterns it contains.
+    """
+    def __init__(self, patterns):
+        self.always = []
+        rows_by_pattern = {}
+        for i, p in enumerate(patterns):
+            if len(p) == 0:
+                self.always.append(i)  # note: an empty pattern is a sub-string of everything
+            else:
+                rows_by_pattern.setdefault(p, []).append(i)
+
+        uniq = sorted(rows_by_pattern, key=len, reverse=True)
+        self.contains = {}
+        for p in uniq:
+            self.contains[p] = [i for q in uniq if q in p for i in rows_by_pattern[q]]
+
+        self.regex = None
+        if uniq:
+            self.regex = re.compile(u"(?=({}))".format(u"|".join(re.escape(p) for p in uniq)))
+
+    def find(self, value):
+        """ returns the (sorted) positions of the patterns that are sub-strings of value """
+        if self.regex is None:
+            return self.always
+        found = set(self.always)
+        seen = set()
+        for m in self.regex.finditer(value.lower()):
+            p = m.group(1)
+            if p not in seen:
+                seen.add(p)
+                found.update(self.contains[p])
+        return sorted(found)
+
+
+class ReplaceTable(object):
+    """
+    Compiled lookups over the list of dicts loaded from one of the ./config/*.csv replace files
+
+    Built once, the table has dicts keyed by the normalized (stripped, lower case) 'str' and 'replace' columns,
+    plus sub-string matchers for each column, so lookups don't re-scan (and re-lower-case) every csv row per call.
+    """
+    def __init__(self, rows):
+        self.rows = rows
+        self.str_index = self.make_index('str')
+        self.replace_index = self.make_index('replace')
+        self.str_matcher = SubStringMatcher([r['str'].lower() for r in rows])
+        self.replace_matcher = SubStringMatcher([r['replace'].lower() for r in rows])
+
+    def make_index(self, col):
+        """ dict of normalized column value to the position of the first csv row having that value """
+        ret_val = {}
+        for i, row in enumerate(self.rows):
+            ret_val.setdefault(row[col].strip().lower(), i)
+        return ret_val
+
+    def find_pos(self, value, col='str'):
+        """ position of first row whose column matches (case insensitive) the value ... or -1 if not found """
+        index = self.str_index if col == 'str' else self.replace_index
+        return index.get(value.strip().lower(), -1)
+
+    def find_replace(self, value):
+        """ returns the 'replace' string of the row matching value in either the 'str' or 'replace' column
+            returns the passed in value if not found
+        """
+        i = self.find_pos(value, 'str')
+        if i == -1:
+            i = self.find_pos(value, 'replace')
+        if i == -1:
+            return value
+        return self.rows[i]['replace']
+
+    def has(self, value):
+        """ is value (exactly, ignoring case) one of the 'str' or 'replace' entries of this table """
+        v = value.strip().lower()
+        return len(v) > 0 and (v in self.str_index or v in self.replace_index)
+
+    def find_contained(self, value):
+        """ returns the first row whose 'str' (or else 'replace') column is a sub-string of value ... or None """
+        ret_val = None
+        pos = self.str_matcher.find(value)
+        if not pos:
+            pos = self.replace_matcher.find(value)
+        if pos:
+            ret_val = self.rows[pos[0]]
+        return ret_val
+
+    def sub_str_replace(self, value, justOnce=False):
+        """ replace the 'str' of each row found in value with that row's 'replace' string (in csv order) """
+        ret_val = value
+        for i in self.str_matcher.find(value):
+            row = self.rows[i]
+            ret_val = ret_val.replace(row['str'], row['replace'], 1)
+            if justOnce:
+                break
+        return ret_val
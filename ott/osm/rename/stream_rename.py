@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+import re
+import shutil
+from xml.parsers import expat
+
+from ott.osm.osm_sections import FRAGMENT_OPEN
+from ott.osm.osm_sections import FRAGMENT_CLOSE
+
+import logging
+log = logging.getLogger(__file__)
+
+
+# marker added to the <osm generator="..."> attribute once a file has been renamed
+RENAMED_BY = "streets renamed by OpenTransitTools"
+
+# <tag k="..."> keys (or key prefixes) whose values get renamed when the tag belongs to a <way> or <relation>
+WAY_NAME_KEY = "name"
+WAY_NAME_KEY_PREFIXES = ("name_", "alt_name", "old_name", "bridge:name", "description", "destination")
+
+# attribute scanner used to find the byte span of an attribute value within a start tag
+ATTR_RE = re.compile(br'\s+([^\s=/>]+)\s*=\s*("[^"]*"|\'[^\']*\')')
+
+# '<' and the element name of a start tag (the attributes follow, after any xml whitespace)
+ELEMENT_NAME_RE = re.compile(br'<[^\s/>]+')
+
+XML_ESCAPES = (("&", "&amp;"), ("<", "&lt;"), (">", "&gt;"), ("\t", "&#9;"), ("\n", "&#10;"), ("\r", "&#13;"))
+
+
+def is_street_name_key(key, is_inside_way):
+    """ True if the value of a <tag k="key"> element is a street name that should be renamed """
+    if "addr:street" in key:
+        return True
+    if is_inside_way:
+        return key == WAY_NAME_KEY or key.startswith(WAY_NAME_KEY_PREFIXES)
+    return False
+
+
+def is_renamed(generator):
+    """ True if the <osm generator="..."> attribute says this file was already renamed """
+    return generator is not None and RENAMED_BY in generator
+
+
+def escape_attr_value(value, quote='"'):
+    """ escape a str for use as an xml attribute value (quoted with the quote character) """
+    for c, e in XML_ESCAPES:
+        value = value.replace(c, e)
+    if quote == '"':
+        value = value.replace('"', "&quot;")
+    else:
+        value = value.replace("'", "&apos;")
+    return value
+
+
+def find_attr_span(buf, tag_start, attr_name):
+    """ return the (start, end, quote) byte span of an attribute's value in the start tag beginning at tag_start
+        :note the span excludes the quote characters ... returns None if the attribute isn't in the tag
+    """
+    ret_val = None
+    name = ELEMENT_NAME_RE.match(buf, tag_start)
+    if name is None:
+        return ret_val
+
+    # note: each attribute match starts where the last one ended, so the scan stops at this tag's '>' or '/>'
+    i = name.end()
+    attr_name = attr_name.encode("utf-8")
+    while True:
+        m = ATTR_RE.match(buf, i)
+        if m is None:
+            break
+        if m.group(1) == attr_name:
+            ret_val = m.start(2) + 1, m.end(2) - 1, m.group(2)[:1].decode("utf-8")
+            break
+        i = m.end()
+    return ret_val
+
+
+class StreamRename(object):
+    """ streaming street renamer for .osm (xml) files
+
+        an expat (SAX) state machine walks the element events of the input file.  the input bytes are copied to
+        the output verbatim, except for the 'v' attribute values of street name <tag> elements (and the <osm>
+        generator attribute), which are spliced in place.  memory use is constant (one read chunk, plus the bytes
+        of the element currently being parsed), and the output doesn't depend on how the xml is laid out on lines.
+    """
+    chunk_size = 4 * 1024 * 1024
+
+    def __init__(self, rename_func, attrib=RENAMED_BY, encoding="utf-8"):
+        """
+        :param rename_func: callable that takes a street name str and returns the renamed str
+        :param attrib: text appended to the <osm> generator attribute, marking the output as renamed
+        """
+        self.rename_func = rename_func
+        self.attrib = attrib
+        self.encoding = encoding
+
+        self.do_rename = True
+        self.mark_osm = True
+        self.is_inside_way = False
+        self.num_renamed = 0
+
+        self.buf = bytearray()
+        self.buf_start = 0
+        self.safe_pos = 0
+        self.edits = []
+
+        self.parser = expat.ParserCreate()
+        self.parser.StartElementHandler = self.start_element
+        self.parser.EndElementHandler = self.end_element
+
+    def start_element(self, name, attrs):
+        pos = self.parser.CurrentByteIndex
+        self.safe_pos = pos
+        if name == 'tag':
+            if self.do_rename:
+                k = attrs.get('k')
+                if k and is_street_name_key(k, self.is_inside_way):
+                    self.rename_tag(pos, attrs)
+        elif name == 'way' or name == 'relation':
+            self.is_inside_way = True
+        elif name == 'osm' and self.mark_osm:
+            self.mark_osm_element(pos, attrs)
+
+    def end_element(self, name):
+        if name == 'way' or name == 'relation':
+            self.is_inside_way = False
+
+    def rename_tag(self, pos, attrs):
+        """ rename the 'v' attribute value of the <tag> element starting at byte pos """
+        val = attrs.get('v')
+        if val is None:
+            log.warning("xml element {} (byte {}) is without a value attribute".format(attrs, pos))
+        elif len(val) == 0:
+            log.warning("xml element {} (byte {}) found an empty street name value".format(attrs, pos))
+        else:
+            rename = self.rename_func(val)
+            if rename != val:
+                span = find_attr_span(self.buf, pos - self.buf_start, 'v')
+                if span:
+                    start, end, quote = span
+                    value = escape_attr_value(rename, quote).encode(self.encoding)
+                    self.edits.append((start + self.buf_start, end + self.buf_start, value))
+                    self.num_renamed += 1
+
+    def mark_osm_element(self, pos, attrs):
+        """ append our 'renamed' marker to the <osm generator=""> attribute ... or turn off renaming if it's there """
+        generator = attrs.get('generator')
+        if is_renamed(generator):
+            log.info("generator '{}' says this file was already renamed".format(generator))
+            self.do_rename = False
+            return
+
+        rel = pos - self.buf_start
+        if generator is None:
+            end = rel + len(b"<osm")
+            value = ' generator="{}"'.format(escape_attr_value(self.attrib)).encode(self.encoding)
+            self.edits.append((end + self.buf_start, end + self.buf_start, value))
+        else:
+            start, end, quote = find_attr_span(self.buf, rel, 'generator')
+            value = escape_attr_value("{}; {}".format(generator, self.attrib), quote).encode(self.encoding)
+            self.edits.append((start + self.buf_start, end + self.buf_start, value))
+
+    def flush(self, w, upto):
+        """ write the buffered input bytes (with edits applied) up to absolute byte offset upto """
+        if upto <= self.buf_start:
+            return
+        pos = self.buf_start
+        pending = []
+        for start, end, value in self.edits:
+            if start >= upto:
+                pending.append((start, end, value))
+                continue
+            w.write(self.buf[pos - self.buf_start:start - self.buf_start])
+            w.write(value)
+            pos = end
+        self.edits = pending
+        w.write(self.buf[pos - self.buf_start:upto - self.buf_start])
+        del self.buf[:upto - self.buf_start]
+        self.buf_start = upto
+
+    def feed(self, chunk, w):
+        """ parse the next chunk of input bytes, and write out everything that's been completely parsed """
+        self.buf += chunk
+        self.parser.Parse(chunk, False)
+        self.flush(w, self.safe_pos)
+
+    def flush_all(self, w):
+        """ write out all the buffered input bytes """
+        self.flush(w, self.buf_start + len(self.buf))
+
+    def process(self, r, w):
+        """ rename streets in file object r (opened 'rb'), writing the results to file object w (opened 'wb') """
+        while True:
+            chunk = r.read(self.chunk_size)
+            if len(chunk) == 0:
+                self.parser.Parse(chunk, True)
+                self.flush_all(w)
+                break
+            self.feed(chunk, w)
+            if not self.do_rename:
+                # already renamed: no need to parse further, so just copy the rest of the file
+                self.flush_all(w)
+                shutil.copyfileobj(r, w, self.chunk_size)
+                break
+        return self.num_renamed
+
+    def process_fragment(self, r, w, length):
+        """ rename the next length bytes of r, which must be a run of complete top-level elements
+            (e.g., a byte range of <node>, <way> and <relation> elements from the body of an .osm file)
+
+            :note: the fragment is wrapped in a fake <osm> element for the xml parser, and that wrapper isn't output
+        """
+        self.mark_osm = False
+        self.parser.Parse(FRAGMENT_OPEN, False)
+        self.buf_start = self.safe_pos = len(FRAGMENT_OPEN)
+        while length > 0:
+            chunk = r.read(min(self.chunk_size, length))
+            if len(chunk) == 0:
+                break
+            length -= len(chunk)
+            self.feed(chunk, w)
+        self.parser.Parse(FRAGMENT_CLOSE, True)
+        self.flush_all(w)
+        return self.num_renamed
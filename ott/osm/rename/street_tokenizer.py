@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+from collections import namedtuple
+
+from pyparsing import Keyword
+
+
+StreetTokens = namedtuple('StreetTokens', ['prefix', 'name', 'type', 'suffix'])
+
+DIR = 'dir'
+TYPE = 'type'
+NAME = 'name'
+
+
+class StreetTokenizer(object):
+    """
+    Hand-written fast path for the OsmAbbrParser.streetAddress (pyparsing) grammar
+
+    Handles the common street name shape -- optional prefix, name tokens, optional type -- with token set lookups.
+    Each space separated token is classified as a direction (dir_types.csv keyword), a street type
+    (street_types.csv keyword) or a plain name token, and the grammar's answer is assembled from those classes:
+       - a leading direction is the prefix (as long as a name remains)
+       - a trailing street type is the type (as long as a name remains)
+       - everything in between is the name (keywords in the name come back in their keyword .csv form)
+    note: the grammar never produces a suffix for space separated input (the suffix rule requires adjacent tokens)
+
+    parse() returns None for anything it isn't sure about (odd characters, odd spacing, tokens like 'N.W.' or
+    'St.Helens' where a keyword matches only part of the token, tokens that are both a direction and a type, etc...),
+    and the caller falls back to the pyparsing grammar.
+    """
+    ident_chars = frozenset(Keyword.DEFAULT_KEYWORD_CHARS.upper())
+
+    def __init__(self, dir_keywords, type_keywords, name_chars):
+        """
+        :param dir_keywords: list of direction keywords, in the same order they're given to the grammar
+        :param type_keywords: list of street type keywords, in the same order they're given to the grammar
+        :param name_chars: the characters the grammar allows in a name token
+        """
+        self.dirs = self.make_keyword_index(dir_keywords)
+        self.types = self.make_keyword_index(type_keywords)
+        self.name_chars = frozenset(name_chars)
+        self.max_keyword_len = max([len(k) for k in list(self.dirs) + list(self.types)] or [0])
+        self.token_cache = {}
+
+    @classmethod
+    def make_keyword_index(cls, keywords):
+        """ dict of upper case keyword to (position in keyword list, keyword) ... first keyword in the list wins """
+        ret_val = {}
+        for i, k in enumerate(keywords):
+            ret_val.setdefault(k.upper(), (i, k))
+        return ret_val
+
+    def match_keyword(self, index, token):
+        """ mimic pyparsing MatchFirst(CaselessKeyword(...)) at the start of token
+            :return (length of the match, keyword) or None
+        """
+        ret_val = None
+        first = None
+        up = token.upper()
+        for end in range(1, min(len(up), self.max_keyword_len) + 1):
+            if end < len(up) and up[end] in self.ident_chars:
+                continue  # keywords only match up to a word boundary
+            k = index.get(up[:end])
+            if k and (first is None or k[0] < first[0]):
+                first = k
+                ret_val = end, k[1]
+        return ret_val
+
+    def classify(self, token):
+        """ :return (class, keyword) for the token ... or None when the token is ambiguous """
+        ret_val = self.token_cache.get(token)
+        if ret_val is None and token not in self.token_cache:
+            classes = []
+            for cls, index in ((DIR, self.dirs), (TYPE, self.types)):
+                m = self.match_keyword(index, token)
+                if m:
+                    length, keyword = m
+                    if length == len(token) or (length + 1 == len(token) and token[-1] == '.'):
+                        classes.append((cls, keyword))
+                    else:
+                        classes = None  # keyword matches just the start of the token, ala 'N.W.' or 'Ave-85th'
+                        break
+            if classes is None or len(classes) > 1:
+                ret_val = None
+            elif len(classes) == 1:
+                ret_val = classes[0]
+            else:
+                ret_val = (NAME, None)
+            self.token_cache[token] = ret_val
+        return ret_val
+
+    def parse(self, s):
+        """ :return StreetTokens for the string, or None if the pyparsing grammar should handle it """
+        tokens = s.split(' ')
+        classes = []
+        for t in tokens:
+            if len(t) == 0:
+                return None
+            for c in t:
+                if c not in self.name_chars:
+                    return None
+            c = self.classify(t)
+            if c is None:
+                return None
+            classes.append(c)
+
+        n = len(tokens)
+        if n == 1 and classes[0][0] == TYPE:
+            return None  # the grammar can't parse a lone street type
+
+        # step 1: leading direction is the prefix, unless it would leave only a street type for the name
+        prefix = ''
+        start = 0
+        if n > 1 and classes[0][0] == DIR and not (n == 2 and classes[1][0] == TYPE):
+            prefix = classes[0][1]
+            start = 1
+
+        # step 2: trailing street type (when a name is left over)
+        type_ = ''
+        end = n
+        if n - start > 1 and classes[-1][0] == TYPE:
+            type_ = classes[-1][1]
+            end = n - 1
+
+        # step 3: name is everything else ... street types within the name come back as the keyword
+        name = []
+        for i in range(start, end):
+            cls, keyword = classes[i]
+            name.append(keyword if cls == TYPE else tokens[i])
+
+        return StreetTokens(prefix, ' '.join(name), type_, '')
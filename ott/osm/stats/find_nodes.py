@@ -1,38 +1,81 @@
-from osmread import parse_file, Way
-
-from ott.utils import json_utils
-from ott.utils import date_utils
 from ott.utils import file_utils
 
+from ott.osm.stats.tag_index import TagIndex
+
 import logging
 logging.basicConfig()
 log = logging.getLogger(__file__)
 
+
 class NodeInfo(object):
     node = None
     node_id = None
     tag_name = None
     tag_value = None
 
+    def __init__(self, node=None):
+        """ :param node: TagIndex.find() element dict """
+        if node:
+            self.node = node
+            self.node_id = node.get('id')
+            self.tag_name = node.get('tag_name')
+            self.tag_value = node.get('tag_value')
+
+    def __repr__(self):
+        return "{}".format(self.node)
+
 
 class FindNodes(object):
     """
-    Utility for finding OSM elements
+    Utility for finding OSM elements ... queries go against a TagIndex of the .osm file, which is built (one read
+    of the .osm file) and saved to <osm file>-tags the first time it's needed, then memory-mapped on later queries
     """
     def __init__(self, osm_file):
         self.osm_file = osm_file
-        self.osm_path = osm_file # TODO
 
     @classmethod
-    def find(cls, osm_file, tag_name, value_value=('yes', 'true')):
-        """ will find nodes with """
-        pass
+    def get_index_path(cls, osm_file):
+        return osm_file + "-tags"
 
+    @classmethod
+    def get_index(cls, osm_file, index_path=None):
+        """ :return TagIndex of the .osm file ... (re)built when there's no index file newer than the .osm file """
+        if index_path is None:
+            index_path = cls.get_index_path(osm_file)
+        if not file_utils.is_a_newer_than_b(index_path, osm_file):
+            log.info("building tag index {} of {}".format(index_path, osm_file))
+            TagIndex.build(osm_file).save(index_path)
+        return TagIndex.load(index_path)
 
     @classmethod
-    def find_park_and_rides(cls):
-        """ will find park & ride stuff """
-        pass
+    def find(cls, osm_file, tag_name, value_value=('yes', 'true')):
+        """ will find nodes (and ways and relations) with the tag_name tag, with one of the value_value values
+            :param value_value: value (or list of them) ... '*' or None finds any value
+            :return list of NodeInfo
+        """
+        index = cls.get_index(osm_file)
+        return [NodeInfo(n) for n in index.find(tag_name, value_value)]
+
+    @classmethod
+    def find_park_and_rides(cls, osm_file=None):
+        """ will find park & ride stuff: park_ride=<anything but no> (usually on amenity=parking), plus
+            parking=park_and_ride and amenity=park_and_ride
+            :param osm_file: defaults to the osm cache's .osm file
+        """
+        if osm_file is None:
+            from ott.osm.osm_cache import OsmCache
+            osm_file = OsmCache().osm_path
+
+        ret_val = []
+        seen = set()
+        index = cls.get_index(osm_file)
+        for n in index.find('park_ride') + index.find('parking', 'park_and_ride') + index.find('amenity', 'park_and_ride'):
+            key = (n['type'], n['id'])
+            if key in seen or n['tag_value'] == 'no':
+                continue
+            seen.add(key)
+            ret_val.append(NodeInfo(n))
+        return ret_val
 
 
 def main():
@@ -1,5 +1,13 @@
+import os
+import json
+import hashlib
+import multiprocessing
 from osmread import parse_file, Way
 
+from ott.osm.osm_sections import OsmSectionReader
+from ott.osm.pbf_blocks import read_header_block
+from .scan_stats import scan_way_stats, to_epoch
+
 from ott.utils import json_utils
 from ott.utils import date_utils
 from ott.utils import file_utils
@@ -15,8 +23,8 @@ class OsmInfo(object):
     """
     def __init__(self):
         """
-        TODO think about rewriting this to simply read file line by line and find latest stamps and count tags...
-        will be much faster than osmread on big files...
+        NOTE: .osm stats are found via a (fast) byte scan of the file (see scan_osm_stats) ... the osmread parse in
+        calculate_osm_stats is slow on big files, but is still used for .pbf files and to validate the scan
         """
         self.way_count = 0
         self.highway_count = 0
@@ -36,23 +44,49 @@ class OsmInfo(object):
     def write_json_file(self, file_path, pretty_print=False):
         json_utils.object_to_json_file(file_path, self, pretty_print)
 
+    def write_stats_file(self, stats_file, pretty_print=False, use_hash=False):
+        """ write the stats (plus the file_key of the osm file they're from ... see read_cached_stats) """
+        self.file_key = self.get_file_key(self.osm_file, use_hash)
+        self.write_json_file(stats_file, pretty_print)
+
     def calculate_osm_stats(self, osm_path):
         """ reads the .osm file and captures certain stats like last update and number of ways, etc... 
         """
         log.info("calculating stats for {}".format(osm_path))
         self.osm_file = osm_path
 
-        for entity in parse_file(osm_path):
+        for entity in self.parse_ways(osm_path):
             if isinstance(entity, Way):
                 self.way_count += 1
                 if 'highway' in entity.tags:
                     self.highway_count += 1
-                if entity.timestamp > self.last.timestamp:
-                    self.last.timestamp = entity.timestamp
-                    self.last.id = entity.id
-                    if entity.changeset > 0:
-                        self.last.changeset = entity.changeset
+                self.update_last(entity.timestamp, entity.id, entity.changeset)
+
+        self.finish_stats(osm_path)
+
+    def scan_osm_stats(self, osm_path, workers=1):
+        """ same stats as calculate_osm_stats, via a byte regex scan of the .osm file's way section (see scan_stats)
+            :param workers: number of processes scanning chunks of the file
+        """
+        log.info("scanning stats for {}".format(osm_path))
+        self.osm_file = osm_path
+
+        for way_count, highway_count, newest in scan_way_stats(osm_path, workers):
+            self.way_count += way_count
+            self.highway_count += highway_count
+            for timestamp, id, changeset in newest:
+                self.update_last(to_epoch(timestamp), id, changeset)
 
+        self.finish_stats(osm_path)
+
+    def update_last(self, timestamp, id, changeset):
+        if timestamp > self.last.timestamp:
+            self.last.timestamp = timestamp
+            self.last.id = id
+            if changeset > 0:
+                self.last.changeset = changeset
+
+    def finish_stats(self, osm_path):
         self.last.edit_date = date_utils.pretty_date_from_ms(self.last.timestamp * 1000, fmt="%B %d, %Y")
         self.last.file_date = file_utils.file_pretty_date(osm_path, fmt="%B %d, %Y")
 
@@ -60,6 +94,48 @@ class OsmInfo(object):
         if self.last.changeset > 0:
             self.last.changeset_url = "http://openstreetmap.org/changeset/{}".format(self.last.changeset)
 
+    @classmethod
+    def calculate(cls, osm_path, validate=False, workers=1):
+        """ :return OsmInfo of an osm file ... .osm files are scanned, unless validate is True (osmread parse)
+        """
+        ret_val = OsmInfo()
+        if osm_path.endswith('.osm') and not validate:
+            ret_val.scan_osm_stats(osm_path, workers)
+        else:
+            ret_val.calculate_osm_stats(osm_path)
+        return ret_val
+
+    @classmethod
+    def validate_stats(cls, osm_path, workers=1):
+        """ compare the (fast) scanned stats of an .osm file with the osmread parsed stats
+            :return list of the stats that differ (empty when they match)
+        """
+        scanned = cls.calculate(osm_path, workers=workers).to_json()
+        parsed = cls.calculate(osm_path, validate=True).to_json()
+        ret_val = []
+        for k in ('way_count', 'highway_count'):
+            if scanned.get(k) != parsed.get(k):
+                ret_val.append("{}: {} != {}".format(k, scanned.get(k), parsed.get(k)))
+        for k in ('timestamp', 'id', 'changeset'):
+            if scanned['last'].get(k) != parsed['last'].get(k):
+                ret_val.append("last.{}: {} != {}".format(k, scanned['last'].get(k), parsed['last'].get(k)))
+        for r in ret_val:
+            log.warning("{} stats mismatch -- {}".format(osm_path, r))
+        return ret_val
+
+    @classmethod
+    def parse_ways(cls, osm_path):
+        """ osmread entities from the file, skipping the (big) node section of .osm files, since only ways are counted
+        """
+        if osm_path.endswith('.osm'):
+            from osmread.parser.xml import XmlParser
+            with OsmSectionReader.ways(osm_path) as fp:
+                for entity in XmlParser().parse(fp):
+                    yield entity
+        else:
+            for entity in parse_file(osm_path):
+                yield entity
+
     @classmethod
     def find_osm_files(cls, dir_path):
         ret_val = []
@@ -78,66 +154,180 @@ class OsmInfo(object):
         return stats_file
 
     @classmethod
-    def cache_stats(cls, osm_path, stats_file=None, pretty_print=True):
+    def get_file_key(cls, osm_file, use_hash=False):
+        """ :return dict of the osm file's size and mtime (plus its sha1, when use_hash is set) """
+        ret_val = {'size': os.path.getsize(osm_file), 'mtime': os.path.getmtime(osm_file)}
+        if use_hash:
+            ret_val['sha1'] = cls.file_sha1(osm_file)
+        return ret_val
+
+    @classmethod
+    def file_sha1(cls, file_path, block_size=4 * 1024 * 1024):
+        h = hashlib.sha1()
+        with open(file_path, "rb") as f:
+            for b in iter(lambda: f.read(block_size), b""):
+                h.update(b)
+        return h.hexdigest()
+
+    @classmethod
+    def cache_stats(cls, osm_path, stats_file=None, pretty_print=True, validate=False, workers=1, use_hash=False):
         """ return OSM .osm-stats info json
             will either read the .osm-stats file or create a new stats file calculated via the .osm file
+            :param validate: calculate the stats with osmread, rather than the (much faster) .osm scan
+            :param workers: number of processes scanning the .osm file
+            :param use_hash: add the osm file's sha1 to the stats' file_key (see read_cached_stats)
         """
         stats_path = cls.get_stats_file_path(osm_path, stats_file)
         is_stats_good = False
 
-        # step 1: read the .osm-stats cache file (if exists and stats are newer than osm)
-        if not file_utils.is_a_newer_than_b(osm_path, stats_path):
-            j = json_utils.get_json(stats_path)
-            if j.get('way_count') and j.get('highway_count') and j.get('last'):
-                is_stats_good = True
-                ret_val = j
+        # step 1: read the .osm-stats cache file (if exists and stats are from this version of the osm file)
+        j = cls.read_cached_stats(osm_path, stats_path)
+        if j and j.get('way_count') and j.get('highway_count') and j.get('last'):
+            is_stats_good = True
+            ret_val = j
 
         # step 2: if .osm-stats don't exists or are out of date, cache them
         if not is_stats_good:
-            stats = OsmInfo()
-            stats.calculate_osm_stats(osm_path)
-            stats_file = cls.get_stats_file_path(osm_path, stats_file)
-            stats.write_json_file(stats_file, pretty_print)
+            stats = OsmInfo.calculate(osm_path, validate, workers)
+            stats.write_stats_file(stats_path, pretty_print, use_hash)
             ret_val = stats.to_json()
 
         return ret_val
 
     @classmethod
-    def get_stats(cls, osm_file, stats_file=None, pretty_print=True):
-        """ will either read a cache'd -stats file into memory, or calculate the stats, cache them and then return
-            :return dict representing the json stats object
+    def read_cached_stats(cls, osm_file, stats_file=None):
+        """ :return dict of the cache'd -stats file, if it's from this version of the osm file ... else None
+
+            the stats' file_key says which version: the same size and mtime, or -- for a file that's been copied or
+            touched -- the same sha1, when the key has one (the new mtime is then saved, so the file isn't hashed
+            again).  legacy -stats (without a file_key) are good when they're newer than the osm file, same as always
         """
         ret_val = None
+        stats_file = cls.get_stats_file_path(osm_file, stats_file)
+        if not file_utils.exists(stats_file) or not file_utils.exists(osm_file):
+            return ret_val
+
+        j = json_utils.get_json(stats_file)
+        if j is None or len(j) < 2:
+            return ret_val
 
+        key = j.get('file_key')
+        mtime = os.path.getmtime(osm_file)
+        if not key:
+            if file_utils.is_a_newer_than_b(stats_file, osm_file):
+                ret_val = j
+        elif key.get('size') not in (None, os.path.getsize(osm_file)):
+            log.debug("{} has changed size since its stats".format(osm_file))
+        elif key.get('mtime') == mtime:
+            ret_val = j
+        elif key.get('sha1'):
+            if key.get('sha1') == cls.file_sha1(osm_file):
+                log.info("{} has a new mtime, but the same sha1 as its stats".format(osm_file))
+                key['mtime'] = mtime
+                with open(stats_file, "w") as f:
+                    json.dump(j, f, indent=4)
+                ret_val = j
+        else:
+            log.debug("{} has a new mtime (and its stats don't have a sha1)".format(osm_file))
+        return ret_val
+
+    @classmethod
+    def get_stats(cls, osm_file, stats_file=None, pretty_print=True, use_hash=False):
+        """ will either read a cache'd -stats file into memory, or calculate the stats, cache them and then return
+            :param use_hash: add the osm file's sha1 to new stats (see cache_stats)
+            :return dict representing the json stats object
+        """
         # step 1: validate stats file path
         stats_file = cls.get_stats_file_path(osm_file, stats_file)
 
-        # step 2: if the stats file exists and is newere than the .osm file, try to read it in
-        if file_utils.exists(stats_file) and file_utils.is_a_newer_than_b(stats_file, osm_file):
-            ret_val = json_utils.get_json(stats_file)
+        # step 2: if the stats file exists and is from this version of the .osm file, try to read it in
+        ret_val = cls.read_cached_stats(osm_file, stats_file)
 
         # step 3: if we don't have stats from a cache'd file, calculate new stats and write them out
-        if ret_val is None or len(ret_val) < 2:
-            ret_val = cls.cache_stats(osm_file, stats_file, pretty_print)
+        if ret_val is None:
+            ret_val = cls.cache_stats(osm_file, stats_file, pretty_print, use_hash=use_hash)
 
         # step 4: return the stats as a string
         return ret_val
 
+    @classmethod
+    def pbf_header_stats(cls, pbf_path):
+        """ stats from just the OSMHeader block of a .pbf file: the osmosis replication timestamp and sequence number,
+            plus the bbox ... takes milliseconds, since none of the data blocks are read (so there are no way counts)
+            :return dict with the same 'last' dates as the full stats, and 'header_only' set
+        """
+        header = read_header_block(pbf_path)
+
+        def field(name, def_val=None):
+            try:
+                return getattr(header, name) if header.HasField(name) else def_val
+            except ValueError:
+                return def_val  # older .proto without the osmosis replication fields
+
+        ret_val = {
+            'osm_file': pbf_path,
+            'header_only': True,
+            'writingprogram': field('writingprogram'),
+            'source': field('source'),
+            'replication': {
+                'timestamp': field('osmosis_replication_timestamp'),
+                'sequence_number': field('osmosis_replication_sequence_number'),
+                'base_url': field('osmosis_replication_base_url'),
+            },
+            'last': {
+                'timestamp': field('osmosis_replication_timestamp', 0),
+                'file_date': file_utils.file_pretty_date(pbf_path, fmt="%B %d, %Y"),
+            }
+        }
+        if ret_val['last']['timestamp'] > 0:
+            ret_val['last']['edit_date'] = date_utils.pretty_date_from_ms(ret_val['last']['timestamp'] * 1000, fmt="%B %d, %Y")
+
+        if header.HasField('bbox'):
+            b = header.bbox
+            ret_val['bbox'] = {'top': b.top / 1e9, 'bottom': b.bottom / 1e9, 'left': b.left / 1e9, 'right': b.right / 1e9}
+        return ret_val
+
+    @classmethod
+    def get_feed_stats(cls, file_path):
+        """ stats for the feed messages ... .pbf files use their cache'd -stats when fresh, else just their header,
+            so the (slow) full stats are only calculated when someone asks for them (e.g., get_stats for way counts)
+        """
+        ret_val = None
+        if file_path.endswith('.pbf'):
+            ret_val = cls.read_cached_stats(file_path)
+            if ret_val is None:
+                ret_val = cls.pbf_header_stats(file_path)
+        else:
+            ret_val = cls.get_stats(file_path)
+        return ret_val
+
     @classmethod
     def get_osm_feed_msg(cls, file_path, prefix=" ", suffix="\n", detailed=False):
         """ get osm feed details msg string for the .v log file
         """
         # step 1: get stats and .osm file name
         file_name = file_utils.get_file_name_from_path(file_path)
-        stats = OsmInfo.get_stats(file_path)
+        stats = OsmInfo.get_feed_stats(file_path)
 
         # step 2: make up base message with file name and file / last edit dates
-        msg = "{}{} : file date = {} -- last OSM update = {} : http://osm.org/way/{}".format(
-            prefix, file_name, stats['last'].get('file_date'), stats['last'].get('edit_date'), stats['last'].get('id')
-        )
+        if stats.get('header_only'):
+            msg = "{}{} : file date = {} -- last OSM update = {} : replication sequence {}".format(
+                prefix, file_name, stats['last'].get('file_date'), stats['last'].get('edit_date'),
+                stats['replication'].get('sequence_number')
+            )
+        else:
+            msg = "{}{} : file date = {} -- last OSM update = {} : http://osm.org/way/{}".format(
+                prefix, file_name, stats['last'].get('file_date'), stats['last'].get('edit_date'), stats['last'].get('id')
+            )
 
         # step 3: add details like changesets, etc...
-        if detailed:
+        if detailed and stats.get('header_only'):
+            url = stats['replication'].get('base_url')
+            if url:
+                msg = "{} @ {}".format(msg, url)
+            if stats.get('bbox'):
+                msg = "{}, bbox: {top:.4f}, {left:.4f}, {bottom:.4f}, {right:.4f}".format(msg, **stats['bbox'])
+        elif detailed:
             cs = stats['last'].get('changeset', 0)
             if cs > 111:
                 msg = "{}, changeset: {}".format(msg, cs)
@@ -152,16 +342,28 @@ class OsmInfo(object):
         return msg
 
     @classmethod
-    def get_cache_msgs(cls, cache_path='.', def_msg="", detailed=False):
+    def get_cache_msgs(cls, cache_path='.', def_msg="", detailed=False, workers=1):
         """
         return message for all OSM feeds in the cache directory
         NOTE: this method could take hours to process, depending upon number & size of .osm files in a directory
+              (.pbf files only have their header block read, unless they've got cache'd -stats ... see get_feed_stats)
+              and files with up-to-date -stats aren't read at all (see read_cached_stats)
+        :param workers: > 1 gets the stats of the files with a pool of worker processes (one file per process)
         """
         osm_msg = def_msg
         try:
             osm_files = OsmInfo.find_osm_files(cache_path)
-            for f in osm_files:
-                osm_msg += OsmInfo.get_osm_feed_msg(file_path=f, detailed=detailed)
+            tasks = [(f, detailed) for f in osm_files]
+            if workers > 1 and len(tasks) > 1:
+                pool = multiprocessing.Pool(min(workers, len(tasks)))
+                try:
+                    msgs = pool.map(feed_msg, tasks, chunksize=1)
+                finally:
+                    pool.close()
+                    pool.join()
+            else:
+                msgs = [feed_msg(t) for t in tasks]
+            osm_msg += "".join(msgs)
         except Exception as e:
             log.info(e)
         return osm_msg
@@ -192,8 +394,19 @@ class OsmInfo(object):
         # import pdb; pdb.set_trace()
         from ott.utils.parse.cmdline import osm_cmdline
         p = osm_cmdline.osm_parser_args(prog_name='bin/osm_info', osm_required=True)
-        OsmInfo.print_stats(p.osm)
-        print(OsmInfo.get_cache_msgs(p.osm, detailed=True))
+        if not os.path.isdir(p.osm):
+            OsmInfo.print_stats(p.osm)
+        print(OsmInfo.get_cache_msgs(p.osm, detailed=True, workers=multiprocessing.cpu_count()))
+
+
+def feed_msg(task):
+    """ worker: OsmInfo.get_osm_feed_msg of one file ... an error is logged (so the other files still get msgs) """
+    file_path, detailed = task
+    try:
+        return OsmInfo.get_osm_feed_msg(file_path=file_path, detailed=detailed)
+    except Exception as e:
+        log.info("{}: {}".format(file_path, e))
+        return ""
 
 
 def main():
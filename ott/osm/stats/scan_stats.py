@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+fast .osm stats: byte regex scan of the (mmap'd) way section of an .osm file, rather than parsing it with osmread
+(see OsmInfo.scan_osm_stats ... osmread is kept around to validate the scan against)
+"""
+import re
+import mmap
+import calendar
+import multiprocessing
+
+from ott.osm.osm_sections import OsmSectionReader
+
+import logging
+log = logging.getLogger(__file__)
+
+
+# start of an element (group 1 is its name, group 2 its attributes, where quoted values can have a '>') ... or
+# (no groups) a highway tag
+WAY_STATS_RE = re.compile(br'<(node|way|relation)[\s/>]((?:[^>"\']+|"[^"]*"|\'[^\']*\')*)|<tag\s+k=(?:"highway"|\'highway\')')
+TIMESTAMP_RE = re.compile(br'(?<![\w:])timestamp=["\']([^"\']+)')
+ID_RE = re.compile(br'(?<![\w:])id=["\'](-?\d+)')
+CHANGESET_RE = re.compile(br'(?<![\w:])changeset=["\'](-?\d+)')
+
+
+def to_epoch(timestamp):
+    """ :return seconds since 1970 of an osm (utc) timestamp, e.g. b'2019-01-01T00:00:00Z' (same as osmread) """
+    t = timestamp.decode('ascii') if isinstance(timestamp, bytes) else timestamp
+    return calendar.timegm((int(t[0:4]), int(t[5:7]), int(t[8:10]), int(t[11:13]), int(t[14:16]), int(t[17:19])))
+
+
+def get_int(regex, attributes, def_val=0):
+    m = regex.search(attributes)
+    return int(m.group(1)) if m else def_val
+
+
+def scan_ways(mm, start, end):
+    """ scan the ways in a byte range of an .osm file (mmap or bytes)
+        :return (number of ways, number of highway ways, list of the (timestamp, id, changeset) of each way with a
+                 newer timestamp than all the ways before it) ... that list is short, and lets the results of
+                 several ranges be replayed in order, the same as if the whole file was read by one process
+    """
+    way_count = 0
+    highway_count = 0
+    newest = []
+    last_timestamp = b""
+    is_way = False
+    is_highway = False
+    for m in WAY_STATS_RE.finditer(mm, start, end):
+        element = m.group(1)
+        if element is None:
+            if is_way and not is_highway:
+                is_highway = True
+                highway_count += 1
+            continue
+
+        is_way = element == b"way"
+        is_highway = False
+        if not is_way:
+            continue
+
+        way_count += 1
+        attributes = m.group(2)
+        t = TIMESTAMP_RE.search(attributes)
+        if t and t.group(1)[:19] > last_timestamp:
+            last_timestamp = t.group(1)[:19]
+            newest.append((last_timestamp, get_int(ID_RE, attributes), get_int(CHANGESET_RE, attributes)))
+    return way_count, highway_count, newest
+
+
+def scan_range(task):
+    """ worker: scan_ways() of a byte range of an .osm file """
+    osm_path, span = task
+    with open(osm_path, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        return scan_ways(mm, span[0], span[1])
+    finally:
+        mm.close()
+
+
+def scan_way_stats(osm_path, workers=1, ranges_per_worker=4):
+    """ generator of the scan_ways() results of the way section of an .osm file, in file order
+        :param workers: > 1 scans ranges of the way section (split on elements) with a pool of worker processes
+    """
+    if workers > 1:
+        ranges = OsmSectionReader.section_ranges(osm_path, is_ways=True, num_ranges=workers * ranges_per_worker)
+        log.info("scanning {} in {} ranges with {} workers".format(osm_path, len(ranges), workers))
+        pool = multiprocessing.Pool(workers)
+        try:
+            for stats in pool.imap(scan_range, [(osm_path, span) for span in ranges]):
+                yield stats
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        yield scan_range((osm_path, OsmSectionReader.section_span(osm_path, is_ways=True)))
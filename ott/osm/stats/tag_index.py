@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+"""
+inverted index of an .osm file's tags: each tag key (e.g., 'amenity') and key=value pair (e.g., 'amenity=parking')
+maps to the elements that have it, along with the elements' (type, id, lat, lon) ... built in one streaming pass
+(see TagIndexBuilder, an OsmPipeline consumer) and saved to a file that's memory-mapped back in (see TagIndex.load)
+
+:example:
+    index = TagIndex.build("or-wa.osm")
+    index.save("or-wa.osm-tags")
+    index = TagIndex.load("or-wa.osm-tags")
+    index.find("amenity", "parking")
+    index.find("public_transport")
+"""
+import mmap
+import math
+import bisect
+import struct
+from array import array
+
+from ott.osm.osm_pipeline import OsmPipeline, OsmConsumer
+from ott.osm.intersections.intersection_index import NameTable
+from ott.osm.intersections.osm_to_intersections import np
+
+import logging
+log = logging.getLogger(__file__)
+
+
+MAGIC = b"OTTTAGX1"
+HEADER = struct.Struct("<8sqqqq")  # magic, number of elements, terms, postings and term bytes
+TYPES = ('node', 'way', 'relation')
+
+# keys whose values are (mostly) unique text, so just the key gets indexed (e.g., 'name', but not 'name=Main St')
+UNINDEXED_VALUE_KEYS = ('name', 'alt_name', 'old_name', 'official_name', 'short_name', 'description', 'note', 'fixme',
+                        'FIXME', 'source', 'website', 'url', 'phone', 'email', 'opening_hours', 'wikipedia', 'wikidata')
+UNINDEXED_VALUE_PREFIXES = ('name:', 'addr:', 'tiger:', 'gnis:', 'nhd:', 'source:', 'contact:')
+
+
+def is_value_indexed(key):
+    return key not in UNINDEXED_VALUE_KEYS and not key.startswith(UNINDEXED_VALUE_PREFIXES)
+
+
+def pair_term(key, value):
+    return u"{}={}".format(key, value)
+
+
+class TagIndexBuilder(OsmConsumer):
+    """ OsmPipeline consumer that builds a TagIndex of the tagged elements
+
+        a way's coordinate is the mean of its nodes' coordinates, so every node's id and coordinate are kept in
+        arrays (7 decimal fixed point), along with the tagged ways' node refs, until the end of the file
+        (relations don't get a coordinate)
+
+        :note memory: 16 bytes a node (tagged or not), 8 bytes a tagged way's node ref, and ~24 bytes (plus the term
+              strings and 8 bytes a posting) a tagged element ... e.g., ~40M nodes and 4M ways of or-wa is ~1 GB
+              while the file is read (and finish sorts a copy of the node arrays).  the node and ref arrays are let
+              go once the ways have their coordinates
+    """
+    def __init__(self):
+        self.types = bytearray()
+        self.ids = array('q')
+        self.lats = array('d')
+        self.lons = array('d')
+        self.postings = {}
+        self.node_ids = array('q')
+        self.node_lats = array('i')
+        self.node_lons = array('i')
+        self.way_elements = array('q')
+        self.way_refs = array('q')
+        self.way_lengths = array('i')
+        self.index = None
+
+    def element(self, elem):
+        if elem.tag not in TYPES:
+            return
+        if elem.tag == 'node':
+            lat, lon = float(elem.get('lat')), float(elem.get('lon'))
+            self.node_ids.append(int(elem.get('id')))
+            self.node_lats.append(int(round(lat * 1e7)))
+            self.node_lons.append(int(round(lon * 1e7)))
+        else:
+            lat = lon = float('nan')
+
+        terms = set()
+        for t in elem.findall('tag'):
+            k = t.get('k')
+            terms.add(k)
+            if is_value_indexed(k):
+                terms.add(pair_term(k, t.get('v')))
+        if not terms:
+            return
+
+        i = len(self.ids)
+        self.types.append(TYPES.index(elem.tag))
+        self.ids.append(int(elem.get('id')))
+        self.lats.append(lat)
+        self.lons.append(lon)
+        for term in terms:
+            p = self.postings.get(term)
+            if p is None:
+                p = self.postings[term] = array('q')
+            p.append(i)
+
+        if elem.tag == 'way':
+            refs = [int(nd.get('ref')) for nd in elem.findall('nd')]
+            self.way_elements.append(i)
+            self.way_refs.extend(refs)
+            self.way_lengths.append(len(refs))
+
+    def finish(self):
+        self.way_coordinates()
+        self.node_ids = self.node_lats = self.node_lons = None
+        self.way_elements = self.way_refs = self.way_lengths = None
+        self.index = TagIndex.from_postings(self.types, self.ids, self.lats, self.lons, self.postings)
+        log.info("indexed {} tags of {} elements".format(len(self.postings), len(self.ids)))
+
+    def way_coordinates(self):
+        """ set each tagged way's lat, lon to the mean of its (found) nodes' coordinates """
+        if len(self.way_elements) == 0 or len(self.node_ids) == 0:
+            return
+        if np:
+            node_ids = np.frombuffer(self.node_ids, dtype=np.int64)
+            node_lats = np.frombuffer(self.node_lats, dtype=np.int32)
+            node_lons = np.frombuffer(self.node_lons, dtype=np.int32)
+            order = np.argsort(node_ids, kind='stable')
+            node_ids, node_lats, node_lons = node_ids[order], node_lats[order], node_lons[order]
+
+            refs = np.frombuffer(self.way_refs, dtype=np.int64)
+            n = np.searchsorted(node_ids, refs)
+            n[n == len(node_ids)] = 0
+            found = node_ids[n] == refs
+            way_of_ref = np.repeat(np.arange(len(self.way_lengths)), np.frombuffer(self.way_lengths, dtype=np.int32))
+            counts = np.bincount(way_of_ref[found], minlength=len(self.way_lengths))
+            lats = np.bincount(way_of_ref[found], weights=node_lats[n[found]], minlength=len(self.way_lengths))
+            lons = np.bincount(way_of_ref[found], weights=node_lons[n[found]], minlength=len(self.way_lengths))
+            for w, i in enumerate(self.way_elements):
+                if counts[w] > 0:
+                    self.lats[i] = float(lats[w]) / counts[w] * 1e-7
+                    self.lons[i] = float(lons[w]) / counts[w] * 1e-7
+        else:
+            order = sorted(range(len(self.node_ids)), key=self.node_ids.__getitem__)
+            node_ids = array('q', (self.node_ids[j] for j in order))
+            pos = 0
+            for i, length in zip(self.way_elements, self.way_lengths):
+                lat = lon = count = 0
+                for ref in self.way_refs[pos:pos + length]:
+                    j = bisect.bisect_left(node_ids, ref)
+                    if j < len(node_ids) and node_ids[j] == ref:
+                        lat += self.node_lats[order[j]]
+                        lon += self.node_lons[order[j]]
+                        count += 1
+                if count > 0:
+                    self.lats[i] = float(lat) / count * 1e-7
+                    self.lons[i] = float(lon) / count * 1e-7
+                pos += length
+
+
+class TagIndex(object):
+    """ elements (type, id, lat, lon) and the sorted tag terms (key, or key=value), each with the sorted element
+        indexes that have it ... everything is in flat arrays, so an index can be saved to a file and memory-mapped
+        back in (load), like an IntersectionIndex
+    """
+    def __init__(self, types, ids, lats, lons, terms, posting_starts, postings):
+        self.types = types
+        self.ids = ids
+        self.lats = lats
+        self.lons = lons
+        self.terms = terms
+        self.posting_starts = posting_starts
+        self.postings = postings
+        self.mm = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def build(cls, osm_path):
+        """ :return TagIndex of an .osm file, from one read of it """
+        pipeline = OsmPipeline(osm_path)
+        builder = pipeline.add(TagIndexBuilder())
+        pipeline.run()
+        return builder.index
+
+    @classmethod
+    def from_postings(cls, types, ids, lats, lons, postings):
+        """ :param postings: dict of term to the (ascending) element indexes with it """
+        blob = bytearray()
+        offsets = array('q', [0])
+        posting_starts = array('q', [0])
+        all_postings = array('q')
+        for term in sorted(postings):
+            blob += term.encode('utf-8')
+            offsets.append(len(blob))
+            all_postings.extend(postings[term])
+            posting_starts.append(len(all_postings))
+        return cls(bytes(types), ids, lats, lons, NameTable(bytes(blob), offsets), posting_starts, all_postings)
+
+    def element(self, i):
+        """ :return dict of element i """
+        ret_val = {'type': TYPES[self.types[i]], 'id': self.ids[i], 'lat': None, 'lon': None}
+        if not math.isnan(self.lats[i]):
+            ret_val['lat'] = round(self.lats[i], 7)
+            ret_val['lon'] = round(self.lons[i], 7)
+        return ret_val
+
+    def term_range(self, prefix):
+        """ :return (start, end) of the (sorted) terms that start with prefix """
+        start = bisect.bisect_left(self.terms, prefix)
+        end = bisect.bisect_left(self.terms, prefix + u"\U0010ffff", start)
+        return start, end
+
+    def lookup(self, term):
+        """ :return the element indexes of a term (a key, or a key=value pair) """
+        t = bisect.bisect_left(self.terms, term)
+        if t < len(self.terms) and self.terms[t] == term:
+            return self.postings[self.posting_starts[t]:self.posting_starts[t + 1]]
+        return []
+
+    def values(self, key):
+        """ :return list of the (value, number of elements) of a key ... empty for keys whose values aren't indexed """
+        ret_val = []
+        prefix = pair_term(key, u"")
+        start, end = self.term_range(prefix)
+        for t in range(start, end):
+            ret_val.append((self.terms[t][len(prefix):], self.posting_starts[t + 1] - self.posting_starts[t]))
+        return ret_val
+
+    def find(self, key, values=None):
+        """ :return list of the element dicts (plus their 'tag_name' and 'tag_value') with the key ... and, when given,
+                    one of the values (a string or a list of them ... '*' is any value)
+            :note tag_value is None for the keys whose values aren't indexed (see UNINDEXED_VALUE_KEYS)
+        """
+        if isinstance(values, (str, type(u''))):
+            values = (values,)
+        if values is not None and '*' in values:
+            values = None
+
+        found = {}
+        if values is None:
+            for i in self.lookup(key):
+                found[i] = None
+            for value, count in self.values(key):
+                for i in self.lookup(pair_term(key, value)):
+                    found[i] = value
+        else:
+            for value in values:
+                for i in self.lookup(pair_term(key, value)):
+                    found[i] = value
+
+        ret_val = []
+        for i in sorted(found):
+            e = self.element(i)
+            e['tag_name'] = key
+            e['tag_value'] = found[i]
+            ret_val.append(e)
+        return ret_val
+
+    def save(self, path):
+        """ write the index to a file (native byte order ... see load) """
+        blob = self.terms.blob
+        with open(path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, len(self), len(self.terms), len(self.postings), len(blob)))
+            for a in (self.ids, self.lats, self.lons, self.terms.offsets, self.posting_starts, self.postings):
+                f.write(a.tobytes() if isinstance(a, array) else bytes(a))
+            f.write(blob)
+            f.write(bytes(self.types))
+
+    @classmethod
+    def load(cls, path):
+        """ memory-map an index file written by save() ... the arrays are views of the file, so nothing is read up front """
+        with open(path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, num_elements, num_terms, num_postings, blob_size = HEADER.unpack_from(mm, 0)
+        if magic != MAGIC:
+            mm.close()
+            raise ValueError("{} isn't a tag index file".format(path))
+
+        view = memoryview(mm)
+        pos = [HEADER.size]
+
+        def take(fmt, count, size=8):
+            ret_val = view[pos[0]:pos[0] + count * size]
+            pos[0] += count * size
+            return ret_val.cast(fmt) if fmt else ret_val
+
+        ids = take('q', num_elements)
+        lats = take('d', num_elements)
+        lons = take('d', num_elements)
+        offsets = take('q', num_terms + 1)
+        posting_starts = take('q', num_terms + 1)
+        postings = take('q', num_postings)
+        terms = NameTable(take(None, blob_size, 1), offsets)
+        types = take(None, num_elements, 1)
+
+        ret_val = cls(types, ids, lats, lons, terms, posting_starts, postings)
+        ret_val.mm = mm
+        return ret_val
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+dependency graph scheduler of (post-processing) steps: each step declares the files it reads (inputs) and writes
+(outputs), a step waits on the steps that write its inputs, and the steps that aren't waiting on anything run at the
+same time in a bounded pool of worker threads ... so a run takes about as long as its longest chain of steps
+
+steps can also name a resource (e.g., 'osmosis'), to cap how many steps using it run at once (osmosis JVMs are
+memory hungry)
+
+:example:
+    scheduler = StepScheduler(workers=4, limits={'osmosis': 2})
+    scheduler.add('cull_transit', cull, inputs=['or-wa.osm'], outputs=['or-wa_cull_transit.osm'], resource='osmosis')
+    scheduler.add('cull_transit_pbf', to_pbf, inputs=['or-wa_cull_transit.osm'], resource='osmosis')
+    scheduler.add('stats', stats, inputs=['or-wa.osm'])
+    scheduler.run()
+"""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import logging
+log = logging.getLogger(__file__)
+
+
+class Step(object):
+    """ a named call, with the paths it reads and writes """
+    def __init__(self, name, func, inputs=(), outputs=(), resource=None):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.resource = resource
+        self.depends_on = set()
+        self.status = 'pending'
+        self.seconds = None
+
+    def run(self):
+        start = time.time()
+        log.info("step {} started".format(self.name))
+        try:
+            self.func()
+            self.status = 'done'
+        except Exception:
+            self.status = 'failed'
+            raise
+        finally:
+            self.seconds = time.time() - start
+            log.info("step {} {} in {:.1f} seconds".format(self.name, self.status, self.seconds))
+
+
+class StepScheduler(object):
+    """ runs steps in dependency order, with up to workers of them at once ... with workers=1, the steps run one at a
+        time in the order they were added (as long as that order has each step after the steps it depends on)
+    """
+    def __init__(self, workers=1, limits=None):
+        """ :param limits: dict of resource name to the most steps using it that can run at once """
+        self.workers = max(1, workers)
+        self.limits = limits or {}
+        self.steps = []
+        self.completed = []
+
+    def add(self, name, func, inputs=(), outputs=(), resource=None):
+        """ add a step (a call of func) ... :return the Step """
+        if name in [s.name for s in self.steps]:
+            raise ValueError("there's already a step named {}".format(name))
+        step = Step(name, func, inputs, outputs, resource)
+        self.steps.append(step)
+        return step
+
+    def resolve(self):
+        """ set each step's depends_on to the names of the steps that write its inputs
+            :raise ValueError when two steps write the same file, or the steps depend on each other in a cycle
+        """
+        writers = {}
+        for s in self.steps:
+            for path in s.outputs:
+                key = os.path.abspath(path)
+                if key in writers:
+                    raise ValueError("steps {} and {} both write {}".format(writers[key].name, s.name, path))
+                writers[key] = s
+
+        for s in self.steps:
+            s.depends_on = set()
+            for path in s.inputs:
+                w = writers.get(os.path.abspath(path))
+                if w is not None and w is not s:
+                    s.depends_on.add(w.name)
+
+        # note: take away steps with nothing (left) to wait on ... whatever's left over is in a cycle
+        resolved = set()
+        left = list(self.steps)
+        while left:
+            ready = [s for s in left if s.depends_on <= resolved]
+            if not ready:
+                raise ValueError("steps {} depend on each other".format(", ".join(s.name for s in left)))
+            resolved.update(s.name for s in ready)
+            left = [s for s in left if s.name not in resolved]
+
+    def is_runnable(self, step, done, running):
+        """ True if the step's dependencies are done, and its resource (if any) isn't at its limit """
+        if not step.depends_on <= done:
+            return False
+        limit = self.limits.get(step.resource)
+        return limit is None or sum(1 for s in running.values() if s.resource == step.resource) < max(1, limit)
+
+    def run(self):
+        """ run all the steps ... after a step fails, no more steps are started, the running steps are waited on, and
+            the (first) failure is raised
+            :return list of the names of the steps, in the order they finished
+        """
+        self.resolve()
+        self.completed = []
+        done = set()
+        running = {}
+        pending = list(self.steps)
+        error = None
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while pending or running:
+                if error is None:
+                    for step in list(pending):
+                        if len(running) >= self.workers:
+                            break
+                        if self.is_runnable(step, done, running):
+                            pending.remove(step)
+                            running[pool.submit(step.run)] = step
+                if not running:
+                    break
+
+                finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for f in finished:
+                    step = running.pop(f)
+                    try:
+                        f.result()
+                        done.add(step.name)
+                        self.completed.append(step.name)
+                    except Exception as e:
+                        log.error("step {} failed: {}".format(step.name, e))
+                        if error is None:
+                            error = e
+
+        for step in pending:
+            step.status = 'skipped'
+        if error is not None:
+            raise error
+        return self.completed
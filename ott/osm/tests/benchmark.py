@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+"""
+rename throughput benchmarks: OsmRename, OsmAbbrParser.to_str and OsmAbbrParser.parse, over synthetic .osm files
+(plus extract_intersections, serial and sharded across worker processes)
+
+:example: bin/osm_rename_benchmark --ways 10000 100000 --out bench.json --compare last_bench.json
+:example: bin/osm_rename_benchmark --ways 1000000 -b intersections --workers 1 2 4 8
+"""
+import os
+import sys
+import json
+import time
+import random
+import platform
+import resource
+import tempfile
+import subprocess
+import multiprocessing
+from xml.etree import ElementTree as ET
+
+from ott.osm.rename.osm_rename import OsmRename
+from ott.osm.rename.osm_abbr_parser import OsmAbbrParser
+from ott.osm.rename.stream_rename import escape_attr_value, is_street_name_key
+from ott.osm.intersections.osm_to_intersections import extract_intersections
+from ott.osm.tests import osm_abbr_tester
+
+import logging
+log = logging.getLogger(__file__)
+
+
+# words swapped into the base names, so a big synthetic file has a realistic number of distinct street names
+NAME_WORDS = (
+    "Main", "Oak", "Alder", "Burnside", "Division", "Powell", "Foster", "Lombard", "Killingsworth", "Alberta",
+    "Fremont", "Broadway", "Sandy", "Glisan", "Stark", "Belmont", "Hawthorne", "Clinton", "Holgate", "Woodstock",
+    "Flavel", "Tacoma", "Macadam", "Barbur", "Terwilliger", "Multnomah", "Vermont", "Canyon", "Cornell", "Saint Johns",
+    "Mcloughlin", "Tom's", "De la Cruz", "César Chávez", "Martin Luther King Jr", "Cedar Hills", "Murray", "Walker",
+)
+
+DEFAULT_WAYS = (10000, 100000)
+DEFAULT_BENCHMARKS = ('to_str', 'parse', 'rename')
+MAX_PARSER_NAMES = 20000  # the (cold) parser benchmarks sample at most this many names, whatever the size
+REGRESSION_THRESHOLD = 0.10
+
+
+def base_names():
+    """ the street names in the test data (tests/data/*.osm and osm_abbr_tester), which give us the name shapes """
+    ret_val = set(n.strip() for n in osm_abbr_tester.tests if n and len(n.strip()) > 0)
+    data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+    for f in sorted(os.listdir(data_dir)):
+        if f.endswith(".osm"):
+            for event, elem in ET.iterparse(os.path.join(data_dir, f)):
+                if elem.tag == 'tag' and is_street_name_key(elem.get('k', ''), True) and elem.get('v'):
+                    ret_val.add(elem.get('v'))
+    return sorted(ret_val)
+
+
+class NameCorpus(object):
+    """ street names for synthetic .osm files
+
+        each base name keeps its shape (direction prefix / suffix and street type keywords stay put), while the
+        other words get swapped for street-ish words and ordinals.  names are drawn with a skewed (zipf-like)
+        distribution, so a few names are common, and most are rare ... like the streets in a real extract.
+    """
+    def __init__(self, num_names, seed=1):
+        parser = OsmAbbrParser(use_tokenizer=False)
+        keywords = set(w.lower() for w in (parser.dir_types_kw + " " + parser.street_types_kw).split())
+
+        self.random = random.Random(seed)
+        bases = base_names()
+        names = list(bases)
+        seen = set(names)
+        while len(names) < num_names:
+            words = self.random.choice(bases).split()
+            for i, w in enumerate(words):
+                if w.lower().strip(".") not in keywords:
+                    words[i] = self.random.choice(NAME_WORDS) if self.random.random() < 0.7 else self.ordinal()
+            n = " ".join(words)
+            if n not in seen:
+                seen.add(n)
+                names.append(n)
+        self.random.shuffle(names)
+        self.names = names[:num_names]
+
+    def ordinal(self):
+        n = self.random.randint(1, 250)
+        suffix = "th" if 10 <= n % 100 <= 20 else {1: "st", 2: "nd", 3: "rd"}.get(n % 10, "th")
+        return "{}{}".format(n, suffix)
+
+    def choice(self):
+        """ skewed pick: name i is picked with a probability of about 1 / (i + 1) """
+        i = int(len(self.names) ** self.random.random()) - 1
+        return self.names[i]
+
+    def sample(self, n):
+        return [self.choice() for i in range(n)]
+
+
+def write_synthetic_osm(osm_path, num_ways, seed=1, nodes_per_way=4, names_per_way=0.05):
+    """ write a synthetic .osm file (nodes first, then ways ... same as osmosis) with num_ways named highways """
+    corpus = NameCorpus(max(int(num_ways * names_per_way), 100), seed)
+    r = random.Random(seed)
+    num_nodes = num_ways * nodes_per_way // 2
+    with open(osm_path, "w", encoding="utf-8") as f:
+        f.write("<?xml version='1.0' encoding='UTF-8'?>\n")
+        f.write('<osm version="0.6" generator="ott.osm.tests.benchmark">\n')
+        for i in range(1, num_nodes + 1):
+            lat = 45.4 + r.random() / 5
+            lon = -122.8 + r.random() / 5
+            node = '  <node id="{}" version="1" timestamp="2019-01-01T00:00:00Z" uid="1" user="bench" changeset="1" lat="{:.7f}" lon="{:.7f}"'
+            f.write(node.format(i, lat, lon))
+            if r.random() < 0.02:
+                f.write('>\n    <tag k="addr:street" v="{}"/>\n  </node>\n'.format(escape_attr_value(corpus.choice())))
+            else:
+                f.write('/>\n')
+        for i in range(1, num_ways + 1):
+            f.write('  <way id="{}" version="1" timestamp="2019-01-01T00:00:00Z" uid="1" user="bench" changeset="1">\n'.format(i))
+            start = r.randint(1, max(num_nodes - nodes_per_way, 1))
+            for n in range(start, start + nodes_per_way):
+                f.write('    <nd ref="{}"/>\n'.format(n))
+            f.write('    <tag k="highway" v="residential"/>\n')
+            f.write('    <tag k="name" v="{}"/>\n'.format(escape_attr_value(corpus.choice())))
+            f.write('  </way>\n')
+        f.write('</osm>\n')
+    return osm_path
+
+
+def peak_rss_mb():
+    """ peak resident memory of this process (ru_maxrss is KB on linux, bytes on mac) """
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024.0 * 1024.0 if sys.platform == "darwin" else 1024.0), 1)
+
+
+def bench_rename(osm_path, num_ways):
+    OsmRename.rename_cache = {}
+    out_path = osm_path + ".renamed"
+    start = time.time()
+    r = OsmRename.rename(osm_path, out_path)
+    secs = time.time() - start
+    os.remove(out_path)
+    return {
+        'seconds': round(secs, 3),
+        'names': r.num_processed,
+        'names_per_sec': round(r.num_processed / secs, 1),
+        'mb_per_sec': round(os.path.getsize(osm_path) / (1024.0 * 1024.0) / secs, 2),
+        'cache_hit_rate': round(1.0 - len(r.new_renames) / float(max(r.num_processed, 1)), 4),
+    }
+
+
+def bench_parser(method, num_names, seed):
+    """ cold parser (no caching), so names/sec is the raw parser throughput """
+    num_names = min(num_names, MAX_PARSER_NAMES)
+    names = NameCorpus(num_names // 10, seed).sample(num_names)
+    parser = OsmAbbrParser()
+    if method == 'parse':
+        names = [parser.sub_str_replace(parser.str_replace, n.strip()) for n in names]
+    f = getattr(parser, method)
+    start = time.time()
+    for n in names:
+        try:
+            f(n)
+        except Exception:
+            pass
+    secs = time.time() - start
+    return {
+        'seconds': round(secs, 3),
+        'names': len(names),
+        'names_per_sec': round(len(names) / secs, 1),
+    }
+
+
+def bench_intersections(osm_path, num_ways, workers):
+    start = time.time()
+    r = extract_intersections(osm_path, workers)
+    secs = time.time() - start
+    return {
+        'seconds': round(secs, 3),
+        'workers': workers,
+        'intersections': len(r),
+        'ways_per_sec': round(num_ways / secs, 1),
+    }
+
+
+def run_benchmark(args):
+    """ runs in its own (fresh) process, so peak RSS is just this benchmark's """
+    name, size, osm_path, seed, workers = args
+    logging.disable(logging.WARNING)
+    if name == 'rename':
+        ret_val = bench_rename(osm_path, size)
+    elif name == 'intersections':
+        ret_val = bench_intersections(osm_path, size, workers)
+    else:
+        ret_val = bench_parser(name, size, seed)
+    ret_val['peak_rss_mb'] = peak_rss_mb()
+    return ret_val
+
+
+def queue_benchmark(args, queue):
+    queue.put(run_benchmark(args))
+
+
+def run_in_process(ctx, args):
+    """ run_benchmark in a fresh process ... a plain Process (not a Pool's daemon), so it can have worker processes """
+    queue = ctx.Queue()
+    p = ctx.Process(target=queue_benchmark, args=(args, queue))
+    p.start()
+    ret_val = queue.get()
+    p.join()
+    return ret_val
+
+
+def git_commit():
+    try:
+        here = os.path.dirname(os.path.abspath(__file__))
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=here).decode().strip()
+    except Exception:
+        return None
+
+
+def run(sizes=DEFAULT_WAYS, data_dir=None, seed=1, benchmarks=DEFAULT_BENCHMARKS, workers=(1,)):
+    """ run the benchmarks at each size (number of ways, or number of names for the parser benchmarks)
+        :param workers: worker process counts the intersections benchmark is run with (speedup is vs. the first)
+        :return dict of the results (see main() for writing them to a .json file)
+    """
+    if data_dir is None:
+        data_dir = tempfile.gettempdir()
+    ctx = multiprocessing.get_context("spawn")
+
+    results = []
+    for size in sizes:
+        osm_path = os.path.join(data_dir, "bench_{}_ways_seed{}.osm".format(size, seed))
+        if ('rename' in benchmarks or 'intersections' in benchmarks) and not os.path.exists(osm_path):
+            log.info("writing synthetic .osm file {}".format(osm_path))
+            write_synthetic_osm(osm_path, size, seed)
+
+        for name in benchmarks:
+            base = None
+            for w in (workers if name == 'intersections' else (1,)):
+                r = run_in_process(ctx, (name, size, osm_path, seed, w))
+                r['benchmark'] = name
+                r['size'] = size
+                if name in ('rename', 'intersections'):
+                    r['file_mb'] = round(os.path.getsize(osm_path) / (1024.0 * 1024.0), 2)
+                if name == 'intersections':
+                    base = base or r
+                    r['speedup'] = round(base['seconds'] / r['seconds'], 2)
+                log.info(r)
+                results.append(r)
+
+    return {
+        'commit': git_commit(),
+        'date': time.strftime("%Y-%m-%d %H:%M:%S"),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'seed': seed,
+        'results': results,
+    }
+
+
+def result_key(r):
+    ret_val = (r['benchmark'], r['size'])
+    if 'workers' in r:
+        ret_val += (r['workers'],)
+    return ret_val
+
+
+def compare(results, baseline, threshold=REGRESSION_THRESHOLD):
+    """ compare names/sec (ways/sec for intersections) against a baseline run
+        :return list of regression messages (benchmarks that are more than threshold slower than the baseline)
+    """
+    ret_val = []
+    base = dict((result_key(r), r) for r in baseline.get('results', []))
+    for r in results['results']:
+        b = base.get(result_key(r))
+        if b is None:
+            continue
+        unit = 'names_per_sec' if 'names_per_sec' in r else 'ways_per_sec'
+        ratio = r[unit] / b[unit]
+        label = "{} @ {}".format(r['benchmark'], r['size']) + (" x {} workers".format(r['workers']) if 'workers' in r else "")
+        msg = "{}: {} {} vs {} ({:+.1%})".format(label, r[unit], unit.replace('_per_sec', '/sec'), b[unit], ratio - 1.0)
+        print(msg)
+        if ratio < 1.0 - threshold:
+            ret_val.append(msg)
+    return ret_val
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(prog='bin/osm_rename_benchmark', description=__doc__.strip().split("\n")[0])
+    parser.add_argument('--ways', '-w', type=int, nargs='+', default=DEFAULT_WAYS, help="sizes (number of ways) to run, e.g. 10000 ... 10000000")
+    parser.add_argument('--benchmarks', '-b', nargs='+', default=list(DEFAULT_BENCHMARKS), choices=['to_str', 'parse', 'rename', 'intersections'])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1], help="worker counts for the intersections benchmark, e.g. 1 2 4 8")
+    parser.add_argument('--dir', '-d', default=None, help="directory for the (cached) synthetic .osm files")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--out', '-o', default="rename_benchmark.json", help="output .json file of the results")
+    parser.add_argument('--compare', '-c', default=None, help="baseline .json file ... exit code 1 on regressions")
+    parser.add_argument('--threshold', '-t', type=float, default=REGRESSION_THRESHOLD)
+    p = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    results = run(p.ways, p.dir, p.seed, p.benchmarks, p.workers)
+    with open(p.out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps(results['results'], indent=2))
+
+    if p.compare:
+        with open(p.compare) as f:
+            regressions = compare(results, json.load(f), p.threshold)
+        if regressions:
+            print("REGRESSIONS:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
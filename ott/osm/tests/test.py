@@ -1,10 +1,100 @@
+import io
 import os
+import csv
+import time
+import shutil
+import tempfile
+import threading
 import unittest
+from xml.etree import ElementTree as ET
 
+from osmread import parse_file
+
+from ott.osm.osm_sections import find_first_way, is_nodes_first, OsmSectionReader
+from ott.osm.pbf_blocks import FileBlock, HeaderBlock, PrimitiveBlock, OSM_HEADER, OSM_DATA
+from ott.osm.stats.osm_info import OsmInfo
+from ott.osm.osm_pipeline import OsmPipeline, StatsConsumer, TransitCullWriter, IntersectionsConsumer
+from ott.osm.artifact_catalog import ArtifactCatalog
+from ott.osm.step_scheduler import StepScheduler
+from ott.osm.stats.find_nodes import FindNodes
+from ott.osm.stats.tag_index import TagIndex
 from ott.osm.rename.osm_rename import OsmRename
+from ott.osm.rename.rename_memo import RenameMemo
+from ott.osm.rename.osm_abbr_parser import OsmAbbrParser
+from ott.osm.rename.stream_rename import StreamRename, is_street_name_key, find_attr_span
+from ott.osm.rename.mmap_rename import MmapRename
+from ott.osm.tests import osm_abbr_tester
+from ott.osm.tests.benchmark import write_synthetic_osm
+from ott.osm.intersections.osm_to_intersections import extract_intersections, intersection_nodes, osm_to_intersections, to_csv, to_csv_incremental, delta_csv_path
+from ott.osm.intersections.intersection_index import IntersectionIndex
+from ott.osm.intersections.cluster_intersections import cluster_intersections
+from ott.osm.intersections.intersection_writers import read_records
 from ott.utils import file_utils
 
 
+def write_pbf(root, pbf_path):
+    """ write the elements of an .osm xml tree to a (single block) .pbf file """
+    strings = [b""]
+
+    def sid(s):
+        s = s.encode('utf-8')
+        if s not in strings:
+            strings.append(s)
+        return strings.index(s)
+
+    def add_tags(e, x):
+        for t in x.findall('tag'):
+            e.keys.append(sid(t.get('k')))
+            e.vals.append(sid(t.get('v')))
+
+    block = PrimitiveBlock()
+    dense = block.primitivegroup.add().dense
+    last_id = last_lat = last_lon = 0
+    for x in root.findall('node'):
+        i, lat, lon = int(x.get('id')), int(round(float(x.get('lat')) * 1e7)), int(round(float(x.get('lon')) * 1e7))
+        dense.id.append(i - last_id)
+        dense.lat.append(lat - last_lat)
+        dense.lon.append(lon - last_lon)
+        last_id, last_lat, last_lon = i, lat, lon
+        for t in x.findall('tag'):
+            dense.keys_vals.extend((sid(t.get('k')), sid(t.get('v'))))
+        dense.keys_vals.append(0)
+        for f in (dense.denseinfo.version, dense.denseinfo.timestamp, dense.denseinfo.changeset,
+                  dense.denseinfo.uid, dense.denseinfo.user_sid):
+            f.append(0)
+
+    ways = block.primitivegroup.add().ways
+    for x in root.findall('way'):
+        w = ways.add()
+        w.id = int(x.get('id'))
+        w.info.user_sid = sid(x.get('user', ''))
+        add_tags(w, x)
+        last_ref = 0
+        for nd in x.findall('nd'):
+            w.refs.append(int(nd.get('ref')) - last_ref)
+            last_ref = int(nd.get('ref'))
+
+    relations = block.primitivegroup.add().relations
+    for x in root.findall('relation'):
+        r = relations.add()
+        r.id = int(x.get('id'))
+        add_tags(r, x)
+        last_ref = 0
+        for m in x.findall('member'):
+            r.memids.append(int(m.get('ref')) - last_ref)
+            r.types.append(('node', 'way', 'relation').index(m.get('type')))
+            r.roles_sid.append(sid(m.get('role')))
+            last_ref = int(m.get('ref'))
+    block.stringtable.s.extend(strings)
+
+    header = HeaderBlock()
+    header.required_features.extend(['OsmSchema-V0.6', 'DenseNodes'])
+    header.writingprogram = root.get('generator', '')
+    with open(pbf_path, "wb") as f:
+        FileBlock.from_block(OSM_HEADER, header).write_to(f)
+        FileBlock.from_block(OSM_DATA, block).write_to(f)
+
+
 class TestOsmRename(unittest.TestCase):
 
     def setUp(self):
@@ -38,6 +128,148 @@ class TestOsmRename(unittest.TestCase):
         r = file_utils.grep(osm_out, self.full_names_regexp)
         self.assertTrue(len(r) > 0)  # note: expect to grep multiple full names, since the renamer should not engage
 
+    def test_rename_is_line_layout_independent(self):
+        """ the streaming renamer shouldn't care if the xml is all on one line (or tags are split over lines) """
+        osm_in = os.path.join(self.thisdir, "data", "test_data_2018.osm")
+        with open(osm_in, "rb") as f:
+            one_line = f.read().replace(b"\n", b" ").replace(b'<tag k="name"', b'<tag\n k="name"')
+
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            osm_one_line = os.path.join(tmp_dir, "one_line.osm")
+            with open(osm_one_line, "wb") as f:
+                f.write(one_line)
+            OsmRename.rename(osm_one_line, os.path.join(tmp_dir, "one_line_renamed.osm"))
+            OsmRename.rename(osm_in, os.path.join(tmp_dir, "renamed.osm"))
+            with open(os.path.join(tmp_dir, "one_line_renamed.osm"), "rb") as f:
+                one_line_renamed = f.read()
+            with open(os.path.join(tmp_dir, "renamed.osm"), "rb") as f:
+                renamed = f.read()
+            self.assertNotEqual(one_line, one_line_renamed)
+            self.assertEqual(one_line_renamed, renamed.replace(b"\n", b" ").replace(b'<tag k="name"', b'<tag\n k="name"'))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_rename_whitespace_separated_attributes(self):
+        """ tab and newline separated attributes should rename the value of the tag being renamed (not a later tag's) """
+        self.assertEqual(find_attr_span(b'<tag\tk="name"\tv="A"/><tag k="x" v="B"/>', 0, 'v'), (17, 18, '"'))
+        self.assertIsNone(find_attr_span(b'<tag\nk="name"/><tag k="x" v="B"/>', 0, 'v'))
+
+        osm = b'<?xml version="1.0" encoding="UTF-8"?>\n<osm version="0.6" generator="x">\n' \
+              b'<way id="1">\n<tag\nk="name"\nv="North Main Street"/>\n<tag k="note" v="keep me"/>\n</way>\n' \
+              b'<way id="2">\n<tag\tk="name"\tv="South Oak Avenue"/><tag k="note" v="me too"/>\n</way>\n</osm>\n'
+        w = io.BytesIO()
+        StreamRename(OsmAbbrParser().to_str).process(io.BytesIO(osm), w)
+        tags = [(t.get('k'), t.get('v')) for t in ET.fromstring(w.getvalue()).iter('tag')]
+        self.assertEqual(tags, [('name', 'N Main St'), ('note', 'keep me'), ('name', 'S Oak Ave'), ('note', 'me too')])
+
+    def test_rename_memo(self):
+        """ renames are saved to the persistent memo, and the memo is emptied when the config key changes """
+        osm_in = os.path.join(self.thisdir, "data", "test_data_2018.osm")
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            memo_path = os.path.join(tmp_dir, "memo.db")
+            OsmRename.rename_cache = {}
+            OsmRename.rename(osm_in, os.path.join(tmp_dir, "renamed.osm"), memo_path=memo_path)
+
+            memo = RenameMemo(memo_path, OsmAbbrParser.config_key())
+            renames = memo.load()
+            memo.close()
+            self.assertEqual(renames, OsmRename.rename_cache)
+            self.assertTrue(len(renames) > 0)
+
+            memo = RenameMemo(memo_path, "some other config")
+            self.assertEqual(memo.load(), {})
+            memo.close()
+        finally:
+            OsmRename.rename_cache = {}
+            shutil.rmtree(tmp_dir)
+
+    def test_parallel_rename(self):
+        """ a multi-process rename should be byte-identical to the serial rename """
+        with open(os.path.join(self.thisdir, "data", "test_data.osm"), "rb") as f:
+            osm = f.read()
+        body_start = osm.index(b"  <way ")
+        body_end = osm.rindex(b"</osm>")
+
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            osm_in = os.path.join(tmp_dir, "big.osm")
+            with open(osm_in, "wb") as f:
+                f.write(osm[:body_start] + osm[body_start:body_end] * 25 + osm[body_end:])
+            serial = OsmRename.rename(osm_in, os.path.join(tmp_dir, "serial.osm"))
+            parallel = OsmRename.rename(osm_in, os.path.join(tmp_dir, "parallel.osm"), workers=3)
+            with open(serial.osm_output_path, "rb") as s, open(parallel.osm_output_path, "rb") as p:
+                self.assertEqual(s.read(), p.read())
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_mmap_rename(self):
+        """ the byte-level (mmap) renamer should give output that's byte-identical to the xml streaming renamer """
+        parser = OsmAbbrParser()
+        data_dir = os.path.join(self.thisdir, "data")
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            for f in sorted(os.listdir(data_dir)):
+                if not f.endswith(".osm"):
+                    continue
+                osm_in = os.path.join(data_dir, f)
+                with open(osm_in, "rb") as r, open(os.path.join(tmp_dir, "stream.osm"), "wb") as w:
+                    num_stream = StreamRename(parser.to_str).process(r, w)
+                num_mmap = MmapRename(parser.to_str).process(osm_in, os.path.join(tmp_dir, "mmap.osm"))
+                with open(os.path.join(tmp_dir, "stream.osm"), "rb") as s, open(os.path.join(tmp_dir, "mmap.osm"), "rb") as m:
+                    self.assertEqual(s.read(), m.read(), f)
+                self.assertEqual(num_stream, num_mmap, f)
+
+                # note: the scan is a set of the distinct names, and a prescan'd rename is the same as process()
+                scans = []
+                mmap_rename = MmapRename(parser.to_str)
+                self.assertEqual(mmap_rename.rename(osm_in, os.path.join(tmp_dir, "prescan.osm"), prescan=scans.append), num_mmap, f)
+                with open(os.path.join(tmp_dir, "prescan.osm"), "rb") as p, open(os.path.join(tmp_dir, "mmap.osm"), "rb") as m:
+                    self.assertEqual(p.read(), m.read(), f)
+                scan = mmap_rename.scan(osm_in)
+                self.assertIsInstance(scan, set)
+                self.assertEqual(scans, [scan] if scan else [], f)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_pbf_rename(self):
+        """ renaming a .pbf file should give the same tags as renaming the .osm file """
+        tree = ET.parse(os.path.join(self.thisdir, "data", "test_data.osm"))
+
+        # note: a node named the same as a street (the node's name is not renamed) shares the street's string
+        street = tree.getroot().find("way/tag[@k='name']").get('v')
+        node = tree.getroot().find('node')
+        ET.SubElement(node, 'tag', {'k': 'name', 'v': street})
+
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            osm_in = os.path.join(tmp_dir, "in.osm")
+            pbf_in = os.path.join(tmp_dir, "in.osm.pbf")
+            tree.write(osm_in, encoding="utf-8")
+            write_pbf(tree.getroot(), pbf_in)
+
+            osm = OsmRename.rename(osm_in, os.path.join(tmp_dir, "renamed.osm"))
+            pbf = OsmRename.rename(pbf_in, os.path.join(tmp_dir, "renamed.osm.pbf"))
+
+            osm_tags = {}
+            for e in ET.parse(osm.osm_output_path).getroot():
+                if e.tag in ('node', 'way', 'relation'):
+                    osm_tags[(e.tag, int(e.get('id')))] = dict((t.get('k'), t.get('v')) for t in e.findall('tag'))
+            pbf_tags = dict(((e.__class__.__name__.lower(), e.id), e.tags) for e in parse_file(pbf.osm_output_path))
+            self.assertEqual(osm_tags, pbf_tags)
+            names = [e.tags.get('name') for e in parse_file(pbf.osm_output_path)]
+            self.assertTrue(street in names)
+            self.assertTrue(OsmRename.rename_cache[street] in names)
+            self.assertNotEqual(street, OsmRename.rename_cache[street])
+
+            # the renamed .pbf is marked, so renaming it again is a no-op
+            again = OsmRename.rename(pbf.osm_output_path, os.path.join(tmp_dir, "again.osm.pbf"))
+            with open(pbf.osm_output_path, "rb") as a, open(again.osm_output_path, "rb") as b:
+                self.assertEqual(a.read(), b.read())
+        finally:
+            shutil.rmtree(tmp_dir)
+
     def test_problematic_strings(self):
         osm_in = os.path.join(self.thisdir, "data", "test_data_problematic_strings.osm")
         osm_out = os.path.join(self.thisdir, "data", "test_renamed_problematic_strings.osm")
@@ -59,6 +291,381 @@ class TestOsmRename(unittest.TestCase):
             self.assertTrue(len(r) == 1)
 
 
+class TestOsmSections(unittest.TestCase):
+
+    def setUp(self):
+        self.thisdir = file_utils.get_module_dir(self.__class__)
+
+    def tearDown(self):
+        pass
+
+    def test_find_first_way(self):
+        """ the binary search for the end of the node section should land on the first <way> (for any look ahead) """
+        osm = b'<osm version="0.6">\n'
+        osm += b"".join(b'  <node id="%d" lat="1" lon="2">\n    <tag k="name" v="way"/>\n  </node>\n' % i for i in range(500))
+        first_way = len(osm) + 2
+        osm += b"".join(b'  <way id="%d">\n    <nd ref="%d"/>\n  </way>\n' % (i, i) for i in range(100))
+        osm += b'  <relation id="1"/>\n</osm>\n'
+        for look_ahead in (1, 10, 1000, 64 * 1024):
+            self.assertEqual(find_first_way(osm, look_ahead=look_ahead), first_way)
+        self.assertEqual(find_first_way(osm, 0, first_way - 2), first_way - 2)
+
+        end = osm.rfind(b"</osm>")
+        self.assertTrue(is_nodes_first(osm, 20, first_way, end))
+        self.assertTrue(is_nodes_first(osm[:first_way - 2] + b"</osm>", 20, first_way - 2, first_way - 2))
+        self.assertFalse(is_nodes_first(osm, 20, end, end))
+        self.assertFalse(is_nodes_first(osm, 20, first_way - 2, end))
+        stray = osm[:end] + b'  <node id="501" lat="1" lon="2"/>\n' + osm[end:]
+        self.assertFalse(is_nodes_first(stray, 20, first_way, end + 35))
+
+    def test_ways_section(self):
+        """ the ways section reader should give the parser all of the ways and relations, and none of the nodes
+            (unless the file isn't sorted nodes first, where it has to give the parser everything)
+        """
+        osm_path = os.path.join(self.thisdir, "data", "test_data.osm")
+        tree = ET.parse(osm_path)
+        root = tree.getroot()
+        with OsmSectionReader.ways(osm_path) as fp:
+            self.assertEqual(len(ET.parse(fp).getroot()), len(root.findall('*[@id]')))
+
+        elements = sorted(root, key=lambda e: ('bounds', 'node', 'way', 'relation').index(e.tag))
+        root[:] = elements
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            sorted_path = os.path.join(tmp_dir, "sorted.osm")
+            tree.write(sorted_path, encoding="utf-8")
+            with OsmSectionReader.ways(sorted_path) as fp:
+                section = ET.parse(fp).getroot()
+            self.assertEqual([e.get('id') for e in section], [e.get('id') for e in elements if e.tag in ('way', 'relation')])
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_synthetic_osm(self):
+        """ the benchmark's synthetic .osm file should be valid xml, sorted nodes first (like osmosis output) """
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            osm_path = write_synthetic_osm(os.path.join(tmp_dir, "bench.osm"), 500)
+            root = ET.parse(osm_path).getroot()
+            self.assertEqual(len(root.findall('way')), 500)
+            self.assertTrue(len(set(w.find("tag[@k='name']").get('v') for w in root.findall('way'))) > 20)
+            with OsmSectionReader.ways(osm_path) as fp:
+                self.assertEqual(len(ET.parse(fp).getroot()), 500)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+class TestOsmInfo(unittest.TestCase):
+
+    def setUp(self):
+        self.thisdir = file_utils.get_module_dir(self.__class__)
+
+    def tearDown(self):
+        pass
+
+    def test_scan_stats(self):
+        """ the (fast) .osm scan should find the same stats as osmread, with any number of workers ... the newest
+            element is a node, and the relation's highway tag shouldn't count as a highway way
+        """
+        def element(tag, id, timestamp, changeset, body=""):
+            return '  <{0} id="{1}" version="1" timestamp="{2}" uid="3" changeset="{3}">\n{4}  </{0}>\n'.format(
+                tag, id, timestamp, changeset, body)
+
+        highway = '    <nd ref="1"/>\n    <tag k="highway" v="residential"/>\n    <tag k="name" v="A St"/>\n'
+        osm = '<osm version="0.6">\n'
+        osm += element('node', 1, "2020-05-05T00:00:00Z", 99)
+        for i in range(1, 60):
+            timestamp = "201{}-0{}-1{}T1{}:00:00Z".format(i % 7, i % 9 + 1, i % 10, i % 10)
+            osm += element('way', i, timestamp, i * 10 if i % 4 else 0, highway if i % 3 else '    <nd ref="1"/>\n')
+        osm += element('relation', 1, "2019-01-01T00:00:00Z", 5, '    <tag k="highway" v="primary"/>\n')
+        osm += '</osm>\n'
+
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            osm_path = os.path.join(tmp_dir, "stats.osm")
+            with open(osm_path, "w") as f:
+                f.write(osm)
+            parsed = OsmInfo.calculate(osm_path, validate=True).to_json()
+            self.assertEqual(parsed['way_count'], 59)
+            self.assertEqual(parsed['highway_count'], 40)
+            for workers in (1, 3):
+                self.assertEqual(OsmInfo.calculate(osm_path, workers=workers).to_json(), parsed)
+            self.assertEqual(OsmInfo.validate_stats(os.path.join(self.thisdir, "data", "test_data_utf8.osm")), [])
+
+            # note: a (legal) unescaped '>' in an attribute value before the newest way's timestamp, id and changeset
+            newest = element('way', 59, "2018-12-31T23:59:59Z", 590, highway)
+            with open(osm_path, "w") as f:
+                f.write(osm.replace(element('way', 59, "2013-06-19T19:00:00Z", 590, highway), newest.replace('<way ', '<way user="a>b" '))
+                           .replace('<way id="58"', "<way user='c>d' id=\"58\""))
+            parsed = OsmInfo.calculate(osm_path, validate=True)
+            self.assertEqual((parsed.last.id, parsed.last.changeset), (59, 590))
+            for workers in (1, 3):
+                self.assertEqual(OsmInfo.calculate(osm_path, workers=workers).to_json(), parsed.to_json())
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_cached_stats(self):
+        """ cache'd -stats are used until the osm file changes (a touched file with the same sha1 hasn't changed),
+            and the (multi-process) cache dir msgs are the same as the serial ones
+        """
+        osm = '<osm version="0.6">\n  <way id="{}" version="1" timestamp="2019-03-0{}T00:00:00Z" changeset="{}">\n' \
+              '    <tag k="highway" v="primary"/>\n  </way>\n</osm>\n'
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            osm_path = os.path.join(tmp_dir, "a.osm")
+            with open(osm_path, "w") as f:
+                f.write(osm.format(11, 1, 123))
+            with open(os.path.join(tmp_dir, "b.osm"), "w") as f:
+                f.write(osm.format(22, 2, 456))
+
+            stats = OsmInfo.get_stats(osm_path, use_hash=True)
+            self.assertEqual(stats['last']['changeset'], 123)
+            self.assertEqual(stats['file_key']['sha1'], OsmInfo.file_sha1(osm_path))
+
+            # touched, but the same content: the stats stay (and get the new mtime)
+            os.utime(osm_path, (stats['file_key']['mtime'] + 100, stats['file_key']['mtime'] + 100))
+            self.assertEqual(OsmInfo.read_cached_stats(osm_path)['last']['changeset'], 123)
+            self.assertEqual(OsmInfo.read_cached_stats(osm_path)['file_key']['mtime'], os.path.getmtime(osm_path))
+
+            # same size and mtime, but new content: the sha1 doesn't match, so new stats are calculated
+            with open(osm_path, "w") as f:
+                f.write(osm.format(11, 1, 124))
+            os.utime(osm_path, (stats['file_key']['mtime'] + 200, stats['file_key']['mtime'] + 200))
+            self.assertIsNone(OsmInfo.read_cached_stats(osm_path))
+            self.assertEqual(OsmInfo.get_stats(osm_path)['last']['changeset'], 124)
+
+            # a new mtime, and stats without a sha1: the stats are recalculated, even though they're newer than the file
+            mtime = os.path.getmtime(osm_path)
+            os.utime(osm_path, (mtime - 1000, mtime - 1000))
+            self.assertIsNone(OsmInfo.read_cached_stats(osm_path))
+
+            msgs = OsmInfo.get_cache_msgs(tmp_dir, detailed=True)
+            self.assertIn("http://osm.org/way/11, changeset: 124", msgs)
+            self.assertIn("http://osm.org/way/22, changeset: 456", msgs)
+            self.assertEqual(OsmInfo.get_cache_msgs(tmp_dir, detailed=True, workers=2), msgs)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_pbf_header_stats(self):
+        """ the feed message of a .pbf file comes from just its header block (replication timestamp, sequence and bbox),
+            unless it has fresh -stats cache'd
+        """
+        header = HeaderBlock()
+        header.required_features.append('OsmSchema-V0.6')
+        header.osmosis_replication_timestamp = 1546300800
+        header.osmosis_replication_sequence_number = 2345
+        header.osmosis_replication_base_url = "http://download.geofabrik.de/north-america/us/oregon-updates"
+        header.bbox.left, header.bbox.right = -123000000000, -122000000000
+        header.bbox.top, header.bbox.bottom = 46000000000, 45000000000
+
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            pbf_path = os.path.join(tmp_dir, "or-wa.osm.pbf")
+            with open(pbf_path, "wb") as f:
+                FileBlock.from_block(OSM_HEADER, header).write_to(f)
+                f.write(b"not a data block ... never read")
+
+            stats = OsmInfo.pbf_header_stats(pbf_path)
+            self.assertEqual(stats['replication']['sequence_number'], 2345)
+            self.assertEqual(stats['last']['edit_date'], "January 01, 2019")
+            self.assertEqual(stats['bbox'], {'top': 46.0, 'bottom': 45.0, 'left': -123.0, 'right': -122.0})
+
+            msg = OsmInfo.get_cache_msgs(tmp_dir, detailed=True)
+            self.assertIn("or-wa.osm.pbf", msg)
+            self.assertIn("last OSM update = January 01, 2019 : replication sequence 2345 @ http://download.geofabrik.de", msg)
+            self.assertFalse(os.path.exists(OsmInfo.get_stats_file_path(pbf_path)))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+class TestArtifactCatalog(unittest.TestCase):
+
+    def test_catalog(self):
+        """ the catalog should know each artifact's stats, and what was made from what (and from those, etc.) """
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            def path(name, content="x"):
+                ret_val = os.path.join(tmp_dir, name)
+                with open(ret_val, "w") as f:
+                    f.write(content)
+                return ret_val
+
+            pbf, osm, osm_pbf, csv = path("or-wa-latest.osm.pbf"), path("or-wa.osm"), path("or-wa.osm.pbf"), path("i.csv")
+            with ArtifactCatalog(os.path.join(tmp_dir, "artifacts.db")) as catalog:
+                self.assertTrue(catalog.record(pbf, 'download_pbf'))
+                self.assertTrue(catalog.record(osm, 'clip_region_to_bbox', [pbf], {'way_count': 1}, use_hash=True))
+                self.assertTrue(catalog.record(osm_pbf, 'osm_to_pbf', [osm]))
+                self.assertTrue(catalog.record(csv, 'intersections_export', [osm]))
+                self.assertFalse(catalog.record(os.path.join(tmp_dir, "nope.osm"), 'osm_to_pbf', [osm]))
+
+                self.assertEqual(catalog.latest_stats("or-wa.osm"), {'way_count': 1})
+                self.assertIsNone(catalog.latest_stats("or-wa.osm.pbf"))
+                self.assertEqual(catalog.inputs_of(osm_pbf), [osm])
+                self.assertEqual(catalog.outputs_of(pbf), [osm])
+                self.assertEqual(catalog.outputs_of(pbf, recursive=True), sorted([osm, osm_pbf, csv]))
+                self.assertEqual([a['path'] for a in catalog.artifacts('osm_to_pbf')], [osm_pbf])
+                self.assertEqual(catalog.get(osm)['sha1'], OsmInfo.file_sha1(osm))
+                self.assertTrue(catalog.is_current(osm))
+
+                # re-recording keeps the stats (unless new ones are given), and a changed file isn't current
+                path("or-wa.osm", "xy")
+                self.assertFalse(catalog.is_current(osm))
+                catalog.record(osm, 'clip_region_to_bbox', [pbf])
+                self.assertEqual(catalog.get(osm)['stats'], {'way_count': 1})
+                self.assertIsNone(catalog.get(osm)['sha1'])
+                self.assertTrue(catalog.is_current(osm))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+class TestOsmPipeline(unittest.TestCase):
+
+    def test_single_pass(self):
+        """ the consumers of one read of an .osm file should get the same stats and intersections as their own reads,
+            and the transit cull writer should copy everything but the transit elements
+        """
+        osm = TestOsmIntersections.grid_osm().replace('<way id="10">', '<way id="10" timestamp="2020-02-02T20:20:20Z" changeset="9">')
+        transit = '<node id="8" lat="45.8" lon="-122.8"><tag k="highway" v="bus_stop"/></node>' + \
+                  '<way id="14"><nd ref="8"/><tag k="public_transport" v="platform"/></way>' + \
+                  '<relation id="20"><member type="node" ref="8" role=""/><tag k="type" v="route_master"/></relation>' + \
+                  '<relation id="21"><member type="way" ref="10" role=""/><tag k="type" v="multipolygon"/></relation>'
+        osm = osm.replace('<way id="10"', transit + '<way id="10"', 1)
+
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            osm_path = os.path.join(tmp_dir, "grid.osm")
+            with open(osm_path, "w") as f:
+                f.write(osm)
+
+            pipeline = OsmPipeline(osm_path)
+            stats = pipeline.add(StatsConsumer())
+            cull = pipeline.add(TransitCullWriter())
+            intersections = pipeline.add(IntersectionsConsumer(os.path.join(tmp_dir, "intersection.csv")))
+            pipeline.run()
+
+            cached = OsmInfo.get_stats(osm_path)
+            self.assertEqual(cached.pop('file_key')['size'], os.path.getsize(osm_path))
+            self.assertEqual(cached, OsmInfo.calculate(osm_path).to_json())
+            self.assertEqual(stats.stats.last.changeset, 9)
+            self.assertEqual(intersections.intersections, extract_intersections(osm_path))
+            self.assertEqual(len(list(read_records(os.path.join(tmp_dir, "intersection.csv")))), 4)
+
+            culled = ET.parse(cull.osm_out_path).getroot()
+            self.assertEqual(cull.osm_out_path, os.path.join(tmp_dir, "grid_cull_transit.osm"))
+            self.assertEqual(culled.get('version'), "0.6")
+            self.assertEqual([e.get('id') for e in culled], [e.get('id') for e in ET.fromstring(osm) if e.get('id') not in ('8', '14', '20')])
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+class TestStepScheduler(unittest.TestCase):
+
+    def test_schedule(self):
+        """ steps should wait on the steps that write their inputs, overlap otherwise, and respect resource limits """
+        lock = threading.Lock()
+        log = []
+        running = {'osmosis': 0, 'max osmosis': 0, 'all': 0, 'max all': 0}
+
+        def step(name, resource=None, fail=False):
+            def run():
+                with lock:
+                    log.append(('start', name))
+                    for r in ('all', resource):
+                        if r:
+                            running[r] += 1
+                            running['max ' + r] = max(running['max ' + r], running[r])
+                time.sleep(0.05)
+                with lock:
+                    log.append(('end', name))
+                    for r in ('all', resource):
+                        if r:
+                            running[r] -= 1
+                if fail:
+                    raise IOError("{} failed".format(name))
+            return run
+
+        def add_steps(scheduler, fail=None):
+            scheduler.add('stats', step('stats'), ['a.osm'], ['a.osm-stats'])
+            for n in ('a', 'b', 'c'):
+                scheduler.add('pbf ' + n, step('pbf ' + n, 'osmosis', fail == n), [n + '.osm'], [n + '.osm.pbf'], 'osmosis')
+            scheduler.add('cull', step('cull', 'osmosis'), ['a.osm'], ['a_cull.osm'], 'osmosis')
+            scheduler.add('cull pbf', step('cull pbf', 'osmosis'), ['a_cull.osm'], ['a_cull.osm.pbf'], 'osmosis')
+            scheduler.add('intersections', step('intersections'), ['a.osm', 'a.osm.pbf'], ['i.csv'])
+
+        # one worker runs the steps in the order they were added
+        scheduler = StepScheduler(1)
+        add_steps(scheduler)
+        self.assertEqual(scheduler.run(), ['stats', 'pbf a', 'pbf b', 'pbf c', 'cull', 'cull pbf', 'intersections'])
+        self.assertEqual(running['max all'], 1)
+
+        del log[:]
+        running.update({'max osmosis': 0, 'max all': 0})
+        scheduler = StepScheduler(4, {'osmosis': 2})
+        add_steps(scheduler)
+        self.assertEqual(sorted(scheduler.run()), sorted(s.name for s in scheduler.steps))
+        self.assertEqual(running['max osmosis'], 2)
+        self.assertTrue(running['max all'] >= 3)
+        self.assertEqual(scheduler.steps[-1].depends_on, {'pbf a'})
+        self.assertTrue(log.index(('end', 'cull')) < log.index(('start', 'cull pbf')))
+        self.assertTrue(log.index(('end', 'pbf a')) < log.index(('start', 'intersections')))
+
+        # after a failure, nothing else starts, and the failure is raised
+        scheduler = StepScheduler(1)
+        add_steps(scheduler, fail='b')
+        self.assertRaises(IOError, scheduler.run)
+        self.assertEqual([s.status for s in scheduler.steps], ['done', 'done', 'failed', 'skipped', 'skipped', 'skipped', 'skipped'])
+
+        scheduler = StepScheduler(2)
+        scheduler.add('x', step('x'), ['y.txt'], ['x.txt'])
+        scheduler.add('y', step('y'), ['x.txt'], ['y.txt'])
+        self.assertRaises(ValueError, scheduler.run)
+        scheduler = StepScheduler(2)
+        scheduler.add('x', step('x'), outputs=['x.txt'])
+        scheduler.add('y', step('y'), outputs=['x.txt'])
+        self.assertRaises(ValueError, scheduler.run)
+        self.assertRaises(ValueError, scheduler.add, 'x', step('x'))
+
+
+class TestFindNodes(unittest.TestCase):
+
+    def test_tag_index(self):
+        """ finds should come from a (saved, then memory-mapped) tag index, with way coordinates at their nodes' mean """
+        osm = '<?xml version="1.0" encoding="UTF-8"?>\n<osm version="0.6">' + \
+              '<node id="1" lat="45.0" lon="-122.0"/><node id="2" lat="45.0" lon="-122.2"/>' + \
+              '<node id="3" lat="45.2" lon="-122.2"/><node id="4" lat="45.2" lon="-122.0"/>' + \
+              '<node id="5" lat="45.5" lon="-122.5"><tag k="amenity" v="parking"/><tag k="park_ride" v="bus"/></node>' + \
+              '<node id="6" lat="45.6" lon="-122.6"><tag k="amenity" v="parking"/><tag k="park_ride" v="no"/></node>' + \
+              '<node id="7" lat="45.7" lon="-122.7"><tag k="name" v="Café"/><tag k="amenity" v="cafe"/></node>' + \
+              '<way id="10"><nd ref="1"/><nd ref="2"/><nd ref="3"/><nd ref="4"/><nd ref="99"/>' + \
+              '<tag k="amenity" v="parking"/><tag k="park_ride" v="yes"/><tag k="name" v="Sunset TC P&amp;R"/></way>' + \
+              '<relation id="20"><member type="way" ref="10" role=""/><tag k="parking" v="park_and_ride"/></relation>' + \
+              '</osm>'
+
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            osm_path = os.path.join(tmp_dir, "pr.osm")
+            with io.open(osm_path, "w", encoding="utf-8") as f:
+                f.write(osm)
+
+            parking = FindNodes.find(osm_path, 'amenity', 'parking')
+            self.assertTrue(os.path.exists(FindNodes.get_index_path(osm_path)))
+            self.assertEqual([(n.node['type'], n.node_id) for n in parking], [('node', 5), ('node', 6), ('way', 10)])
+            self.assertEqual((parking[2].node['lat'], parking[2].node['lon']), (45.1, -122.1))
+            self.assertEqual([n.node_id for n in FindNodes.find(osm_path, 'park_ride')], [10])
+            self.assertEqual([n.tag_value for n in FindNodes.find(osm_path, 'amenity', '*')], ['parking', 'parking', 'cafe', 'parking'])
+            self.assertEqual([n.tag_value for n in FindNodes.find(osm_path, 'name', None)], [None, None])
+            self.assertEqual(FindNodes.find(osm_path, 'name', 'Café'), [])
+            self.assertEqual(FindNodes.find(osm_path, 'shop', '*'), [])
+            self.assertEqual([(n.node['type'], n.node_id) for n in FindNodes.find_park_and_rides(osm_path)],
+                             [('node', 5), ('way', 10), ('relation', 20)])
+
+            index = TagIndex.load(FindNodes.get_index_path(osm_path))
+            self.assertEqual(index.values('amenity'), [('cafe', 1), ('parking', 3)])
+            self.assertEqual(index.find('park_ride', ['bus', 'yes']), TagIndex.build(osm_path).find('park_ride', ['bus', 'yes']))
+            self.assertIsNone(index.element(len(index) - 1)['lat'])
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
 class TestOsmIntersections(unittest.TestCase):
 
     def setUp(self):
@@ -72,3 +679,343 @@ class TestOsmIntersections(unittest.TestCase):
         #self.assertTrue()
         pass
 
+    @classmethod
+    def grid_osm(cls):
+        """ A & B cross at node 2, A & C at 3, and node 5 is shared by B and a footway (not a road) """
+        def way(id, refs, highway, *names):
+            nds = "".join('<nd ref="{}"/>'.format(r) for r in refs)
+            tags = "".join('<tag k="{}" v="{}"/>'.format(k, v) for k, v in names)
+            return '<way id="{}">{}<tag k="highway" v="{}"/>{}</way>'.format(id, nds, highway, tags)
+
+        nodes = "".join('<node id="{0}" lat="45.{0}" lon="-122.{0}"/>'.format(i) for i in range(1, 8))
+        ways = way(10, (1, 2, 3), 'residential', ('name', 'A St')) + \
+               way(11, (4, 2, 5), 'primary', ('name', 'B St')) + \
+               way(12, (3, 6), 'tertiary', ('name', 'C St'), ('alt_name', 'Hwy 1')) + \
+               way(13, (5, 7), 'footway', ('name', 'D Path'))
+        return '<osm version="0.6">{}{}</osm>'.format(nodes, ways)
+
+    def test_extract_intersections(self):
+        """ intersections are nodes shared by two or more (named) roads ... A & B cross at node 2, A & C at 3,
+            and node 5 is shared by B and a footway (not a road), so it's not an intersection
+        """
+        osm = self.grid_osm()
+
+        expected = {
+            ('A St', 'B St'): '45.2,-122.2',
+            ('A St', 'C St'): '45.3,-122.3',
+            ('A St', 'Hwy 1'): '45.3,-122.3',
+            ('C St', 'Hwy 1'): '45.3,-122.3',
+        }
+        self.assertEqual(extract_intersections(osm), expected)
+
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            osm_path = os.path.join(tmp_dir, "grid.osm")
+            with open(osm_path, "w") as f:
+                f.write(osm.replace("><", ">\n<"))
+            self.assertEqual(extract_intersections(osm_path), expected)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_pbf_intersections(self):
+        """ a .pbf file should have the same intersections as the .osm file it's made from """
+        osm = self.grid_osm()
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            osm_path = os.path.join(tmp_dir, "grid.osm")
+            with open(osm_path, "w") as f:
+                f.write(osm)
+            pbf_path = osm_path + ".pbf"
+            write_pbf(ET.fromstring(osm), pbf_path)
+            self.assertEqual(extract_intersections(pbf_path), extract_intersections(osm_path))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_parallel_intersections(self):
+        """ sharding the .osm file across worker processes should give the same intersections, in the same order """
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            osm_path = write_synthetic_osm(os.path.join(tmp_dir, "synthetic.osm"), 2000)
+            serial = extract_intersections(osm_path)
+            parallel = extract_intersections(osm_path, workers=3)
+            self.assertTrue(len(serial) > 0)
+            self.assertEqual(list(serial.items()), list(parallel.items()))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_intersection_index(self):
+        """ name pair lookups (either order, partial names), nearest and bbox queries, before and after save / load """
+        index = IntersectionIndex.from_intersections(extract_intersections(self.grid_osm()))
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            index_path = os.path.join(tmp_dir, "grid.idx")
+            index.save(index_path)
+            loaded = IntersectionIndex.load(index_path)
+            for i in (index, loaded):
+                self.assertEqual(len(i), 4)
+                self.assertEqual(i.lookup("A St", "B St"), i.lookup("b st.", "A"))
+                self.assertEqual([(r['lat'], r['lon']) for r in i.lookup("A St", "B St")], [(45.2, -122.2)])
+                self.assertEqual(len(i.lookup("A", "C St")), 1)
+                self.assertEqual(i.lookup("A St", "D Path"), [])
+
+                nearest = i.nearest(45.21, -122.21, k=2)
+                self.assertEqual([r['name'] for r in nearest[:1]], ["A St & B St"])
+                self.assertEqual(len(nearest), 2)
+                self.assertTrue(nearest[0]['distance'] < nearest[1]['distance'])
+
+                self.assertEqual(sorted(r['cross_street'] for r in i.within_bbox(45.35, 45.25, -122.35, -122.25)), ["C St", "Hwy 1", "Hwy 1"])
+                self.assertEqual(i.within_bbox(45.0, 44.9, -122.0, -121.9), [])
+            loaded.close()
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_intersection_index_far_away(self):
+        """ nearest to a point far outside the index's region doesn't search rings of empty cells across the globe """
+        intersections = {('A St', 'B St'): '45.5,-122.6', ('A St', 'C St'): '45.6,-122.7'}
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            index_path = os.path.join(tmp_dir, "far.idx")
+            IntersectionIndex.from_intersections(intersections).save(index_path)
+            with IntersectionIndex.load(index_path) as index:
+                start = time.time()
+                self.assertEqual([r['name'] for r in index.nearest(40.0, -110.0)], ["A St & B St"])
+                nearest = index.nearest(-45.0, 60.0, k=5)
+                self.assertEqual(sorted(r['name'] for r in nearest), ["A St & B St", "A St & C St"])
+                self.assertTrue(nearest[0]['distance'] <= nearest[1]['distance'])
+                self.assertTrue(time.time() - start < 1.0)
+            self.assertIsNone(index.mm)
+            self.assertEqual(IntersectionIndex.from_intersections({}).nearest(45.5, -122.6), [])
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_incremental_csv(self):
+        """ re-exporting keeps the ids, and the delta files just have the added, removed and changed rows """
+        intersections = extract_intersections(self.grid_osm())
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            csv_path = os.path.join(tmp_dir, "intersection.csv")
+            to_csv(intersections, csv_path)
+            counts = to_csv_incremental(intersections, csv_path)
+            self.assertEqual(counts, {'added': 0, 'removed': 0, 'changed': 4})  # to_csv's ids were 1 to n
+
+            with open(csv_path) as f:
+                ids = dict(((r['street'], r['cross_street']), r['id']) for r in csv.DictReader(f))
+            self.assertEqual(to_csv_incremental(intersections, csv_path), {'added': 0, 'removed': 0, 'changed': 0})
+
+            changed = dict(intersections)
+            del changed[('A St', 'B St')]
+            changed[('A St', 'C St')] = '45.3001,-122.3'
+            changed[('A St', 'E St')] = '45.8,-122.8'
+            self.assertEqual(to_csv_incremental(changed, csv_path), {'added': 1, 'removed': 1, 'changed': 1})
+
+            def read(delta_type):
+                with open(delta_csv_path(csv_path, delta_type)) as f:
+                    return [(r['id'], r['cross_street']) for r in csv.DictReader(f)]
+            self.assertEqual(read('removed'), [(ids[('A St', 'B St')], 'B St')])
+            self.assertEqual(read('changed'), [(ids[('A St', 'C St')], 'C St')])
+            self.assertEqual([r[1] for r in read('added')], ['E St'])
+
+            # a move across a stable id rounding boundary (45.3001 to 45.3006) is a change, and keeps the id ... but
+            # a move of ~1 km is a removed and an added row
+            moved = dict(changed)
+            moved[('A St', 'C St')] = '45.3006,-122.3'
+            self.assertEqual(to_csv_incremental(moved, csv_path), {'added': 0, 'removed': 0, 'changed': 1})
+            self.assertEqual(read('changed'), [(ids[('A St', 'C St')], 'C St')])
+            self.assertEqual(to_csv_incremental(moved, csv_path), {'added': 0, 'removed': 0, 'changed': 0})
+            with open(csv_path) as f:
+                self.assertIn(ids[('A St', 'C St')], [r['id'] for r in csv.DictReader(f)])
+            moved[('A St', 'C St')] = '45.31,-122.3'
+            self.assertEqual(to_csv_incremental(moved, csv_path), {'added': 1, 'removed': 1, 'changed': 0})
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_cluster_intersections(self):
+        """ a divided highway crosses A St at 2 nodes (~30 meters apart), and A St & Hwy 1 also cross ~2 km away """
+        nodes = [
+            (['A St', 'Hwy 1'], '45.5000000,-122.6000000'),
+            (['Hwy 1', 'A St', 'B St'], '45.5000000,-122.6004000'),
+            (['A St', 'Hwy 1'], '45.5200000,-122.6000000'),
+            (['C St', 'D St'], '45.5001000,-122.6001000'),
+        ]
+        clusters = cluster_intersections(nodes, max_distance=100)
+        self.assertEqual([c[0] for c in clusters], [('A St', 'Hwy 1'), ('Hwy 1', 'B St'), ('A St', 'B St'), ('A St', 'Hwy 1'), ('C St', 'D St')])
+        self.assertEqual(clusters[0][1], '45.5000000,-122.6002000')
+        self.assertEqual(clusters[3][1], '45.5200000,-122.6000000')
+        self.assertEqual(len(cluster_intersections(nodes, max_distance=5000)), 4)
+
+        # the clusters write out to the same .csv as extract_intersections() output
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            csv_path = os.path.join(tmp_dir, "intersection.csv")
+            to_csv(clusters, csv_path)
+            with open(csv_path) as f:
+                self.assertEqual([r['id'] for r in csv.DictReader(f)], ['1', '2', '3', '4', '5'])
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_cluster_drift(self):
+        """ a chain of nodes, each ~90 meters north of the cluster's (moving) centroid, should be one cluster ... even
+            once the centroid has drifted several (100 meter) cells from the chain's first node
+        """
+        nodes = []
+        lat_sum = 0.0
+        for n in range(100):
+            lat = 45.5 if n == 0 else lat_sum / n + 90.0 / 111320.0
+            lat_sum += lat
+            nodes.append((['A St', 'Hwy 1'], '{:.7f},-122.6000000'.format(lat)))
+        self.assertTrue(float(nodes[-1][1].split(',')[0]) - 45.5 > 4 * 100 / 111320.0)
+
+        clusters = cluster_intersections(nodes, max_distance=100)
+        self.assertEqual(len(clusters), 1)
+        self.assertEqual(clusters[0][1], '{:.7f},-122.6000000'.format(sum(float(c.split(',')[0]) for n, c in nodes) / len(nodes)))
+
+    def test_incremental_clusters(self):
+        """ A St loops to cross B St twice (~33 meters apart), so with a 20 meter cluster distance there are two
+            A & B intersections in the same ~100 meter stable id cell ... they should still get distinct ids
+        """
+        osm = '<osm version="0.6">' + \
+              '<node id="1" lat="45.0001" lon="-122.0002"/><node id="2" lat="45.0004" lon="-122.0002"/>' + \
+              '<node id="3" lat="45.0002" lon="-122.0004"/><node id="4" lat="45.0002" lon="-122.0001"/>' + \
+              '<way id="10"><nd ref="1"/><nd ref="3"/><nd ref="2"/><tag k="highway" v="residential"/><tag k="name" v="A St"/></way>' + \
+              '<way id="11"><nd ref="1"/><nd ref="4"/><nd ref="2"/><tag k="highway" v="residential"/><tag k="name" v="B St"/></way>' + \
+              '</osm>'
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            osm_path = os.path.join(tmp_dir, "loop.osm")
+            csv_path = os.path.join(tmp_dir, "intersection.csv")
+            with open(osm_path, "w") as f:
+                f.write(osm)
+
+            osm_to_intersections(osm_path, csv_path, incremental=True, cluster_distance=20)
+            rows = list(read_records(csv_path))
+            self.assertEqual(len(rows), 2)
+            self.assertEqual(rows[1]['id'], rows[0]['id'] + "-2")
+            self.assertEqual(len(list(read_records(delta_csv_path(csv_path, 'added')))), 2)
+
+            # note: a re-export is unchanged, and the suffixes follow the coordinates, not the order of the records
+            clusters = cluster_intersections(intersection_nodes(osm_path), 20)
+            self.assertEqual(to_csv_incremental(clusters, csv_path), {'added': 0, 'removed': 0, 'changed': 0})
+            self.assertEqual(to_csv_incremental(list(reversed(clusters)), csv_path), {'added': 0, 'removed': 0, 'changed': 0})
+            self.assertEqual(sorted(r['id'] for r in read_records(csv_path)), sorted(r['id'] for r in rows))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_intersection_writers(self):
+        """ each output format (by extension) reads back the same rows ... and incremental exports work on them too """
+        intersections = extract_intersections(self.grid_osm())
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            csv_path = os.path.join(tmp_dir, "intersection.csv")
+            to_csv(intersections, csv_path)
+            expected = list(read_records(csv_path))
+            self.assertEqual(len(expected), 4)
+
+            exts = ['.csv.gz', '.ndjson', '.jsonl.gz']
+            try:
+                import pyarrow
+                exts += ['.parquet', '.arrow']
+            except ImportError:
+                pass
+            for ext in exts:
+                path = os.path.join(tmp_dir, "intersection" + ext)
+                to_csv(intersections, path)
+                rows = list(read_records(path))
+                self.assertEqual([dict((k, str(v) if v is not None else '') for k, v in r.items()) for r in rows], expected, ext)
+
+                self.assertEqual(to_csv_incremental(intersections, path), {'added': 0, 'removed': 0, 'changed': 4}, ext)
+                self.assertEqual(to_csv_incremental(intersections, path), {'added': 0, 'removed': 0, 'changed': 0}, ext)
+                self.assertTrue(os.path.exists(delta_csv_path(path, 'added')))
+            self.assertTrue(delta_csv_path(csv_path + ".gz", 'added').endswith("intersection-added.csv.gz"))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_road_node_arrays(self):
+        """ the numpy road node counter finds the same shared nodes (and road names, in the same order) as the dict one """
+        from ott.osm.intersections import osm_to_intersections
+        if osm_to_intersections.np is None:
+            self.skipTest("numpy isn't installed")
+
+        osm = '<osm>' \
+              '<way id="1"><nd ref="9"/><nd ref="2"/><nd ref="9"/><tag k="highway" v="primary"/><tag k="name" v="A St"/></way>' \
+              '<way id="2"><nd ref="2"/><nd ref="3"/><tag k="highway" v="residential"/><tag k="name" v="B St"/><tag k="alt_name" v="A St"/></way>' \
+              '<way id="3"><nd ref="3"/><nd ref="4"/><tag k="highway" v="residential"/></way>' \
+              '<way id="4"><nd ref="4"/><nd ref="2"/><tag k="highway" v="service"/><tag k="name" v="C Alley"/></way>' \
+              '</osm>'
+        roads = osm_to_intersections.RoadNodes(), osm_to_intersections.RoadNodeArrays()
+        for r in roads:
+            for way in osm_to_intersections.iter_elements(io.BytesIO(osm.encode()), 'way'):
+                r.add_way(way)
+            r.finish()
+            self.assertEqual(r.num_ways, 3)
+            self.assertEqual(r.num_refs, 4)
+
+        for node_id in (1, 2, 3, 4, 9, 10):
+            self.assertEqual(roads[0].names(node_id), roads[1].names(node_id))
+        self.assertEqual(roads[1].names(2), ['A St', 'B St'])
+        self.assertEqual(roads[1].names(3), ['B St', 'A St'])
+        self.assertEqual(roads[1].names(9), ['A St'])
+        self.assertIsNone(roads[1].names(4))
+
+
+class TestOsmAbbrParser(unittest.TestCase):
+
+    def setUp(self):
+        self.parser = OsmAbbrParser()
+        self.names = [n.strip() for n in osm_abbr_tester.tests if n and len(n.strip()) > 0]
+
+    def tearDown(self):
+        pass
+
+    def get_test_data_names(self):
+        """ unique street name values from the .osm files in tests/data """
+        ret_val = set()
+        data_dir = os.path.join(file_utils.get_module_dir(self.__class__), "data")
+        for f in sorted(os.listdir(data_dir)):
+            if f.endswith(".osm"):
+                for event, elem in ET.iterparse(os.path.join(data_dir, f)):
+                    if elem.tag == 'tag' and is_street_name_key(elem.get('k', ''), True) and elem.get('v'):
+                        ret_val.add(elem.get('v'))
+        return sorted(ret_val)
+
+    def test_tokenizer_matches_grammar(self):
+        """ the fast path tokenizer and the pyparsing grammar should give identical output """
+        def parse(p, name):
+            try:
+                return p.dict(name)
+            except Exception as e:
+                return "exception"
+
+        grammar_only = OsmAbbrParser(use_tokenizer=False)
+        names = self.names + self.get_test_data_names()
+        num_fast = 0
+        for n in names:
+            if self.parser.tokenizer.parse(self.parser.sub_str_replace(self.parser.str_replace, n)):
+                num_fast += 1
+            self.assertEqual(parse(self.parser, n), parse(grammar_only, n), n)
+            self.assertEqual(self.parser.to_str(n), grammar_only.to_str(n), n)
+        self.assertTrue(num_fast > len(names) / 2)
+
+    def test_replace_tables(self):
+        """ the compiled .csv lookup tables should agree with a linear scan of the .csv lists (a copied list isn't
+            in the parser's table index, so the parser falls back to the linear scan for it)
+        """
+        p = self.parser
+        words = set(w for n in self.names for w in n.split())
+        for lst in (p.street_types, p.dir_types, p.str_replace, p.str_ignore):
+            for w in words:
+                self.assertEqual(p.find_replace(lst, w), p.find_replace(list(lst), w))
+            for n in self.names:
+                self.assertEqual(p.sub_str_replace(lst, n), p.sub_str_replace(list(lst), n))
+                self.assertEqual(p.csv_ignore_replace(lst, n), p.csv_ignore_replace(list(lst), n))
+
+    def test_batch(self):
+        """ the batch apis should dedup the names, and give the same output as the one name at a time apis """
+        names = self.names[:40] * 3
+        batch = self.parser.to_str_many(names)
+        self.assertEqual(batch, dict((n, self.parser.to_str(n)) for n in names))
+        self.assertEqual(batch.num_total, len(names))
+        self.assertEqual(batch.num_unique, len(set(names)))
+        self.assertEqual(self.parser.to_str_many(iter(names), workers=2), batch)
+
+        batch = self.parser.dict_many(names)
+        self.assertEqual(batch, dict((n, self.parser.dict(n)) for n in names))
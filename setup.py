@@ -19,6 +19,8 @@ requires = [
 
 extras_require = dict(
     dev=[],
+    numpy=['numpy'],  # faster, smaller intersection extraction (osm-intersections) on big .osm files
+    arrow=['pyarrow'],  # .parquet and .arrow intersection output
 )
 
 setup(
@@ -61,6 +63,7 @@ setup(
         osm_make_raw = ott.osm.osm_cache:make_raw_osm
         osm_other_exports = ott.osm.osm_cache:OsmCache.exports
         osm_abbr_tester = ott.osm.tests.osm_abbr_tester:main
+        osm_rename_benchmark = ott.osm.tests.benchmark:main
         osm-intersections = ott.osm.intersections.osm_to_intersections:main
         osm-intersections_cache = ott.osm.osm_cache:OsmCache.intersections_cache
     """,